@@ -36,6 +36,12 @@ class SearchBackend(BaseSearchBackend):
     def remove(self, obj, commit=True):
         pass
     
+    def remove_many(self, identifiers, commit=True):
+        pass
+    
+    def iter_ids(self, model, chunk_size=1000):
+        return iter([])
+    
     def clear(self, models=[], commit=True):
         pass
     
@@ -3,7 +3,7 @@ import sys
 from django.db.models import signals
 from django.utils.encoding import force_unicode
 from haystack.fields import *
-from haystack.utils import get_identifier, get_facet_field_name
+from haystack.utils import get_identifier, get_facet_field_name, bump_generations
 
 
 class DeclarativeMetaclass(type):
@@ -177,6 +177,7 @@ class SearchIndex(object):
     def update(self):
         """Update the entire index"""
         self.backend.update(self, self.get_queryset())
+        bump_generations([self.model])
     
     def update_object(self, instance, **kwargs):
         """
@@ -186,6 +187,10 @@ class SearchIndex(object):
         # Check to make sure we want to index this first.
         if self.should_update(instance, **kwargs):
             self.backend.update(self, [instance])
+            
+            # Deferred updates bump the generation once they're searchable.
+            if not self.backend.defers_updates():
+                bump_generations([self.model])
     
     def remove_object(self, instance, **kwargs):
         """
@@ -193,10 +198,14 @@ class SearchIndex(object):
         post-delete hook.
         """
         self.backend.remove(instance)
+        
+        if not self.backend.defers_updates():
+            bump_generations([self.model])
     
     def clear(self):
         """Clear the entire index."""
         self.backend.clear(models=[self.model])
+        bump_generations([self.model])
     
     def reindex(self):
         """Completely clear the index for this model and rebuild it."""
@@ -1,10 +1,12 @@
 import datetime
+import os
+import time
 from optparse import make_option
 from django.conf import settings
 from django.core.management.base import AppCommand, CommandError
 from django.db import reset_queries
 from django.utils.encoding import smart_str
-from haystack.query import SearchQuerySet
+from haystack.utils import bump_generations, queryset_batches
 try:
     from django.utils import importlib
 except ImportError:
@@ -17,6 +19,14 @@ except NameError:
 
 DEFAULT_BATCH_SIZE = getattr(settings, 'HAYSTACK_BATCH_SIZE', 1000)
 DEFAULT_AGE = None
+DEFAULT_WORKERS = 0
+DEFAULT_CHECKPOINT = None
+
+# Marks a model as finished in a checkpoint file.
+DONE = '-'
+
+# How the time ``--age`` counts back from is written to a checkpoint file.
+CHECKPOINT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 
 class Command(AppCommand):
@@ -36,6 +46,17 @@ class Command(AppCommand):
         make_option('-r', '--remove', action='store_true', dest='remove',
             default=False, help='Remove objects from the index that are no longer present in the database.'
         ),
+        make_option('-w', '--workers', action='store', dest='workers',
+            default=DEFAULT_WORKERS, type='int',
+            help='Number of processes to index each model with, for backends that support it.'
+        ),
+        make_option('--no-count', action='store_false', dest='count',
+            default=True, help="Don't count the objects to index up front, which can be slow on large tables."
+        ),
+        make_option('-c', '--checkpoint', action='store', dest='checkpoint',
+            default=DEFAULT_CHECKPOINT, type='string',
+            help='A file to record progress in, so an interrupted run can pick up where it stopped.'
+        ),
     )
     option_list = AppCommand.option_list + base_options
     
@@ -60,6 +81,14 @@ class Command(AppCommand):
         self.age = options.get('age', DEFAULT_AGE)
         self.site = options.get('site')
         self.remove = options.get('remove', False)
+        self.workers = options.get('workers', DEFAULT_WORKERS)
+        self.count = options.get('count', True)
+        self.checkpoint = options.get('checkpoint', DEFAULT_CHECKPOINT)
+        self.since = None
+        self.progress = self.load_checkpoint()
+        
+        if self.age and self.since is None:
+            self.since = datetime.datetime.now() - datetime.timedelta(hours=self.age)
         
         if not apps:
             from django.db.models import get_app
@@ -74,8 +103,14 @@ class Command(AppCommand):
                 except:
                     # No models, no problem.
                     pass
-            
-        return super(Command, self).handle(*apps, **options)
+        
+        output = super(Command, self).handle(*apps, **options)
+        
+        # Everything's done, so the next run starts from scratch.
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        
+        return output
     
     def handle_app(self, app, **options):
         # Cause the default site to load.
@@ -102,12 +137,20 @@ class Command(AppCommand):
                     print "Skipping '%s' - no index." % model
                 continue
                 
+            model_key = "%s.%s" % (model._meta.app_label, model._meta.module_name)
+            last_pk = self.progress.get(model_key)
+            
+            if last_pk == DONE:
+                if self.verbosity >= 2:
+                    print "Skipping '%s' - already indexed." % model
+                continue
+            
             extra_lookup_kwargs = {}
             updated_field = index.get_updated_field()
             
             if self.age:
                 if updated_field:
-                    extra_lookup_kwargs['%s__gte' % updated_field] = datetime.datetime.now() - datetime.timedelta(hours=self.age)
+                    extra_lookup_kwargs['%s__gte' % updated_field] = self.since
                 else:
                     if self.verbosity >= 2:
                         print "No updated date field found for '%s' - not restricting by age." % model.__name__
@@ -115,57 +158,210 @@ class Command(AppCommand):
             # `.select_related()` seems like a good idea here but can fail on
             # nullable `ForeignKey` as well as what seems like other cases.
             qs = index.get_queryset().filter(**extra_lookup_kwargs).order_by(model._meta.pk.name)
-            total = qs.count()
-            
-            if self.verbosity >= 1:
-                print "Indexing %d %s." % (total, smart_str(model._meta.verbose_name_plural))
-            
-            pks_seen = set()
             
-            for start in range(0, total, self.batchsize):
-                end = min(start + self.batchsize, total)
+            if last_pk is not None:
+                if self.verbosity >= 1:
+                    print "Resuming %s after primary key %s." % (smart_str(model._meta.verbose_name_plural), last_pk)
                 
-                # Get a clone of the QuerySet so that the cache doesn't bloat up
-                # in memory. Useful when reindexing large amounts of data.
-                small_cache_qs = qs.all()
-                current_qs = small_cache_qs[start:end]
+                qs = qs.filter(pk__gt=last_pk)
+            
+            if self.count or self.workers > 1:
+                total = qs.count()
                 
-                for obj in current_qs:
-                    pks_seen.add(smart_str(obj.pk))
+                if self.verbosity >= 1:
+                    print "Indexing %d %s." % (total, smart_str(model._meta.verbose_name_plural))
+            else:
+                total = None
                 
+                if self.verbosity >= 1:
+                    print "Indexing %s." % smart_str(model._meta.verbose_name_plural)
+            
+            if self.workers > 1 and total > 0:
+                # The ranges aren't recorded in the checkpoint as they finish
+                # (Whoosh adds them all in one commit), so an interrupted model
+                # starts over, after any primary key an earlier run got to.
                 if self.verbosity >= 2:
-                    print "  indexing %s - %d of %d." % (start+1, end, total)
+                    print "  indexing in %d ranges of primary keys." % self.workers
                 
-                index.backend.update(index, current_qs)
-                
-                # Clear out the DB connections queries because it bloats up RAM.
+                index.backend.parallel_update(index, self.split_queryset(qs, total), self.batchsize)
                 reset_queries()
+            else:
+                start = 0
+                
+                for current_objs in queryset_batches(qs, self.batchsize):
+                    end = start + len(current_objs)
+                    
+                    if self.verbosity >= 2:
+                        if total is None:
+                            print "  indexing %s - %d." % (start+1, end)
+                        else:
+                            print "  indexing %s - %d of %d." % (start+1, end, total)
+                    
+                    index.backend.update(index, current_objs)
+                    start = end
+                    
+                    if self.checkpoint:
+                        # Only what's been written can be skipped next time.
+                        index.backend.flush()
+                        self.save_checkpoint(model_key, smart_str(current_objs[-1].pk))
+                    
+                    # Clear out the DB connections queries because it bloats up RAM.
+                    reset_queries()
+            
+            # Backends that buffer writes need to have them on disk before
+            # the index is scanned for stale documents (and before we're done).
+            index.backend.flush()
             
             if self.remove:
-                if self.age or total <= 0:
-                    # They're using a reduced set, which may not incorporate
-                    # all pks. Rebuild the list with everything.
-                    pks_seen = set()
-                    qs = index.get_queryset().values_list('pk', flat=True)
-                    total = qs.count()
-                    
-                    for pk in qs:
-                        pks_seen.add(smart_str(pk))
+                # Stream the pks stored in the index for the model & look them
+                # up in the database a batch at a time, removing the stale ones
+                # as we go. Only the ids are read on either side, so no results
+                # or objects get built & memory use doesn't grow with the size
+                # of the index. (The two can't be walked in step, because the
+                # index orders pks as strings. Thanks comments & UUIDs!)
+                # ``iter_ids`` doesn't skip anything when documents are removed
+                # part way through.
+                pks = []
                 
-                for start in range(0, total, self.batchsize):
-                    upper_bound = start + self.batchsize
-                    
-                    # Fetch a list of results.
-                    # Can't do pk range, because id's are strings (thanks comments
-                    # & UUIDs!).
-                    stuff_in_the_index = SearchQuerySet().models(model)[start:upper_bound]
+                for pk in index.backend.iter_ids(model, chunk_size=self.batchsize):
+                    pks.append(pk)
                     
-                    # Iterate over those results.
-                    for result in stuff_in_the_index:
-                        # Be careful not to hit the DB.
-                        if not smart_str(result.pk) in pks_seen:
-                            # The id is NOT in the small_cache_qs, issue a delete.
-                            if self.verbosity >= 2:
-                                print "  removing %s." % result.pk
-                            
-                            index.backend.remove(".".join([result.app_label, result.model_name, result.pk]))
+                    if len(pks) >= self.batchsize:
+                        self.remove_stale(index, model, pks)
+                        pks = []
+                
+                if pks:
+                    self.remove_stale(index, model, pks)
+                
+                index.backend.flush()
+            
+            # Anything cached for this model is now potentially stale.
+            bump_generations([model])
+            
+            if self.checkpoint:
+                self.save_checkpoint(model_key, DONE)
+    
+    def checkpoint_options(self):
+        """
+        The options a checkpoint is only good for, as they're written to it.
+        """
+        return {
+            '--age': self.age and str(self.age) or '',
+            '--site': self.site or '',
+        }
+    
+    def load_checkpoint(self):
+        """
+        Reads how far each model got from the checkpoint file, as a dict of
+        the last primary key indexed (or ``DONE``) by ``app_label.model``.
+        
+        The run resumes with the same ``--age`` cutoff. Resuming with a
+        different ``--age`` or ``--site`` is refused, as the progress recorded
+        was through a different set of objects.
+        """
+        progress = {}
+        options = {}
+        
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return progress
+        
+        checkpoint_file = open(self.checkpoint)
+        
+        try:
+            for line in checkpoint_file:
+                key, value = line.rstrip('\n').split(' ', 1)
+                
+                if key.startswith('--'):
+                    options[key] = value
+                else:
+                    progress[key] = value
+        finally:
+            checkpoint_file.close()
+        
+        for option, value in self.checkpoint_options().items():
+            if options.get(option, '') != value:
+                raise CommandError("The checkpoint in '%s' was recorded with %s '%s'. Run with the same options to resume, or remove it to start over." % (self.checkpoint, option, options.get(option, '')))
+        
+        if options.get('--since'):
+            self.since = datetime.datetime(*time.strptime(options['--since'], CHECKPOINT_TIME_FORMAT)[:6])
+        
+        return progress
+    
+    def save_checkpoint(self, model_key, last_pk):
+        """
+        Records how far a model has got. The file is replaced in one go, so
+        an interruption can't leave it half written.
+        """
+        self.progress[model_key] = last_pk
+        temp_path = "%s.tmp" % self.checkpoint
+        checkpoint_file = open(temp_path, 'w')
+        
+        try:
+            options = self.checkpoint_options()
+            
+            if self.since is not None:
+                options['--since'] = self.since.strftime(CHECKPOINT_TIME_FORMAT)
+            
+            for key in sorted(options):
+                checkpoint_file.write("%s %s\n" % (key, options[key]))
+            
+            for key in sorted(self.progress):
+                checkpoint_file.write("%s %s\n" % (key, self.progress[key]))
+        finally:
+            checkpoint_file.close()
+        
+        os.rename(temp_path, self.checkpoint)
+    
+    def remove_stale(self, index, model, pks):
+        """
+        Removes the documents for those ``pks`` (as read from the index) which
+        are no longer in the index's queryset.
+        """
+        stale_identifiers = self.find_stale(index, model, pks)
+        
+        if self.verbosity >= 2:
+            for identifier in stale_identifiers:
+                print "  removing %s." % identifier.split('.')[-1]
+        
+        # The ids are NOT in the database, so delete them all at once.
+        if stale_identifiers:
+            index.backend.remove_many(stale_identifiers)
+    
+    def find_stale(self, index, model, pks):
+        """
+        Returns the identifiers of those ``pks`` (as read from the index)
+        which are no longer in the index's queryset.
+        """
+        pks_seen = set()
+        
+        for pk in index.get_queryset().filter(pk__in=pks).values_list('pk', flat=True):
+            pks_seen.add(smart_str(pk))
+        
+        reset_queries()
+        return [".".join([model._meta.app_label, model._meta.module_name, pk]) for pk in pks if not pk in pks_seen]
+    
+    def split_queryset(self, qs, total):
+        """
+        Splits ``qs`` (ordered by primary key) into one queryset per worker,
+        each covering a contiguous range of primary keys with about the same
+        number of objects.
+        """
+        step = (total + self.workers - 1) // self.workers
+        pks = qs.values_list('pk', flat=True)
+        bounds = [pks[start] for start in range(step, total, step)]
+        querysets = []
+        lower = None
+        
+        for upper in bounds + [None]:
+            range_kwargs = {}
+            
+            if lower is not None:
+                range_kwargs['pk__gte'] = lower
+            
+            if upper is not None:
+                range_kwargs['pk__lt'] = upper
+            
+            querysets.append(qs.filter(**range_kwargs))
+            lower = upper
+        
+        return querysets
@@ -6,6 +6,33 @@ from django.utils.encoding import force_unicode
 from django.utils.text import capfirst
 
 
+class ResultConverter(object):
+    """
+    Describes how to turn the raw document a backend returned for one model
+    into Python values.
+    
+    ``converters`` maps field names to callables; any other field is passed
+    through ``default`` (or left as-is if that is ``None``). Fields named in
+    ``exclude`` are bookkeeping for the backend and are never exposed on the
+    result.
+    """
+    def __init__(self, converters, default=None, exclude=()):
+        self.converters = converters
+        self.default = default
+        self.exclude = frozenset(exclude)
+    
+    def field_names(self, raw_fields):
+        return [str(key) for key in raw_fields if not key in self.exclude]
+    
+    def convert(self, key, value):
+        converter = self.converters.get(key, self.default)
+        
+        if converter is None:
+            return value
+        
+        return converter(value)
+
+
 # Not a Django model, but tightly tied to them and there doesn't seem to be a
 # better spot in the tree.
 class SearchResult(object):
@@ -13,28 +40,53 @@ class SearchResult(object):
     A single search result. The actual object is loaded lazily by accessing
     object; until then this object only stores the model, pk, and score.
     
+    Results are slotted so that large pages stay cheap. Fields handed over by
+    a backend through ``_set_raw_fields`` are kept in their raw form and only
+    converted the first time they are accessed. Any other attribute set on a
+    result is kept alongside its fields.
+    
     Note that iterating over SearchResults and getting the object for each
     result will do O(N) database queries, which may not fit your needs for
     performance.
     """
+    __slots__ = ('app_label', 'model_name', 'pk', 'score', '_object', '_model',
+                 '_verbose_name', '_stored_fields', '_fields', '_raw_fields',
+                 '_converter')
+    
+    # Names that additional fields may not shadow.
+    RESERVED_NAMES = frozenset(__slots__ + ('_additional_fields', 'stored_fields', 'log'))
+    
+    log = logging.getLogger('haystack')
+    
     def __init__(self, app_label, model_name, pk, score, **kwargs):
-        self.app_label, self.model_name = app_label, model_name
-        self.pk = pk
-        self.score = score
-        self._object = None
-        self._model = None
-        self._verbose_name = None
-        self._additional_fields = []
-        self.stored_fields = None
-        self.log = self._get_log()
-        
-        for key, value in kwargs.items():
-            if not key in self.__dict__:
-                self.__dict__[key] = value
-                self._additional_fields.append(key)
-    
-    def _get_log(self):
-        return logging.getLogger('haystack')
+        # Slots are set directly, skipping ``__setattr__``. The rest read as
+        # ``None`` until they're set.
+        set_slot = object.__setattr__
+        set_slot(self, 'app_label', app_label)
+        set_slot(self, 'model_name', model_name)
+        set_slot(self, 'pk', pk)
+        set_slot(self, 'score', score)
+        
+        # Most results never see a converted field, so the dict is only
+        # created once there's something to put in it.
+        if kwargs:
+            fields = {}
+            
+            for key, value in kwargs.items():
+                if not key in self.RESERVED_NAMES:
+                    fields[key] = value
+            
+            set_slot(self, '_fields', fields)
+        else:
+            set_slot(self, '_fields', None)
+    
+    def _set_raw_fields(self, raw_fields, converter):
+        """
+        Attaches the raw document from the backend. Each field is run through
+        ``converter`` the first time it is read.
+        """
+        self._raw_fields = raw_fields
+        self._converter = converter
     
     def __repr__(self):
         return "<SearchResult: %s.%s (pk=%r)>" % (self.app_label, self.model_name, self.pk)
@@ -42,11 +94,40 @@ class SearchResult(object):
     def __unicode__(self):
         return force_unicode(self.__repr__())
     
+    def __setattr__(self, attr, value):
+        # Anything other than a slot or property (like an annotation made by
+        # user code) is kept with the fields, as if results had a __dict__.
+        if attr in SearchResult.__slots__ or hasattr(type(self), attr):
+            object.__setattr__(self, attr, value)
+            return
+        
+        if self._fields is None:
+            object.__setattr__(self, '_fields', {})
+        
+        self._fields[attr] = value
+    
     def __getattr__(self, attr):
-        if attr == '__getnewargs__':
-            raise AttributeError
+        # Special methods must not fall through to the fields, and unset
+        # slots are ``None``.
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        
+        if attr in SearchResult.__slots__:
+            return None
+        
+        if self._fields is not None and attr in self._fields:
+            return self._fields[attr]
+        
+        if self._raw_fields is not None and attr in self._raw_fields and not attr in self._converter.exclude:
+            value = self._converter.convert(attr, self._raw_fields[attr])
+            
+            if self._fields is None:
+                self._fields = {}
+            
+            self._fields[attr] = value
+            return value
         
-        return self.__dict__.get(attr, None)
+        return None
     
     def _get_object(self):
         if self._object is None:
@@ -113,9 +194,14 @@ class SearchResult(object):
         aware of.
         """
         additional_fields = {}
+        fieldnames = list(self._fields or ())
         
-        for fieldname in self._additional_fields:
-            additional_fields[fieldname] = getattr(self, fieldname)
+        if self._raw_fields is not None:
+            fieldnames.extend(self._converter.field_names(self._raw_fields))
+        
+        for fieldname in fieldnames:
+            if not fieldname in self.RESERVED_NAMES:
+                additional_fields[fieldname] = getattr(self, fieldname)
         
         return additional_fields
     
@@ -151,15 +237,31 @@ class SearchResult(object):
         Returns a dictionary representing the ``SearchResult`` in order to
         make it pickleable.
         """
-        # The ``log`` is excluded because, under the hood, ``logging`` uses
-        # ``threading.Lock``, which doesn't pickle well.
-        ret_dict = self.__dict__.copy()
-        del(ret_dict['log'])
+        # Converters are usually bound methods, which don't pickle, so any
+        # fields still in their raw form are converted first.
+        ret_dict = {}
+        
+        for name in SearchResult.__slots__:
+            ret_dict[name] = getattr(self, name, None)
+        
+        ret_dict['_fields'] = self.get_additional_fields()
+        ret_dict['_raw_fields'] = None
+        ret_dict['_converter'] = None
+        
+        if hasattr(self, '__dict__'):
+            ret_dict.update(self.__dict__)
+        
         return ret_dict
     
     def __setstate__(self, d):
         """
         Updates the object's attributes according to data passed by pickle.
         """
-        self.__dict__.update(d)
-        self.log = self._get_log()
+        # The slots go first, so ``_fields`` is in place for anything else.
+        for key in SearchResult.__slots__:
+            if key in d:
+                setattr(self, key, d[key])
+        
+        for key, value in d.items():
+            if not key in SearchResult.__slots__:
+                setattr(self, key, value)
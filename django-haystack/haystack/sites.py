@@ -21,6 +21,7 @@ class SearchSite(object):
     def __init__(self):
         self._registry = {}
         self._cached_field_mapping = None
+        self._cached_result_converters = {}
     
     def register(self, model, index_class=None):
         """
@@ -43,6 +44,7 @@ class SearchSite(object):
         
         self._registry[model] = index_class(model)
         self._setup(model, self._registry[model])
+        self._cached_result_converters = {}
     
     def unregister(self, model):
         """
@@ -52,6 +54,7 @@ class SearchSite(object):
             raise NotRegistered('The model %s is not registered' % model.__class__)
         self._teardown(model, self._registry[model])
         del(self._registry[model])
+        self._cached_result_converters = {}
     
     def _setup(self, model, index):
         index._setup_save(model)
@@ -75,6 +78,30 @@ class SearchSite(object):
         """Provide a list of all models being indexed."""
         return self._registry.keys()
     
+    def get_result_converter(self, django_ct, backend):
+        """
+        Provides the model and ``ResultConverter`` for hits with the given
+        ``django_ct`` coming back from ``backend``.
+        
+        Returns ``(None, None)`` if the model isn't registered. Converters are
+        built once per backend class & cached until the registry changes, so
+        backends don't have to inspect the index for every hit.
+        """
+        key = (backend.__class__, django_ct)
+        
+        if not key in self._cached_result_converters:
+            model, converter = None, None
+            
+            for indexed_model, index in self._registry.items():
+                if django_ct.lower() == u"%s.%s" % (indexed_model._meta.app_label, indexed_model._meta.module_name):
+                    model = indexed_model
+                    converter = backend.build_result_converter(index)
+                    break
+            
+            self._cached_result_converters[key] = (model, converter)
+        
+        return self._cached_result_converters[key]
+    
     def all_searchfields(self):
         """
         Builds a dictionary of all fields appearing in any of the `SearchIndex`
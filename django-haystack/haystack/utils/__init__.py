@@ -1,4 +1,9 @@
+import random
 import re
+import sys
+import threading
+from django.conf import settings
+from django.core.cache import cache
 from django.utils.html import strip_tags
 try:
     set
@@ -7,6 +12,7 @@ except NameError:
 
 
 IDENTIFIER_REGEX = re.compile('^[\w\d_]+\.[\w\d_]+\.\d+$')
+GENERATION_KEY_PREFIX = 'haystack_generation'
 
 
 def get_identifier(obj_or_string):
@@ -32,6 +38,160 @@ def get_facet_field_name(fieldname):
     return "%s_exact" % fieldname
 
 
+def get_generation_key(model):
+    """
+    Returns the cache key that holds the index generation for a model.
+    """
+    return "%s.%s.%s" % (GENERATION_KEY_PREFIX, model._meta.app_label, model._meta.module_name)
+
+
+def _new_generation():
+    # Start counters somewhere unlikely to collide with a generation handed
+    # out before the key was evicted from the cache.
+    return random.randint(1, 2 ** 31)
+
+
+def get_generations(models):
+    """
+    Returns the current index generation for each of the provided models.
+    
+    A model's generation changes whenever its documents in the index do, so
+    it can be used as part of a cache key for anything derived from the index.
+    """
+    keys = [get_generation_key(model) for model in models]
+    generations = cache.get_many(keys)
+    
+    for key in keys:
+        if generations.get(key) is None:
+            cache.add(key, _new_generation())
+            generations[key] = cache.get(key)
+    
+    return [generations[key] for key in keys]
+
+
+def bump_generations(models):
+    """
+    Marks the index data for the provided models as changed, invalidating any
+    cached search results that involved them.
+    
+    Does nothing unless ``HAYSTACK_RESULT_CACHE_TIMEOUT`` is set.
+    """
+    if not getattr(settings, 'HAYSTACK_RESULT_CACHE_TIMEOUT', None):
+        return
+    
+    for model in models:
+        key = get_generation_key(model)
+        
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The key is gone. Any fresh value will do.
+            cache.set(key, _new_generation())
+
+
+def bump_identifier_generations(identifiers):
+    """
+    Bumps the generations of the models the provided identifiers (like
+    ``app_label.model_name.pk``) belong to.
+    """
+    if not getattr(settings, 'HAYSTACK_RESULT_CACHE_TIMEOUT', None):
+        return
+    
+    from django.db.models import get_model
+    models = set()
+    
+    for identifier in identifiers:
+        app_label, model_name = identifier.split('.')[:2]
+        model = get_model(app_label, model_name)
+        
+        if model is not None:
+            models.add(model)
+    
+    bump_generations(list(models))
+
+
+def queryset_batches(qs, batch_size):
+    """
+    Yields the objects in ``qs`` in lists of up to ``batch_size``, in primary
+    key order.
+    
+    Each batch picks up after the last primary key of the one before, rather
+    than at an offset, so the database can go straight to it & later batches
+    are as quick as the first.
+    """
+    qs = qs.order_by(qs.model._meta.pk.name)
+    after_pk = None
+    
+    while True:
+        # Get a clone of the QuerySet so that the cache doesn't bloat up
+        # in memory. Useful when reindexing large amounts of data.
+        batch_qs = qs.all()
+        
+        if after_pk is not None:
+            batch_qs = batch_qs.filter(pk__gt=after_pk)
+        
+        batch = list(batch_qs[:batch_size])
+        
+        if not batch:
+            return
+        
+        yield batch
+        
+        if len(batch) < batch_size:
+            return
+        
+        after_pk = batch[-1].pk
+
+
+def run_threaded(func, items, max_threads):
+    """
+    Calls ``func`` on each of the provided items using up to ``max_threads``
+    threads, returning the results in the same order as the items.
+    
+    If any call raises an exception, no further items are started and the
+    first exception is re-raised once the running calls have finished.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    
+    if max_threads <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    
+    positions = iter(range(len(items)))
+    lock = threading.Lock()
+    errors = []
+    
+    def worker():
+        while not errors:
+            lock.acquire()
+            
+            try:
+                try:
+                    position = positions.next()
+                except StopIteration:
+                    return
+            finally:
+                lock.release()
+            
+            try:
+                results[position] = func(items[position])
+            except:
+                errors.append(sys.exc_info())
+    
+    threads = [threading.Thread(target=worker) for i in range(min(max_threads, len(items)))]
+    
+    for thread in threads:
+        thread.start()
+    
+    for thread in threads:
+        thread.join()
+    
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    
+    return results
+
+
 class Highlighter(object):
     css_class = 'highlighted'
     html_tag = 'span'
@@ -98,6 +98,21 @@ class MixedMockSearchBackend(MockSearchBackend):
         return result_info
 
 
+class LargeMockSearchBackend(MockSearchBackend):
+    """Fabricates only the requested page of a very large result set."""
+    hit_count = 500000
+    
+    @log_query
+    def search(self, query_string, start_offset=0, end_offset=None, **kwargs):
+        if end_offset is None or end_offset > self.hit_count:
+            end_offset = self.hit_count
+        
+        return {
+            'results': [SearchResult('core', 'mockmodel', i, 1.0) for i in xrange(start_offset, end_offset)],
+            'hits': self.hit_count,
+        }
+
+
 class MockSearchQuery(BaseSearchQuery):
     def build_query(self):
         return ''
@@ -1,7 +1,7 @@
 import logging
 import pickle
 from django.test import TestCase
-from haystack.models import SearchResult
+from haystack.models import ResultConverter, SearchResult
 from core.models import MockModel
 from core.tests.mocks import MockSearchResult
 
@@ -129,6 +129,48 @@ class SearchResultTestCase(TestCase):
         self.assertEqual(awol2.stored, None)
         self.assertEqual(len(CaptureHandler.logs_seen), 9)
     
+    def test_raw_fields(self):
+        converted = []
+        
+        def to_int(value):
+            converted.append(value)
+            return int(value)
+        
+        converter = ResultConverter({'count': to_int}, default=unicode, exclude=('django_ct', 'django_id'))
+        lazy_sr = SearchResult('core', 'mockmodel', '1', 2, highlighted='<em>1</em>')
+        lazy_sr._set_raw_fields({'django_ct': 'core.mockmodel', 'django_id': '1', 'count': '5', 'name': 'daniel'}, converter)
+        
+        # Nothing is converted until it's asked for.
+        self.assertEqual(converted, [])
+        self.assertEqual(lazy_sr.count, 5)
+        self.assertEqual(lazy_sr.count, 5)
+        self.assertEqual(converted, ['5'])
+        self.assertEqual(lazy_sr.name, u'daniel')
+        self.assertEqual(lazy_sr.highlighted, '<em>1</em>')
+        
+        # Backend bookkeeping stays hidden.
+        self.assertEqual(lazy_sr.django_ct, None)
+        self.assertEqual(lazy_sr.missing, None)
+        self.assertEqual(lazy_sr.get_additional_fields(), {'count': 5, 'name': u'daniel', 'highlighted': '<em>1</em>'})
+        
+        # Results don't carry a ``__dict__``, but can still be annotated, or
+        # have their fields changed.
+        self.assertFalse(hasattr(lazy_sr, '__dict__'))
+        lazy_sr.distance = 3
+        lazy_sr.name = u'johnny'
+        self.assertEqual(lazy_sr.distance, 3)
+        self.assertEqual(lazy_sr.name, u'johnny')
+        self.assertEqual(lazy_sr.get_additional_fields(), {'count': 5, 'name': u'johnny', 'highlighted': '<em>1</em>', 'distance': 3})
+        
+        unpickled = pickle.loads(pickle.dumps(lazy_sr))
+        self.assertEqual(unpickled.distance, 3)
+        self.assertEqual(unpickled.name, u'johnny')
+        
+        no_fields_sr = SearchResult('core', 'mockmodel', '1', 2)
+        no_fields_sr.distance = 3
+        self.assertEqual(no_fields_sr.distance, 3)
+        self.assertEqual(no_fields_sr.get_additional_fields(), {'distance': 3})
+    
     def test_pickling(self):
         pickle_me_1 = SearchResult('core', 'mockmodel', '1000000', 2)
         picklicious = pickle.dumps(pickle_me_1)
@@ -138,3 +180,10 @@ class SearchResultTestCase(TestCase):
         self.assertEqual(pickle_me_1.model_name, pickle_me_2.model_name)
         self.assertEqual(pickle_me_1.pk, pickle_me_2.pk)
         self.assertEqual(pickle_me_1.score, pickle_me_2.score)
+        
+        lazy_sr = SearchResult('core', 'mockmodel', '1', 2)
+        lazy_sr._set_raw_fields({'django_id': '1', 'count': '5'}, ResultConverter({'count': int}, exclude=('django_id',)))
+        unpickled_sr = pickle.loads(pickle.dumps(lazy_sr))
+        self.assertEqual(unpickled_sr.count, 5)
+        self.assertEqual(unpickled_sr.get_additional_fields(), {'count': 5})
+        self.assertEqual(unpickled_sr._raw_fields, None)
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 import datetime
+import threading
+import time
 from django.conf import settings
+from django.db import connection, reset_queries
 from django.test import TestCase
 import haystack
 from haystack import backends
@@ -9,10 +12,11 @@ from haystack.backends.dummy_backend import SearchBackend as DummySearchBackend
 from haystack.backends.dummy_backend import SearchQuery as DummySearchQuery
 from haystack.exceptions import HaystackError, FacetingError, NotRegistered
 from haystack.models import SearchResult
-from haystack.query import SearchQuerySet, EmptySearchQuerySet
+from haystack.query import SearchQuerySet, EmptySearchQuerySet, multi_search
 from haystack.sites import SearchSite
 from core.models import MockModel, AnotherMockModel, CharPKMockModel
-from core.tests.mocks import MockSearchQuery, MockSearchBackend, CharPKMockSearchBackend, MixedMockSearchBackend, MOCK_SEARCH_RESULTS
+from core.tests.indexes import GoodCustomMockSearchIndex
+from core.tests.mocks import MockSearchQuery, MockSearchBackend, CharPKMockSearchBackend, MixedMockSearchBackend, LargeMockSearchBackend, MOCK_SEARCH_RESULTS
 try:
     set
 except NameError:
@@ -268,6 +272,42 @@ class BaseSearchQueryTestCase(TestCase):
         haystack.site = old_site
         settings.DEBUG = old_debug
     
+    def test_get_count_only(self):
+        backends.reset_search_queries()
+        
+        # Stow.
+        old_site = haystack.site
+        old_debug = settings.DEBUG
+        test_site = SearchSite()
+        test_site.register(MockModel)
+        haystack.site = test_site
+        settings.DEBUG = True
+        
+        # Only the count is fetched, leaving the results & offsets alone.
+        msq = MockSearchQuery(backend=MockSearchBackend())
+        self.assertEqual(msq.get_count(), 100)
+        self.assertEqual(msq._results, None)
+        self.assertEqual(msq.end_offset, None)
+        self.assertEqual(len(backends.queries), 1)
+        
+        # Cached on the query.
+        self.assertEqual(msq.get_count(), 100)
+        self.assertEqual(len(backends.queries), 1)
+        
+        # Running the query for results afterward still works.
+        self.assertEqual(len(msq.get_results()), 100)
+        self.assertEqual(len(backends.queries), 2)
+        
+        # Raw queries take the same path.
+        msq2 = MockSearchQuery(backend=MockSearchBackend())
+        msq2.raw_search('foo')
+        self.assertEqual(msq2.get_count(), 100)
+        self.assertEqual(msq2._results, None)
+        
+        # Restore.
+        haystack.site = old_site
+        settings.DEBUG = old_debug
+    
     def test_regression_site_kwarg(self):
         # Stow.
         test_site = SearchSite()
@@ -362,8 +402,8 @@ class SearchQuerySetTestCase(TestCase):
         # This will hang indefinitely if broken.
         results = self.mmsqs.all()
         loaded = [result.pk for result in results._manual_iter()]
-        self.assertEqual(loaded, [0, 1, 2, 3, 4, 5, 6, 7, 8, 10, 11, 12, 15, 16, 17, 18, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29])
-        self.assertEqual(len(backends.queries), 8)
+        self.assertEqual(loaded, [0, 1, 2, 3, 4, 5, 6, 7, 8, 10, 11, 12, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29])
+        self.assertEqual(len(backends.queries), 6)
     
     def test_fill_cache(self):
         backends.reset_search_queries()
@@ -414,6 +454,141 @@ class SearchQuerySetTestCase(TestCase):
         self.assertEqual(results._cache_is_full(), True)
         self.assertEqual(len(backends.queries), 10)
     
+    def test_sparse_cache(self):
+        backends.reset_search_queries()
+        results = self.msqs.all()
+        
+        # Jumping deep into the results only loads the requested page.
+        self.assertEqual(results[90:95], MOCK_SEARCH_RESULTS[90:95])
+        self.assertEqual(len(results._result_cache), 5)
+        self.assertEqual(len(results._result_cache.blocks), 1)
+        self.assertEqual(len(backends.queries), 1)
+        
+        # Overlapping slices only fetch what's missing.
+        self.assertEqual(results[85:95], MOCK_SEARCH_RESULTS[85:95])
+        self.assertEqual(len(results._result_cache), 10)
+        self.assertEqual(len(backends.queries), 2)
+        self.assertEqual(results[88], MOCK_SEARCH_RESULTS[88])
+        self.assertEqual(len(backends.queries), 2)
+        
+        # Iteration picks up around the cached section.
+        self.assertEqual([result for result in results], MOCK_SEARCH_RESULTS)
+        self.assertEqual(results._cache_is_full(), True)
+        
+        try:
+            results[100]
+            self.fail()
+        except IndexError:
+            pass
+    
+    def test_iter_large_result_set(self):
+        # The cache should stay proportional to the page being loaded, no
+        # matter how many hits the backend claims. Iterating over 500k hits
+        # was effectively quadratic with the old count-sized list of ``None``s.
+        settings.DEBUG = False
+        results = SearchQuerySet(query=MockSearchQuery(backend=LargeMockSearchBackend()))
+        
+        self.assertEqual(len(results), 500000)
+        self.assertEqual(len(results._result_cache.blocks), 0)
+        
+        start = time.time()
+        seen = 0
+        
+        for result in results:
+            seen += 1
+        
+        elapsed = time.time() - start
+        self.assertEqual(seen, 500000)
+        self.assertEqual(len(results._result_cache), 500000)
+        self.assertEqual(results._cache_is_full(), True)
+        # Generous, but the old behavior didn't finish in any sane time.
+        self.assert_(elapsed < 120, "Iterating over 500k hits took %.2fs." % elapsed)
+        
+        # A slice deep into the results is a single page load.
+        results = SearchQuerySet(query=MockSearchQuery(backend=LargeMockSearchBackend()))
+        self.assertEqual([result.pk for result in results[499990:500000]], range(499990, 500000))
+        self.assertEqual(len(results._result_cache.blocks), 1)
+    
+    def test_iterator(self):
+        sqs = self.msqs.all()
+        self.assertEqual([result.pk for result in sqs.iterator(chunk_size=30)], range(100))
+        
+        # Nothing was cached. One query for the count, then one per chunk.
+        self.assertEqual(len(sqs._result_cache), 0)
+        self.assertEqual(sqs.query.has_run(), False)
+        self.assertEqual(len(backends.queries), 5)
+        
+        # Objects are loaded per chunk & missing ones are skipped.
+        self.assertEqual([result.object.id for result in self.msqs.load_all().iterator(chunk_size=2)], [1, 2, 3])
+        
+        # Limits on the query are respected.
+        msq = MockSearchQuery(backend=MockSearchBackend())
+        msq.set_limits(10, 25)
+        self.assertEqual([[result.pk for result in chunk] for chunk in msq.iter_results(chunk_size=10)], [range(10, 20), range(20, 25)])
+        
+        self.assertEqual(list(EmptySearchQuerySet().iterator()), [])
+    
+    def test_iterator_large_result_set(self):
+        # Memory stays flat no matter how far into the results we get.
+        settings.DEBUG = False
+        results = SearchQuerySet(query=MockSearchQuery(backend=LargeMockSearchBackend()))
+        start = time.time()
+        seen = 0
+        
+        for result in results.iterator(chunk_size=1000):
+            seen += 1
+            
+            if seen == 100000:
+                break
+        
+        elapsed = time.time() - start
+        self.assertEqual(len(results._result_cache), 0)
+        self.assertEqual(len(results._result_cache.blocks), 0)
+        self.assert_(elapsed < 60, "Streaming 100k hits took %.2fs." % elapsed)
+    
+    def test_result_cache(self):
+        old_timeout = getattr(settings, 'HAYSTACK_RESULT_CACHE_TIMEOUT', None)
+        settings.HAYSTACK_RESULT_CACHE_TIMEOUT = 60
+        
+        try:
+            # Use a backend that knows about the test site's models.
+            self.msqs = SearchQuerySet(query=MockSearchQuery(backend=MockSearchBackend()))
+            backends.reset_search_queries()
+            self.assertEqual([result.pk for result in self.msqs.all()[0:10]], range(0, 10))
+            self.assertEqual(len(backends.queries), 1)
+            
+            # The same search in a new ``SearchQuerySet`` comes from the cache.
+            self.assertEqual([result.pk for result in self.msqs.all()[0:10]], range(0, 10))
+            self.assertEqual(len(backends.queries), 1)
+            
+            # Different params mean a different search.
+            self.assertEqual([result.pk for result in self.msqs.all()[10:20]], range(10, 20))
+            self.assertEqual(len(backends.queries), 2)
+            
+            # Reindexing a model invalidates what's cached.
+            mock = MockModel()
+            mock.id = 1
+            mock.author = 'daniel'
+            mock.pub_date = datetime.datetime(2009, 2, 25, 1, 1)
+            haystack.site.get_index(MockModel).update_object(mock)
+            self.assertEqual([result.pk for result in self.msqs.all()[0:10]], range(0, 10))
+            self.assertEqual(len(backends.queries), 3)
+            self.assertEqual([result.pk for result in self.msqs.all()[0:10]], range(0, 10))
+            self.assertEqual(len(backends.queries), 3)
+            
+            # As does removing it.
+            haystack.site.get_index(MockModel).remove_object(mock)
+            self.assertEqual([result.pk for result in self.msqs.all()[0:10]], range(0, 10))
+            self.assertEqual(len(backends.queries), 4)
+        finally:
+            settings.HAYSTACK_RESULT_CACHE_TIMEOUT = old_timeout
+        
+        # Disabled, every search hits the backend.
+        backends.reset_search_queries()
+        self.assertEqual([result.pk for result in self.msqs.all()[0:10]], range(0, 10))
+        self.assertEqual([result.pk for result in self.msqs.all()[0:10]], range(0, 10))
+        self.assertEqual(len(backends.queries), 2)
+    
     def test_all(self):
         sqs = self.bsqs.all()
         self.assert_(isinstance(sqs, SearchQuerySet))
@@ -496,6 +671,110 @@ class SearchQuerySetTestCase(TestCase):
         
         # For full tests, see the solr_backend.
     
+    def test_load_all_uses_load_all_queryset(self):
+        # ``GoodCustomMockSearchIndex`` only loads objects with an id over 1.
+        test_site = SearchSite()
+        test_site.register(MockModel, GoodCustomMockSearchIndex)
+        haystack.site = test_site
+        
+        sqs = SearchQuerySet(query=MockSearchQuery(backend=MockSearchBackend())).load_all()
+        self.assertEqual([result.object.id for result in sqs[0:10]], [2, 3])
+    
+    def test_load_all_related(self):
+        sqs = self.msqs.load_all_related('tag')
+        self.assert_(isinstance(sqs, SearchQuerySet))
+        self.assertEqual(sqs._load_all, True)
+        self.assertEqual(sqs._load_all_related, ('tag',))
+        self.assertEqual(sqs.load_all_related('tag__name')._load_all_related, ('tag', 'tag__name'))
+        
+        # Lookups only apply to models that have the field.
+        self.assertEqual(sqs._related_lookups(MockModel), ['tag'])
+        self.assertEqual(sqs._related_lookups(AnotherMockModel), [])
+        
+        # The page & its relations come back in a single query.
+        reset_queries()
+        results = sqs[0:10]
+        self.assertEqual(len(connection.queries), 1)
+        self.assertEqual([result.object.tag.name for result in results], [u'primary', u'primary', u'secondary'])
+        self.assertEqual(len(connection.queries), 1)
+    
+    def test_load_all_threads(self):
+        calls = []
+        
+        class RecordingSearchQuerySet(SearchQuerySet):
+            def _load_model_objects(self, model, pks):
+                calls.append((model, threading.currentThread()))
+                
+                if model is AnotherMockModel:
+                    raise ValueError("Boom.")
+                
+                return dict([(pk, model(pk=pk)) for pk in pks])
+        
+        sqs = RecordingSearchQuerySet(query=MockSearchQuery(backend=MockSearchBackend()))
+        models_pks = {
+            MockModel: [1, 2],
+            CharPKMockModel: ['sometext'],
+        }
+        
+        # By default, everything happens in the calling thread.
+        loaded = sqs._load_objects(models_pks)
+        self.assertEqual(sorted(loaded[MockModel].keys()), [1, 2])
+        self.assertEqual(loaded[CharPKMockModel].keys(), ['sometext'])
+        self.assertEqual([thread for model, thread in calls], [threading.currentThread()] * 2)
+        
+        # Stow.
+        old_threads = getattr(settings, 'HAYSTACK_LOAD_ALL_THREADS', 1)
+        settings.HAYSTACK_LOAD_ALL_THREADS = 2
+        
+        try:
+            calls = []
+            loaded = sqs._load_objects(models_pks)
+            self.assertEqual(sorted(loaded[MockModel].keys()), [1, 2])
+            self.assertEqual(loaded[CharPKMockModel].keys(), ['sometext'])
+            self.assertEqual(len(calls), 2)
+            self.failIf(threading.currentThread() in [thread for model, thread in calls])
+            
+            # Errors in the workers make it back to the caller.
+            models_pks[AnotherMockModel] = [1]
+            self.assertRaises(ValueError, sqs._load_objects, models_pks)
+        finally:
+            # Restore.
+            settings.HAYSTACK_LOAD_ALL_THREADS = old_threads
+    
+    def test_multi_search(self):
+        batch = multi_search([self.msqs, self.mmsqs.all(), EmptySearchQuerySet()])
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch[0], self.msqs)
+        
+        # Each query ran once & the first page of each cache is filled.
+        self.assertEqual(len(backends.queries), 3)
+        self.assertEqual(len(self.msqs._result_cache), 10)
+        self.assertEqual([result.pk for result in self.msqs[0:10]], range(10))
+        self.assertEqual(len(batch[1]._result_cache), 9)
+        self.assertEqual(len(self.msqs), 100)
+        self.assertEqual(len(batch[1]), 30)
+        self.assertEqual(self.msqs.facet_counts(), {})
+        self.assertEqual(len(batch[2]), 0)
+        self.assertEqual(len(backends.queries), 3)
+        
+        # Other windows can be requested.
+        sqs = multi_search([self.msqs.all()], start=20, end=25)[0]
+        self.assertEqual([result.pk for result in sqs[20:25]], range(20, 25))
+        self.assertEqual(len(backends.queries), 4)
+        
+        # Each backend gets its queries in one batch.
+        batches = []
+        
+        class BatchingMockSearchBackend(MockSearchBackend):
+            def run_batch(self, queries):
+                batches.append(len(queries))
+                super(BatchingMockSearchBackend, self).run_batch(queries)
+        
+        querysets = [SearchQuerySet(query=MockSearchQuery(backend=BatchingMockSearchBackend())) for i in xrange(3)]
+        multi_search(querysets + [self.msqs.all()])
+        self.assertEqual(batches, [3])
+        self.assertEqual([len(sqs._result_cache) for sqs in querysets], [10, 10, 10])
+    
     def test_auto_query(self):
         sqs = self.bsqs.auto_query('test search -stuff')
         self.assert_(isinstance(sqs, SearchQuerySet))
@@ -590,7 +869,7 @@ class SearchQuerySetTestCase(TestCase):
         self.assert_(isinstance(clone, SearchQuerySet))
         self.assertEqual(clone.site, results.site)
         self.assertEqual(str(clone.query), str(results.query))
-        self.assertEqual(clone._result_cache, [])
+        self.assertEqual(len(clone._result_cache), 0)
         self.assertEqual(clone._result_count, None)
         self.assertEqual(clone._cache_full, False)
     
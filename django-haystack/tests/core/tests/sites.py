@@ -1,5 +1,6 @@
 import datetime
 from django.test import TestCase
+from haystack.backends import BaseSearchBackend
 from haystack.indexes import *
 from haystack.exceptions import SearchFieldError
 from haystack.fields import CharField, FacetField
@@ -100,6 +101,25 @@ class SearchSiteTestCase(TestCase):
         self.assertEqual(len(indexed_models), 1)
         self.assert_(MockModel in indexed_models)
     
+    def test_get_result_converter(self):
+        backend = BaseSearchBackend(site=self.site)
+        self.assertEqual(self.site.get_result_converter('core.mockmodel', backend), (None, None))
+        
+        self.site.register(MockModel, ValidSearchIndex)
+        model, converter = self.site.get_result_converter('core.mockmodel', backend)
+        self.assertEqual(model, MockModel)
+        self.assertEqual(sorted(converter.converters.keys()), ['author', 'text', 'title'])
+        self.assertEqual(converter.field_names({'django_ct': 'core.mockmodel', 'django_id': '1', 'title': 'Hello'}), ['title'])
+        
+        # Built once, then reused.
+        self.assert_(self.site.get_result_converter('core.mockmodel', backend)[1] is converter)
+        self.assert_(self.site.get_result_converter('core.mockmodel', BaseSearchBackend(site=self.site))[1] is converter)
+        self.assertEqual(self.site.get_result_converter('core.anothermockmodel', backend), (None, None))
+        
+        # Changing the registry throws the cache away.
+        self.site.unregister(MockModel)
+        self.assertEqual(self.site.get_result_converter('core.mockmodel', backend), (None, None))
+    
     def test_all_searchfields(self):
         self.site.register(MockModel)
         fields = self.site.all_searchfields()
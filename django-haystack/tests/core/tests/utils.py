@@ -1,6 +1,11 @@
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, reset_queries
 from django.test import TestCase
-from haystack.utils import get_identifier, get_facet_field_name, Highlighter
-from core.models import MockModel
+from haystack.utils import get_identifier, get_facet_field_name, Highlighter, get_generation_key, get_generations, bump_generations, queryset_batches, run_threaded
+from core.models import MockModel, AnotherMockModel
 
 
 class GetIdentifierTestCase(TestCase):
@@ -21,6 +26,95 @@ class GetFacetFieldNameTestCase(TestCase):
         self.assertEqual(get_identifier(mock), 'core.mockmodel.1')
 
 
+class GenerationsTestCase(TestCase):
+    def setUp(self):
+        super(GenerationsTestCase, self).setUp()
+        self.old_timeout = getattr(settings, 'HAYSTACK_RESULT_CACHE_TIMEOUT', None)
+        settings.HAYSTACK_RESULT_CACHE_TIMEOUT = 60
+        cache.delete(get_generation_key(MockModel))
+        cache.delete(get_generation_key(AnotherMockModel))
+    
+    def tearDown(self):
+        settings.HAYSTACK_RESULT_CACHE_TIMEOUT = self.old_timeout
+        super(GenerationsTestCase, self).tearDown()
+    
+    def test_get_generation_key(self):
+        self.assertEqual(get_generation_key(MockModel), 'haystack_generation.core.mockmodel')
+    
+    def test_bump_generations(self):
+        mock_gen, another_gen = get_generations([MockModel, AnotherMockModel])
+        self.assertEqual(get_generations([MockModel, AnotherMockModel]), [mock_gen, another_gen])
+        
+        bump_generations([MockModel])
+        self.assertEqual(get_generations([MockModel, AnotherMockModel]), [mock_gen + 1, another_gen])
+        
+        # Evicted counters get a fresh value.
+        cache.delete(get_generation_key(AnotherMockModel))
+        bump_generations([AnotherMockModel])
+        self.assertNotEqual(get_generations([AnotherMockModel]), [another_gen])
+        
+        # Nothing happens when the result cache is off.
+        settings.HAYSTACK_RESULT_CACHE_TIMEOUT = None
+        bump_generations([MockModel])
+        self.assertEqual(get_generations([MockModel]), [mock_gen + 1])
+
+
+class RunThreadedTestCase(TestCase):
+    def test_run_threaded(self):
+        threads = []
+        
+        def slow_double(value):
+            threads.append(threading.currentThread())
+            time.sleep(0.05)
+            return value * 2
+        
+        # Single threaded.
+        self.assertEqual(run_threaded(slow_double, [1, 2, 3], 1), [2, 4, 6])
+        self.assertEqual(threads, [threading.currentThread()] * 3)
+        
+        # Results keep their order, regardless of which finishes first.
+        threads = []
+        start = time.time()
+        self.assertEqual(run_threaded(slow_double, range(8), 4), [0, 2, 4, 6, 8, 10, 12, 14])
+        self.assert_(time.time() - start < 0.05 * 8)
+        self.assertEqual(len(threads), 8)
+        self.failIf(threading.currentThread() in threads)
+        
+        self.assertEqual(run_threaded(slow_double, [], 4), [])
+    
+    def test_run_threaded_errors(self):
+        def picky(value):
+            if value == 3:
+                raise ValueError("No threes.")
+            
+            return value
+        
+        self.assertRaises(ValueError, run_threaded, picky, range(6), 2)
+        self.assertRaises(ValueError, run_threaded, picky, range(6), 1)
+
+
+class QuerysetBatchesTestCase(TestCase):
+    def test_queryset_batches(self):
+        self.assertEqual([[obj.pk for obj in batch] for batch in queryset_batches(MockModel.objects.all(), 2)], [[1, 2], [3]])
+        self.assertEqual([[obj.pk for obj in batch] for batch in queryset_batches(MockModel.objects.all(), 3)], [[1, 2, 3]])
+        self.assertEqual(list(queryset_batches(MockModel.objects.filter(pk__gt=3), 2)), [])
+        
+        # Later batches pick up after the last primary key, not at an offset.
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        reset_queries()
+        
+        try:
+            list(queryset_batches(MockModel.objects.order_by('-pk'), 1))
+            queries = [query['sql'] for query in connection.queries]
+        finally:
+            settings.DEBUG = old_debug
+            reset_queries()
+        
+        self.assertEqual(len(queries), 4)
+        self.assertEqual([sql for sql in queries if 'OFFSET' in sql], [])
+
+
 class HighlighterTestCase(TestCase):
     def setUp(self):
         super(HighlighterTestCase, self).setUp()
@@ -31,6 +31,12 @@ class SimpleSearchBackendTestCase(TestCase):
     def test_remove(self):
         self.backend.remove(self.sample_objs[0])
     
+    def test_remove_many(self):
+        self.backend.remove_many(self.sample_objs[:2])
+    
+    def test_iter_ids(self):
+        self.assertEqual(list(self.backend.iter_ids(MockModel)), [])
+    
     def test_clear(self):
         self.backend.clear()
     
@@ -72,6 +78,14 @@ class SimpleSearchBackendTestCase(TestCase):
         
         # Note that only textual-fields are supported.
         self.assertEqual(self.backend.search(u'2009-06-18')['hits'], 0)
+    
+    def test_count(self):
+        self.assertEqual(self.backend.count(u''), 0)
+        self.assertEqual(self.backend.count(u'*'), 23)
+        self.assertEqual(self.backend.count(u'daniel'), 23)
+        self.assertEqual(self.backend.count(u'should be a string'), 1)
+        self.assertEqual(self.backend.count(u'index document'), 6)
+        self.assertEqual(self.backend.count(u'Indx'), 0)
         
     def test_more_like_this(self):
         self.backend.update(self.index, self.sample_objs)
@@ -1,14 +1,24 @@
+import BaseHTTPServer
+import cgi
 import datetime
+import httplib
 import logging
 import pysolr
+import re
+import SocketServer
+import threading
+import time
+import urlparse
 from django.conf import settings
 from django.test import TestCase
+from django.utils import simplejson
 from haystack import backends
 from haystack.indexes import *
-from haystack.backends.solr_backend import SearchBackend, SearchQuery
+from haystack.backends.solr_backend import POOLS, SearchBackend, SearchQuery
 from haystack.exceptions import HaystackError
-from haystack.query import SearchQuerySet, RelatedSearchQuerySet, SQ
+from haystack.query import SearchQuerySet, RelatedSearchQuerySet, SQ, multi_search
 from haystack.sites import SearchSite
+from haystack.utils import get_generations
 from core.models import MockModel, AnotherMockModel, AFourthMockModel
 try:
     set
@@ -281,6 +291,42 @@ class SolrSearchBackendTestCase(TestCase):
         # Restore.
         settings.HAYSTACK_LIMIT_TO_REGISTERED_MODELS = old_limit_to_registered_models
     
+    def test_result_page_cost(self):
+        objs = []
+        
+        for i in xrange(1, 1001):
+            mock = MockModel()
+            mock.id = i
+            mock.author = 'daniel%s' % i
+            mock.pub_date = datetime.date(2009, 2, 25) - datetime.timedelta(days=i)
+            objs.append(mock)
+        
+        self.sb.update(self.smmi, objs)
+        results = self.sb.search(u'*:*', end_offset=1000)['results']
+        self.assertEqual(len(results), 1000)
+        
+        # The whole page shares a converter & nothing has been converted.
+        converter = results[0]._converter
+        self.assertEqual(len(set([id(result._converter) for result in results])), 1)
+        self.assertEqual([result for result in results if result._fields], [])
+        
+        calls = []
+        convert = converter.convert
+        
+        def counting_convert(key, value):
+            calls.append(key)
+            return convert(key, value)
+        
+        converter.convert = counting_convert
+        
+        # Reading one field costs one conversion per result, once.
+        self.assertEqual(sorted([result.name for result in results])[:2], [u'daniel1', u'daniel10'])
+        self.assertEqual(len(calls), 1000)
+        self.assertEqual(len([result.name for result in results]), 1000)
+        self.assertEqual(len(calls), 1000)
+        self.assert_(isinstance(results[0].pub_date, datetime.date))
+        self.assertEqual(len(calls), 1001)
+    
     def test_more_like_this(self):
         self.sb.update(self.smmi, self.sample_objs)
         self.assertEqual(self.raw_solr.search('*:*').hits, 3)
@@ -503,6 +549,347 @@ class FailedSolrSearchBackendTestCase(TestCase):
         logging.getLogger('haystack').addHandler(haystack.stream)
 
 
+class StandInSolrHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connects.append(self.client_address)
+    
+    def do_GET(self):
+        self.server.gets.append(self.path)
+        time.sleep(self.server.delay)
+        body = '{"responseHeader": {"status": 0, "QTime": 0}, "response": {"numFound": 1, "start": 0, "docs": []}}'
+        
+        if self.server.docs is not None:
+            body = self.select()
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+        if self.server.drop_connections:
+            # Hang up without warning, like an idle timeout would.
+            self.close_connection = 1
+    
+    def select(self):
+        """
+        Pages through the stored docs, in ``id`` order, after the lower bound
+        given by an ``id:{"..." TO *}`` filter.
+        """
+        params = cgi.parse_qs(urlparse.urlparse(self.path)[4])
+        self.server.queries.append(params)
+        docs = sorted(self.server.docs, key=lambda doc: doc['id'])
+        
+        for fq in params.get('fq', []):
+            match = re.match(r'^id:\{"(.*)" TO \*\}$', fq)
+            
+            if match:
+                docs = [doc for doc in docs if doc['id'] > match.group(1)]
+        
+        rows = int(params['rows'][0])
+        return simplejson.dumps({
+            'responseHeader': {'status': 0, 'QTime': 0},
+            'response': {'numFound': len(docs), 'start': 0, 'docs': docs[:rows]},
+        })
+    
+    def do_POST(self):
+        self.server.posts.append((self.path, self.rfile.read(int(self.headers['Content-Length']))))
+        body = '<response><lst name="responseHeader"><int name="status">0</int></lst></response>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+
+class StandInSolrServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Answers every query with one hit (or pages through ``docs``, when given),
+    counting the connections made to it & keeping whatever's posted to it.
+    """
+    daemon_threads = True
+    
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StandInSolrHandler)
+        self.connects = []
+        self.posts = []
+        self.delay = 0
+        self.drop_connections = False
+        self.docs = None
+        self.queries = []
+        self.gets = []
+
+
+class StandInSolrTestCase(TestCase):
+    def setUp(self):
+        super(StandInSolrTestCase, self).setUp()
+        self.server = StandInSolrServer()
+        server_thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.01})
+        server_thread.setDaemon(True)
+        server_thread.start()
+        
+        # Stow.
+        self.old_solr_url = settings.HAYSTACK_SOLR_URL
+        self.old_pool_size = getattr(settings, 'HAYSTACK_SOLR_POOL_SIZE', 10)
+        settings.HAYSTACK_SOLR_URL = 'http://127.0.0.1:%s/solr' % self.server.server_port
+        settings.HAYSTACK_SOLR_POOL_SIZE = 4
+        
+        self.site = SearchSite()
+        self.site.register(MockModel, SolrMockSearchIndex)
+    
+    def tearDown(self):
+        # The next test's server may get the same port, with other settings.
+        pool = POOLS.pop(('http', '127.0.0.1', self.server.server_port), None)
+        
+        if pool is not None:
+            pool.clear()
+        
+        self.server.shutdown()
+        self.server.server_close()
+        
+        # Restore.
+        settings.HAYSTACK_SOLR_URL = self.old_solr_url
+        settings.HAYSTACK_SOLR_POOL_SIZE = self.old_pool_size
+        super(StandInSolrTestCase, self).tearDown()
+
+
+class SolrConnectionPoolTestCase(StandInSolrTestCase):
+    def test_keep_alive(self):
+        sb = SearchBackend(site=self.site)
+        
+        for i in xrange(10):
+            self.assertEqual(sb.search(u'foo')['hits'], 1)
+        
+        self.assertEqual(len(self.server.connects), 1)
+        
+        # Every backend shares the same connections.
+        self.assertEqual(SearchBackend(site=self.site).search(u'foo')['hits'], 1)
+        self.assertEqual(len(self.server.connects), 1)
+    
+    def test_parallel_queries(self):
+        self.server.delay = 0.05
+        sb = SearchBackend(site=self.site)
+        hits = []
+        
+        def run_queries():
+            for i in xrange(5):
+                hits.append(sb.search(u'foo')['hits'])
+        
+        threads = [threading.Thread(target=run_queries) for i in xrange(8)]
+        start = time.time()
+        
+        for thread in threads:
+            thread.start()
+        
+        for thread in threads:
+            thread.join()
+        
+        elapsed = time.time() - start
+        self.assertEqual(hits, [1] * 40)
+        
+        # No more connections than the pool allows, but enough of them to
+        # answer queries side by side.
+        self.assert_(1 < len(self.server.connects) <= 4)
+        self.assert_(elapsed < 40 * 0.05 / 2)
+    
+    def test_dropped_connections(self):
+        self.server.drop_connections = True
+        sb = SearchBackend(site=self.site)
+        
+        # Each query notices the last connection's gone & opens another.
+        for i in xrange(3):
+            self.assertEqual(sb.search(u'foo')['hits'], 1)
+        
+        self.assertEqual(len(self.server.connects), 3)
+    
+    def test_https(self):
+        settings.HAYSTACK_SOLR_URL = 'https://127.0.0.1:%s/solr' % self.server.server_port
+        
+        try:
+            sb = SearchBackend(site=self.site)
+        finally:
+            settings.HAYSTACK_SOLR_URL = 'http://127.0.0.1:%s/solr' % self.server.server_port
+        
+        # HTTPS gets its own pool, of HTTPS connections.
+        self.assertNotEqual(sb.conn.pool, SearchBackend(site=self.site).conn.pool)
+        conn, reused = sb.conn.pool.acquire()
+        self.assert_(isinstance(conn, httplib.HTTPSConnection))
+        sb.conn.pool.discard(conn)
+        del POOLS[('https', '127.0.0.1', self.server.server_port)]
+    
+    def test_timeouts_not_retried(self):
+        sb = SearchBackend(site=self.site)
+        sb.conn.pool.socket_timeout = 0.2
+        self.assertEqual(sb.search(u'foo')['hits'], 1)
+        
+        # A slow answer on a kept-alive connection may still have reached
+        # Solr, so it's reported rather than sent again.
+        self.server.delay = 0.5
+        self.assertEqual(sb.search(u'foo')['hits'], 0)
+        self.assertEqual(len(self.server.gets), 2)
+
+
+class SolrIdScanTestCase(StandInSolrTestCase):
+    def test_iter_ids(self):
+        self.server.docs = [{'id': 'core.mockmodel.%s' % i, 'django_id': i} for i in xrange(1, 26)]
+        sb = SearchBackend(site=self.site)
+        ids = list(sb.iter_ids(MockModel, chunk_size=10))
+        self.assertEqual(sorted(ids, key=int), [str(i) for i in xrange(1, 26)])
+        
+        # Each page starts after the last id of the one before it.
+        self.assertEqual(len(self.server.queries), 3)
+        self.assertEqual(self.server.queries[0]['fq'], ['django_ct:core.mockmodel'])
+        self.assertEqual(self.server.queries[0]['fl'], ['id django_id'])
+        self.assertEqual(self.server.queries[0]['sort'], ['id asc'])
+        self.assertEqual(self.server.queries[1]['fq'], ['django_ct:core.mockmodel', 'id:{"core.mockmodel.18" TO *}'])
+        self.assertEqual(self.server.queries[2]['fq'], ['django_ct:core.mockmodel', 'id:{"core.mockmodel.4" TO *}'])
+
+
+class SolrUpdateQueueTestCase(StandInSolrTestCase):
+    def setUp(self):
+        super(SolrUpdateQueueTestCase, self).setUp()
+        
+        # Stow.
+        self.old_queue_size = getattr(settings, 'HAYSTACK_SOLR_QUEUE_SIZE', 0)
+        self.old_queue_delay = getattr(settings, 'HAYSTACK_SOLR_QUEUE_DELAY', 1)
+        self.old_commit_within = getattr(settings, 'HAYSTACK_SOLR_COMMIT_WITHIN', 1000)
+        self.old_commit_within_deletes = getattr(settings, 'HAYSTACK_SOLR_COMMIT_WITHIN_DELETES', False)
+        settings.HAYSTACK_SOLR_QUEUE_SIZE = 3
+        settings.HAYSTACK_SOLR_QUEUE_DELAY = 60
+        settings.HAYSTACK_SOLR_COMMIT_WITHIN = 500
+        settings.HAYSTACK_SOLR_COMMIT_WITHIN_DELETES = True
+        
+        self.sb = SearchBackend(site=self.site)
+        self.smmi = SolrMockSearchIndex(MockModel, backend=self.sb)
+        self.sample_objs = []
+        
+        for i in xrange(1, 5):
+            mock = MockModel()
+            mock.id = i
+            mock.author = 'daniel%s' % i
+            mock.pub_date = datetime.date(2009, 2, 25) - datetime.timedelta(days=i)
+            self.sample_objs.append(mock)
+    
+    def tearDown(self):
+        self.sb.flush()
+        
+        # Restore.
+        settings.HAYSTACK_SOLR_QUEUE_SIZE = self.old_queue_size
+        settings.HAYSTACK_SOLR_QUEUE_DELAY = self.old_queue_delay
+        settings.HAYSTACK_SOLR_COMMIT_WITHIN = self.old_commit_within
+        settings.HAYSTACK_SOLR_COMMIT_WITHIN_DELETES = self.old_commit_within_deletes
+        super(SolrUpdateQueueTestCase, self).tearDown()
+    
+    def test_coalesced_posts(self):
+        self.sb.update(self.smmi, self.sample_objs[:2])
+        self.sb.remove(self.sample_objs[0])
+        self.sb.update(self.smmi, self.sample_objs[1:2])
+        self.assertEqual(self.server.posts, [])
+        
+        # The third document fills the queue, so it's posted straight away.
+        # Only the last change to each document is sent.
+        self.sb.update(self.smmi, self.sample_objs[2:3])
+        self.assertEqual(len(self.server.posts), 2)
+        self.assertEqual(self.server.posts[0], ('/solr/update/?commit=false', '<delete commitWithin="500"><id>core.mockmodel.1</id></delete>'))
+        path, body = self.server.posts[1]
+        self.assertEqual(path, '/solr/update/?commit=false')
+        self.assert_(body.startswith('<add commitWithin="500"><doc>'))
+        self.assertEqual(body.count('<doc>'), 2)
+        self.assert_('core.mockmodel.2' in body)
+        self.assert_('core.mockmodel.3' in body)
+        
+        self.sb.update(self.smmi, self.sample_objs[3:])
+        self.assertEqual(len(self.server.posts), 2)
+        self.sb.flush()
+        self.assertEqual(len(self.server.posts), 3)
+        self.assert_('core.mockmodel.4' in self.server.posts[2][1])
+    
+    def test_delayed_posts(self):
+        settings.HAYSTACK_SOLR_QUEUE_DELAY = 0.05
+        self.sb.remove(self.sample_objs[0])
+        self.assertEqual(self.server.posts, [])
+        time.sleep(0.5)
+        self.assertEqual(self.server.posts, [('/solr/update/?commit=false', '<delete commitWithin="500"><id>core.mockmodel.1</id></delete>')])
+    
+    def test_remove_many(self):
+        settings.HAYSTACK_SOLR_QUEUE_SIZE = 0
+        self.sb.remove_many(self.sample_objs[:3])
+        self.assertEqual(self.server.posts, [('/solr/update/?commit=true', '<delete><id>core.mockmodel.1</id><id>core.mockmodel.2</id><id>core.mockmodel.3</id></delete>')])
+        
+        # Queued removals are posted along with everything else.
+        settings.HAYSTACK_SOLR_QUEUE_SIZE = 3
+        self.sb.remove_many(self.sample_objs[1:])
+        self.assertEqual(len(self.server.posts), 2)
+        path, body = self.server.posts[1]
+        self.assertEqual(path, '/solr/update/?commit=false')
+        self.assert_(body.startswith('<delete commitWithin="500"><id>'))
+        self.assertEqual(body.count('<id>'), 3)
+    
+    def test_commit_within_deletes(self):
+        # Unless Solr's known to honour ``commitWithin`` on deletes, a post
+        # with removals commits with its last request.
+        settings.HAYSTACK_SOLR_COMMIT_WITHIN_DELETES = False
+        self.sb.remove(self.sample_objs[0])
+        self.sb.flush()
+        self.assertEqual(self.server.posts, [('/solr/update/?commit=true', '<delete><id>core.mockmodel.1</id></delete>')])
+        
+        self.sb.remove(self.sample_objs[1])
+        self.sb.update(self.smmi, self.sample_objs[2:3])
+        self.sb.flush()
+        self.assertEqual(self.server.posts[1], ('/solr/update/?commit=false', '<delete><id>core.mockmodel.2</id></delete>'))
+        self.assertEqual(self.server.posts[2][0], '/solr/update/?commit=true')
+        self.assert_(self.server.posts[2][1].startswith('<add><doc>'))
+        
+        # Posts of additions alone still use ``commitWithin``.
+        self.sb.update(self.smmi, self.sample_objs[3:])
+        self.sb.flush()
+        self.assertEqual(self.server.posts[3][0], '/solr/update/?commit=false')
+        self.assert_(self.server.posts[3][1].startswith('<add commitWithin="500">'))
+    
+    def test_deferred_generations(self):
+        old_timeout = getattr(settings, 'HAYSTACK_RESULT_CACHE_TIMEOUT', None)
+        settings.HAYSTACK_RESULT_CACHE_TIMEOUT = 60
+        
+        try:
+            generation = get_generations([MockModel])[0]
+            self.assertEqual(self.sb.defers_updates(), True)
+            
+            # Queued changes aren't searchable, so the generation waits for
+            # Solr to commit them.
+            self.smmi.update_object(self.sample_objs[0])
+            self.smmi.remove_object(self.sample_objs[1])
+            self.assertEqual(get_generations([MockModel])[0], generation)
+            
+            self.sb.flush()
+            self.assertEqual(len(self.server.posts), 2)
+            self.assertEqual(get_generations([MockModel])[0], generation)
+            time.sleep(0.7)
+            self.assertEqual(get_generations([MockModel])[0], generation + 1)
+            
+            # A hard commit makes them searchable right away.
+            settings.HAYSTACK_SOLR_COMMIT_WITHIN = 0
+            self.sb.remove(self.sample_objs[2])
+            self.sb.flush()
+            self.assertEqual(get_generations([MockModel])[0], generation + 2)
+        finally:
+            settings.HAYSTACK_RESULT_CACHE_TIMEOUT = old_timeout
+    
+    def test_hard_commit(self):
+        settings.HAYSTACK_SOLR_COMMIT_WITHIN = 0
+        self.sb.update(self.smmi, self.sample_objs[:1])
+        self.sb.remove(self.sample_objs[1])
+        self.sb.flush()
+        self.assertEqual(self.server.posts[0], ('/solr/update/?commit=false', '<delete><id>core.mockmodel.2</id></delete>'))
+        self.assertEqual(self.server.posts[1][0], '/solr/update/?commit=true')
+
+
 class LiveSolrSearchQueryTestCase(TestCase):
     fixtures = ['initial_data.json']
     
@@ -646,6 +1033,28 @@ class LiveSolrSearchQuerySetTestCase(TestCase):
         # Should only execute one query to count the length of the result set.
         self.assertEqual(len(backends.queries), 1)
     
+    def test_iterator(self):
+        backends.reset_search_queries()
+        self.assertEqual(len(backends.queries), 0)
+        sqs = self.sqs.all()
+        results = [int(result.pk) for result in sqs.iterator(chunk_size=10)]
+        self.assertEqual(results, range(1, 24))
+        self.assertEqual(len(sqs._result_cache), 0)
+        # One to count, then one per chunk.
+        self.assertEqual(len(backends.queries), 4)
+    
+    def test_multi_search(self):
+        backends.reset_search_queries()
+        self.assertEqual(len(backends.queries), 0)
+        querysets = multi_search([self.sqs.all(), self.sqs.filter(id='core.mockmodel.2'), self.sqs.order_by('-pub_date')])
+        self.assertEqual(len(backends.queries), 3)
+        
+        self.assertEqual([int(result.pk) for result in querysets[0][0:10]], range(1, 11))
+        self.assertEqual(len(querysets[0]), 23)
+        self.assertEqual([int(result.pk) for result in querysets[1]], [2])
+        self.assertEqual(len(querysets[2]._result_cache), 10)
+        self.assertEqual(len(backends.queries), 3)
+    
     def test_manual_iter(self):
         results = self.sqs.all()
         
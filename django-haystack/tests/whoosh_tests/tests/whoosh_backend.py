@@ -1,16 +1,29 @@
 from datetime import timedelta
+import imp
 import os
 import shutil
+import sys
+import tempfile
+import threading
+import whoosh
 from whoosh.fields import TEXT, ID, KEYWORD, NUMERIC, DATETIME
+from whoosh.filedb.filestore import RamStorage
 from whoosh.qparser import QueryParser
+from whoosh.query import And, Every, Not, Term
+from whoosh.spelling import SpellChecker
 from django.conf import settings
+from django.core.management.base import CommandError
 from django.utils.datetime_safe import datetime, date
 from django.test import TestCase
 from haystack import backends
+from haystack.backends import whoosh_backend
 from haystack.indexes import *
-from haystack.backends.whoosh_backend import SearchBackend, SearchQuery
+from haystack.backends.whoosh_backend import KEY_TERMS, SEARCHERS, SNAPSHOTS, SUGGESTIONS, WRITES, LRUCache, PooledSpellChecker, SearchBackend, SearcherPool, SearchQuery
+from haystack.exceptions import MissingDependency, SearchBackendError
+from haystack.management.commands.update_index import Command as UpdateIndexCommand
 from haystack.query import SearchQuerySet, SQ
 from haystack.sites import SearchSite
+from haystack.utils import get_generations
 from core.models import MockModel, AnotherMockModel
 try:
     set
@@ -32,6 +45,12 @@ class AllTypesWhooshMockSearchIndex(SearchIndex):
     seen_count = IntegerField(indexed=False)
 
 
+class WhooshFacetMockSearchIndex(SearchIndex):
+    text = CharField(document=True, use_template=True)
+    name = CharField(model_attr='author', faceted=True)
+    pub_date = DateField(model_attr='pub_date')
+
+
 class WhooshMaintainTypeMockSearchIndex(SearchIndex):
     text = CharField(document=True)
     month = CharField(indexed=False)
@@ -99,6 +118,31 @@ class WhooshSearchBackendTestCase(TestCase):
         self.assertEqual(len(self.whoosh_search(u'*')), 23)
         self.assertEqual([doc.fields()['id'] for doc in self.whoosh_search(u'*')], [u'core.mockmodel.%s' % i for i in xrange(1, 24)])
     
+    def test_update_empty_index(self):
+        # Starting from an empty index, documents are simply added.
+        self.sb.update(self.smmi, self.sample_objs[:10])
+        self.sb.update(self.smmi, self.sample_objs[10:])
+        self.assertEqual(len(self.sb._appended), 23)
+        self.assertEqual(len(self.whoosh_search(u'*')), 23)
+        
+        # Updating them again still replaces them.
+        self.sb.update(self.smmi, self.sample_objs[:5])
+        self.assertEqual(len(self.whoosh_search(u'*')), 23)
+        self.assertEqual(self.sb.index.refresh().doc_count(), 23)
+        
+        # Once anything else has written to the index, it's back to looking
+        # each document up.
+        other_sb = SearchBackend(site=self.site)
+        other_sb.remove(self.sample_objs[0])
+        self.sb.update(self.smmi, self.sample_objs)
+        self.assertEqual(self.sb._appended, None)
+        self.assertEqual(len(self.whoosh_search(u'*')), 23)
+        self.assertEqual(self.sb.index.refresh().doc_count(), 23)
+        
+        self.sb.delete_index()
+        self.sb.update(self.smmi, self.sample_objs)
+        self.assertEqual(len(self.sb._appended), 23)
+    
     def test_remove(self):
         self.sb.update(self.smmi, self.sample_objs)
         self.assertEqual(self.sb.index.doc_count(), 23)
@@ -106,6 +150,148 @@ class WhooshSearchBackendTestCase(TestCase):
         self.sb.remove(self.sample_objs[0])
         self.assertEqual(self.sb.index.doc_count(), 22)
     
+    def test_remove_many(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        generation = self.sb.index.latest_generation()
+        
+        self.sb.remove_many([self.sample_objs[0], 'core.mockmodel.%s' % self.sample_objs[1].pk, u'core.mockmodel.%s' % self.sample_objs[2].pk])
+        self.assertEqual(self.sb.index.doc_count(), 20)
+        
+        # All in the one commit.
+        self.assertEqual(self.sb.index.latest_generation(), generation + 1)
+        
+        # Nothing to remove means nothing to commit.
+        self.sb.remove_many([])
+        self.assertEqual(self.sb.index.latest_generation(), generation + 1)
+    
+    def test_minimum_version(self):
+        # Older versions of Whoosh are turned away before any of the imports
+        # they don't have (like ``whoosh.qparser.common``) are tried.
+        old_version = whoosh.__version__
+        old_common = sys.modules['whoosh.qparser.common']
+        whoosh.__version__ = (1, 4, 1)
+        sys.modules['whoosh.qparser.common'] = None
+        source = os.path.splitext(whoosh_backend.__file__)[0] + '.py'
+        
+        try:
+            self.assertRaises(MissingDependency, imp.load_source, 'whoosh_backend_version_check', source)
+            
+            whoosh.__version__ = old_version
+            self.assertRaises(ImportError, imp.load_source, 'whoosh_backend_version_check', source)
+        finally:
+            whoosh.__version__ = old_version
+            sys.modules['whoosh.qparser.common'] = old_common
+            sys.modules.pop('whoosh_backend_version_check', None)
+    
+    def test_iter_ids(self):
+        self.assertEqual(list(self.sb.iter_ids(MockModel)), [])
+        
+        self.sb.update(self.smmi, self.sample_objs)
+        self.sb.remove(self.sample_objs[0])
+        ids = list(self.sb.iter_ids(MockModel))
+        self.assertEqual(sorted(ids, key=int), [str(i) for i in xrange(2, 24)])
+        self.assertEqual(list(self.sb.iter_ids(AnotherMockModel)), [])
+        
+        # Removing documents along the way doesn't skip any.
+        ids = []
+        
+        for pk in self.sb.iter_ids(MockModel):
+            ids.append(pk)
+            self.sb.remove('core.mockmodel.%s' % pk)
+        
+        self.assertEqual(sorted(ids, key=int), [str(i) for i in xrange(2, 24)])
+        self.assertEqual(list(self.sb.iter_ids(MockModel)), [])
+    
+    def test_update_index_remove(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        stale = [obj.pk for obj in self.sample_objs[:12]]
+        MockModel.objects.filter(pk__in=stale).delete()
+        self.site.get_index(MockModel).backend = self.sb
+        
+        removed = []
+        old_remove_many = SearchBackend.remove_many
+        
+        def recording_remove_many(sb, identifiers, commit=True):
+            removed.append(sorted(identifiers))
+            return old_remove_many(sb, identifiers, commit)
+        
+        SearchBackend.remove_many = recording_remove_many
+        
+        try:
+            UpdateIndexCommand().handle('core', verbosity=0, remove=True, batchsize=5)
+        finally:
+            SearchBackend.remove_many = old_remove_many
+        
+        # The stale documents go with the batch they were read in (the index
+        # orders pks as strings).
+        self.assertEqual(removed, [['core.mockmodel.%s' % pk for pk in batch] for batch in [[1, 10, 11, 12, 2], [3, 4, 5, 6, 7], [8, 9]]])
+        self.assertEqual(self.sb.search(u'*')['hits'], 11)
+    
+    def test_update_index_checkpoint(self):
+        self.site.get_index(MockModel).backend = self.sb
+        checkpoint_dir = tempfile.mkdtemp()
+        checkpoint = os.path.join(checkpoint_dir, 'update_index.checkpoint')
+        
+        try:
+            batches = []
+            old_update = SearchBackend.update
+            
+            def failing_update(sb, index, iterable, commit=True):
+                if len(batches) == 2:
+                    raise KeyboardInterrupt
+                
+                batches.append([obj.pk for obj in iterable])
+                return old_update(sb, index, iterable, commit)
+            
+            SearchBackend.update = failing_update
+            
+            try:
+                self.assertRaises(KeyboardInterrupt, UpdateIndexCommand().handle, 'core', verbosity=0, batchsize=5, checkpoint=checkpoint)
+            finally:
+                SearchBackend.update = old_update
+            
+            # Batches follow on from the last primary key seen.
+            self.assertEqual(batches, [[1, 2, 3, 4, 5], [6, 7, 8, 9, 10]])
+            self.assertEqual(open(checkpoint).read(), '--age \n--site \ncore.mockmodel 10\n')
+            self.assertEqual(self.sb.search(u'*')['hits'], 10)
+            
+            # It won't resume with options that pick out different objects.
+            self.assertRaises(CommandError, UpdateIndexCommand().handle, 'core', verbosity=0, checkpoint=checkpoint, age=24)
+            self.assertRaises(CommandError, UpdateIndexCommand().handle, 'core', verbosity=0, checkpoint=checkpoint, site='search_sites.site')
+            
+            # Running again picks up where it stopped, then clears the checkpoint.
+            batches = []
+            SearchBackend.update = failing_update
+            
+            try:
+                UpdateIndexCommand().handle('core', verbosity=0, batchsize=8, checkpoint=checkpoint, count=False)
+            finally:
+                SearchBackend.update = old_update
+            
+            self.assertEqual(batches, [range(11, 19), range(19, 24)])
+            self.assertFalse(os.path.exists(checkpoint))
+            self.assertEqual(self.sb.search(u'*')['hits'], 23)
+            
+            # An ``--age`` run resumes from the time it first counted back from.
+            command = UpdateIndexCommand()
+            command.age = 24
+            command.site = None
+            command.since = datetime(2009, 2, 25, 1, 2, 3)
+            command.checkpoint = checkpoint
+            command.progress = {}
+            command.save_checkpoint('core.mockmodel', '10')
+            self.assertEqual(open(checkpoint).read(), '--age 24\n--since 2009-02-25 01:02:03\n--site \ncore.mockmodel 10\n')
+            
+            command = UpdateIndexCommand()
+            command.age = 24
+            command.site = None
+            command.since = None
+            command.checkpoint = checkpoint
+            self.assertEqual(command.load_checkpoint(), {'core.mockmodel': '10'})
+            self.assertEqual(command.since, datetime(2009, 2, 25, 1, 2, 3))
+        finally:
+            shutil.rmtree(checkpoint_dir)
+    
     def test_clear(self):
         self.sb.update(self.smmi, self.sample_objs)
         self.assertEqual(self.sb.index.doc_count(), 23)
@@ -158,19 +344,19 @@ class WhooshSearchBackendTestCase(TestCase):
         results = self.sb.search(u'Index*', facets=['name'])
         results = self.sb.search(u'index*', facets=['name'])
         self.assertEqual(results['hits'], 23)
-        self.assertEqual(results['facets'], {})
+        self.assertEqual(results['facets'], {'fields': {'name': [(u'daniel3', 9), (u'daniel1', 7), (u'daniel2', 7)]}, 'dates': {}, 'queries': {}})
         
         self.assertEqual(self.sb.search(u'', date_facets={'pub_date': {'start_date': date(2008, 2, 26), 'end_date': date(2008, 2, 26), 'gap': '/MONTH'}}), {'hits': 0, 'results': []})
         results = self.sb.search(u'Index*', date_facets={'pub_date': {'start_date': date(2008, 2, 26), 'end_date': date(2008, 2, 26), 'gap': '/MONTH'}})
         results = self.sb.search(u'index*', date_facets={'pub_date': {'start_date': date(2008, 2, 26), 'end_date': date(2008, 2, 26), 'gap': '/MONTH'}})
         self.assertEqual(results['hits'], 23)
-        self.assertEqual(results['facets'], {})
+        self.assertEqual(results['facets'], {'fields': {}, 'dates': {'pub_date': []}, 'queries': {}})
         
         self.assertEqual(self.sb.search(u'', query_facets={'name': '[* TO e]'}), {'hits': 0, 'results': []})
         results = self.sb.search(u'Index*', query_facets={'name': '[* TO e]'})
         results = self.sb.search(u'index*', query_facets={'name': '[* TO e]'})
         self.assertEqual(results['hits'], 23)
-        self.assertEqual(results['facets'], {})
+        self.assertEqual(results['facets'], {'fields': {}, 'dates': {}, 'queries': {u'name:[* TO e]': 23}})
         
         # self.assertEqual(self.sb.search('', narrow_queries=set(['name:daniel1'])), {'hits': 0, 'results': []})
         # results = self.sb.search('Index*', narrow_queries=set(['name:daniel1']))
@@ -192,12 +378,666 @@ class WhooshSearchBackendTestCase(TestCase):
         # Restore.
         settings.HAYSTACK_LIMIT_TO_REGISTERED_MODELS = old_limit_to_registered_models
     
+    def test_count(self):
+        self.assertEqual(self.sb.count(u'*'), 0)
+        
+        self.sb.update(self.smmi, self.sample_objs)
+        self.assertEqual(self.sb.count(u''), 0)
+        self.assertEqual(self.sb.count(u'a'), 0)
+        self.assertEqual(self.sb.count(u'*'), 23)
+        self.assertEqual(self.sb.count(u'index*'), 23)
+        self.assertEqual(self.sb.count(u'Indx'), 0)
+        self.assertEqual(self.sb.count(u'name:daniel1'), self.sb.search(u'name:daniel1')['hits'])
+        self.assertEqual(self.sb.count(u'*', limit_to_registered_models=False), 23)
+        
+        # Narrowing shouldn't alter the set that was passed in.
+        narrow_queries = set([u'name:daniel1'])
+        self.assertEqual(self.sb.count(u'index*', narrow_queries=narrow_queries), 7)
+        self.assertEqual(self.sb.count(u'index*', narrow_queries=narrow_queries), self.sb.search(u'index*', narrow_queries=set([u'name:daniel1']))['hits'])
+        self.assertEqual(narrow_queries, set([u'name:daniel1']))
+    
+    def test_iter_search(self):
+        self.assertEqual(list(self.sb.iter_search(u'*')), [])
+        
+        self.sb.update(self.smmi, self.sample_objs)
+        self.assertEqual(list(self.sb.iter_search(u'')), [])
+        self.assertEqual(list(self.sb.iter_search(u'a')), [])
+        
+        chunks = list(self.sb.iter_search(u'*', chunk_size=10))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 3])
+        self.assertEqual([result.pk for chunk in chunks for result in chunk], [result.pk for result in self.sb.search(u'*')['results']])
+        
+        # Offsets don't have to line up with the chunks.
+        chunks = list(self.sb.iter_search(u'*', chunk_size=10, start_offset=5, end_offset=17))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 2])
+        self.assertEqual([result.pk for chunk in chunks for result in chunk], [u'%s' % i for i in xrange(6, 18)])
+        
+        # Ordering is respected.
+        chunks = list(self.sb.iter_search(u'*', chunk_size=5, sort_by=['-id']))
+        self.assertEqual([result.pk for chunk in chunks for result in chunk], [result.pk for result in self.sb.search(u'*', sort_by=['-id'])['results']])
+        
+        # The searcher goes back to the pool, even if iterating stops early.
+        released = []
+        
+        def recording_release(searcher):
+            released.append(searcher)
+            SearcherPool.release(SEARCHERS, searcher)
+        
+        SEARCHERS.release = recording_release
+        
+        try:
+            chunks = self.sb.iter_search(u'*', chunk_size=10)
+            self.assertEqual(len(chunks.next()), 10)
+            self.assertEqual(released, [])
+            chunks.close()
+            self.assertEqual(len(released), 1)
+        finally:
+            del SEARCHERS.release
+    
+    def test_result_page_cost(self):
+        objs = []
+        
+        for i in xrange(1, 1001):
+            mock = MockModel()
+            mock.id = i
+            mock.author = 'daniel%s' % i
+            mock.pub_date = date(2009, 2, 25) - timedelta(days=i)
+            objs.append(mock)
+        
+        self.sb.update(self.smmi, objs)
+        results = self.sb.search(u'*', end_offset=1000)['results']
+        self.assertEqual(len(results), 1000)
+        
+        # The whole page shares a converter & nothing has been converted.
+        converter = results[0]._converter
+        self.assertEqual(len(set([id(result._converter) for result in results])), 1)
+        self.assertEqual([result for result in results if result._fields], [])
+        
+        calls = []
+        convert = converter.convert
+        
+        def counting_convert(key, value):
+            calls.append(key)
+            return convert(key, value)
+        
+        converter.convert = counting_convert
+        
+        # Reading one field costs one conversion per result, once.
+        self.assertEqual(sorted([result.name for result in results])[:2], [u'daniel1', u'daniel10'])
+        self.assertEqual(len(calls), 1000)
+        self.assertEqual(len([result.name for result in results]), 1000)
+        self.assertEqual(len(calls), 1000)
+        self.assert_(isinstance(results[0].pub_date, datetime))
+        self.assertEqual(len(calls), 1001)
+    
+    def test_result_converter(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        
+        built = []
+        build_result_converter = self.sb.build_result_converter
+        
+        def counting_build(index):
+            built.append(index)
+            return build_result_converter(index)
+        
+        self.sb.build_result_converter = counting_build
+        self.sb.search(u'*')
+        self.sb.search(u'*', end_offset=5)
+        self.assertEqual(len(built), 1)
+        
+        # KEYWORD fields come back as comma-separated strings.
+        converter = self.sb.build_result_converter(AllTypesWhooshMockSearchIndex(MockModel))
+        self.assertEqual(converter.convert('sites', u'1,2'), [u'1', u'2'])
+        self.assertEqual(converter.convert('sites', None), [])
+        self.assertEqual(converter.convert('seen_count', u'5'), 5)
+        self.assertEqual(converter.field_names({'django_ct': u'core.mockmodel', 'django_id': u'1', 'id': u'core.mockmodel.1'}), ['id'])
+    
+    def test_searcher_pool(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        opened = []
+        
+        def counting_open(ix):
+            searcher = ix.searcher()
+            opened.append(searcher)
+            return searcher
+        
+        SEARCHERS._open = counting_open
+        
+        try:
+            # Queries, counts & narrowing all reuse the one searcher.
+            self.assertEqual(self.sb.search(u'*')['hits'], 23)
+            self.assertEqual(self.sb.count(u'*', narrow_queries=set(['name:daniel1'])), 7)
+            self.assertEqual(len(list(self.sb.iter_search(u'*', chunk_size=10))), 3)
+            self.assertEqual(len(opened), 1)
+            self.assertFalse(opened[0].is_closed)
+            
+            # A new generation retires the old searcher.
+            self.sb.remove(self.sample_objs[0])
+            self.assertEqual(self.sb.search(u'*')['hits'], 22)
+            self.assertEqual(len(opened), 2)
+            self.assert_(opened[0].is_closed)
+            self.assertFalse(opened[1].is_closed)
+            
+            # So does wiping the index, even back to the same generation.
+            self.sb.delete_index()
+            self.assert_(opened[1].is_closed)
+            self.assertEqual(self.sb.search(u'*')['hits'], 0)
+        finally:
+            del(SEARCHERS._open)
+    
+    def test_narrow_filter_cache(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        self.assertEqual(self.sb.search(u'*', narrow_queries=set(['name:daniel1']))['hits'], 7)
+        
+        parsed = []
+        parse = self.sb.parser.parse
+        
+        def counting_parse(query_string):
+            parsed.append(query_string)
+            return parse(query_string)
+        
+        self.sb.parser.parse = counting_parse
+        
+        # Only the main query gets parsed & run the second time around; the
+        # narrowing & registered models filters come from the cache.
+        self.assertEqual(self.sb.search(u'*', narrow_queries=set(['name:daniel1']))['hits'], 7)
+        self.assertEqual(self.sb.count(u'*', narrow_queries=set(['name:daniel1'])), 7)
+        self.assertEqual(parsed, [u'*', u'*'])
+        
+        # Narrowing to nothing matches nothing.
+        self.assertEqual(self.sb.search(u'*', narrow_queries=set(['name:nobody']))['hits'], 0)
+        self.assertEqual(self.sb.count(u'*', narrow_queries=set(['name:nobody'])), 0)
+        
+        # Changing the index starts the cache afresh.
+        self.sb.remove(self.sample_objs[0])
+        parsed = []
+        self.assertEqual(self.sb.search(u'*', narrow_queries=set(['name:daniel1']))['hits'], 6)
+        self.assertEqual(len(parsed), 3)
+    
+    def test_narrow_while_matching(self):
+        # Several segments, each matched with its own searcher.
+        command = UpdateIndexCommand()
+        command.workers = 3
+        self.sb.parallel_update(self.smmi, command.split_queryset(self.sample_objs.order_by('pk'), 23), batch_size=5)
+        self.sb.index = self.sb.index.refresh()
+        self.assertEqual(len(self.sb.index._segments()), 3)
+        
+        filtered = []
+        filtered_query = self.sb._filtered_query
+        
+        def recording_filtered_query(searcher, parsed_query, narrowed_results):
+            query, narrowed_results = filtered_query(searcher, parsed_query, narrowed_results)
+            filtered.append(isinstance(query, whoosh_backend.FilteredQuery))
+            return query, narrowed_results
+        
+        self.sb._filtered_query = recording_filtered_query
+        
+        def run():
+            narrow_queries = set(['name:daniel3 OR name:daniel2'])
+            return (
+                self.sb.count(u'index*', narrow_queries=narrow_queries),
+                self.sb.search(u'index*', narrow_queries=narrow_queries)['hits'],
+                [result.pk for result in self.sb.search(u'index*', start_offset=3, end_offset=12, narrow_queries=narrow_queries)['results']],
+                [result.pk for result in self.sb.search(u'index*', sort_by=['-name', 'pub_date'], start_offset=5, end_offset=10, narrow_queries=narrow_queries)['results']],
+                [result.pk for result in self.sb.search(u'name:daniel3', narrow_queries=set(['name:daniel3 OR name:daniel1']))['results']],
+            )
+        
+        old_ratio = whoosh_backend.FILTERED_QUERY_RATIO
+        
+        try:
+            # Never narrow while matching...
+            whoosh_backend.FILTERED_QUERY_RATIO = 1000
+            checked = run()
+            self.assertFalse(True in filtered)
+            
+            # ...& always narrow while matching.
+            filtered = []
+            whoosh_backend.FILTERED_QUERY_RATIO = 0
+            self.assertEqual(run(), checked)
+            self.assertFalse(False in filtered)
+        finally:
+            whoosh_backend.FILTERED_QUERY_RATIO = old_ratio
+        
+        self.assertEqual(checked[0], 16)
+        self.assertEqual(checked[1], 16)
+        self.assertEqual(len(checked[2]), 9)
+        self.assertEqual(checked[3], [u'17', u'19', u'22', u'23', u'2'])
+        self.assertEqual(len(checked[4]), 9)
+        
+        # A narrowing that leaves few of the matches is done while matching.
+        filtered = []
+        self.assertEqual([result.pk for result in self.sb.search(u'index*', narrow_queries=set(['id:core.mockmodel.12']))['results']], [u'12'])
+        self.assertEqual(filtered, [True])
+    
+    def test_searcher_pool_concurrency(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        opened = []
+        hits = []
+        errors = []
+        
+        def counting_open(ix):
+            searcher = ix.searcher()
+            
+            if ix.indexname == self.sb.index.indexname:
+                opened.append(searcher)
+            
+            return searcher
+        
+        def run_queries():
+            try:
+                for i in xrange(20):
+                    hits.append(self.sb.search(u'*')['hits'])
+                    hits.append(self.sb.count(u'name:daniel1'))
+            except Exception, e:
+                errors.append(e)
+        
+        SEARCHERS._open = counting_open
+        old_pool_size = getattr(settings, 'HAYSTACK_WHOOSH_SEARCHER_POOL_SIZE', 4)
+        settings.HAYSTACK_WHOOSH_SEARCHER_POOL_SIZE = 8
+        
+        try:
+            threads = [threading.Thread(target=run_queries) for i in xrange(8)]
+            
+            for thread in threads:
+                thread.start()
+            
+            for thread in threads:
+                thread.join()
+        finally:
+            del(SEARCHERS._open)
+            settings.HAYSTACK_WHOOSH_SEARCHER_POOL_SIZE = old_pool_size
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(set(hits)), [7, 23])
+        self.assertEqual(len(hits), 320)
+        
+        # With room to keep them all, never more searchers than threads.
+        self.assert_(len(opened) <= 8)
+    
+    def buffer_writes(self, size, delay=60):
+        self.old_buffer_size = getattr(settings, 'HAYSTACK_WHOOSH_BUFFER_SIZE', 0)
+        self.old_buffer_delay = getattr(settings, 'HAYSTACK_WHOOSH_BUFFER_DELAY', 5)
+        settings.HAYSTACK_WHOOSH_BUFFER_SIZE = size
+        settings.HAYSTACK_WHOOSH_BUFFER_DELAY = delay
+    
+    def unbuffer_writes(self):
+        WRITES.discard(self.sb.index)
+        settings.HAYSTACK_WHOOSH_BUFFER_SIZE = self.old_buffer_size
+        settings.HAYSTACK_WHOOSH_BUFFER_DELAY = self.old_buffer_delay
+    
+    def test_buffered_writes(self):
+        self.buffer_writes(100)
+        
+        try:
+            generation = self.sb.index.latest_generation()
+            
+            for obj in self.sample_objs:
+                self.sb.update(self.smmi, [obj])
+            
+            self.sb.remove(self.sample_objs[0])
+            
+            # Nothing is written until it's flushed.
+            self.assertEqual(self.sb.search(u'*')['hits'], 0)
+            self.assertEqual(len(WRITES.pending), 1)
+            
+            self.sb.flush()
+            self.assertEqual(WRITES.pending, {})
+            self.assertEqual(WRITES.timers, {})
+            
+            # All of it in a single commit, with the removal winning out over
+            # the earlier update.
+            self.assertEqual(self.sb.index.refresh().latest_generation(), generation + 1)
+            self.assertEqual(self.sb.search(u'*')['hits'], 22)
+            self.assertEqual(self.sb.count(u'id:"core.mockmodel.1"'), 0)
+            
+            # And an update after a removal puts it back.
+            self.sb.remove(self.sample_objs[1])
+            self.sb.update(self.smmi, [self.sample_objs[1]])
+            self.sb.flush()
+            self.assertEqual(self.sb.search(u'*')['hits'], 22)
+            self.assertEqual(self.sb.count(u'id:"core.mockmodel.2"'), 1)
+        finally:
+            self.unbuffer_writes()
+    
+    def test_buffered_writes_generations(self):
+        self.buffer_writes(100)
+        old_timeout = getattr(settings, 'HAYSTACK_RESULT_CACHE_TIMEOUT', None)
+        settings.HAYSTACK_RESULT_CACHE_TIMEOUT = 60
+        
+        try:
+            generation = get_generations([MockModel])[0]
+            self.assertEqual(self.sb.defers_updates(), True)
+            
+            # Buffered changes aren't searchable, so the generation waits for
+            # the commit.
+            self.smmi.update_object(self.sample_objs[0])
+            self.smmi.remove_object(self.sample_objs[1])
+            self.assertEqual(get_generations([MockModel])[0], generation)
+            
+            self.sb.flush()
+            self.assertEqual(get_generations([MockModel])[0], generation + 1)
+        finally:
+            settings.HAYSTACK_RESULT_CACHE_TIMEOUT = old_timeout
+            self.unbuffer_writes()
+    
+    def test_buffered_writes_size(self):
+        self.buffer_writes(10)
+        
+        try:
+            generation = self.sb.index.latest_generation()
+            self.sb.update(self.smmi, self.sample_objs)
+            
+            # Two batches of ten went out, the last three are still waiting.
+            self.assertEqual(self.sb.index.refresh().latest_generation(), generation + 2)
+            self.assertEqual(self.sb.search(u'*')['hits'], 20)
+            
+            self.sb.flush()
+            self.assertEqual(self.sb.search(u'*')['hits'], 23)
+        finally:
+            self.unbuffer_writes()
+    
+    def test_buffered_writes_delay(self):
+        self.buffer_writes(100, delay=0.1)
+        
+        try:
+            self.sb.update(self.smmi, self.sample_objs)
+            timer = WRITES.timers.values()[0]
+            timer.join(5)
+            
+            # Committed from the timer's thread, without a flush.
+            self.assertEqual(WRITES.pending, {})
+            self.assertEqual(self.sb.search(u'*')['hits'], 23)
+        finally:
+            self.unbuffer_writes()
+    
+    def test_buffered_writes_failure(self):
+        self.buffer_writes(100)
+        failures = []
+        old_update_document = whoosh_backend.AsyncWriter.update_document
+        
+        def failing_update_document(writer, **fields):
+            if not failures:
+                failures.append(fields['id'])
+                raise IOError("Disk full.")
+            
+            return old_update_document(writer, **fields)
+        
+        whoosh_backend.AsyncWriter.update_document = failing_update_document
+        
+        try:
+            self.sb.update(self.smmi, self.sample_objs[:10])
+            self.assertRaises(IOError, self.sb.flush)
+            
+            # The changes are kept (behind any made since) & the index isn't
+            # left locked.
+            self.sb.remove(self.sample_objs[0])
+            self.assertEqual(len(WRITES.pending.values()[0][2]), 10)
+            self.assertEqual(WRITES.pending.values()[0][2]['core.mockmodel.1'], None)
+            self.sb.index.writer().cancel()
+            
+            self.sb.flush()
+            self.assertEqual(WRITES.pending, {})
+            self.assertEqual(self.sb.search(u'*')['hits'], 9)
+            
+            # From the timer's thread, they're tried again after another delay.
+            del failures[:]
+            settings.HAYSTACK_WHOOSH_BUFFER_DELAY = 0.1
+            self.sb.update(self.smmi, self.sample_objs[10:])
+            settings.HAYSTACK_WHOOSH_BUFFER_DELAY = 60
+            WRITES.timers.values()[0].join(5)
+            self.assertEqual(len(failures), 1)
+            self.assertEqual(len(WRITES.timers), 1)
+            self.assertEqual(len(WRITES.pending.values()[0][2]), 13)
+            
+            self.sb.flush()
+            self.assertEqual(WRITES.pending, {})
+            self.assertEqual(self.sb.search(u'*')['hits'], 22)
+        finally:
+            whoosh_backend.AsyncWriter.update_document = old_update_document
+            self.unbuffer_writes()
+    
+    def test_buffered_writes_delete_index(self):
+        self.buffer_writes(100)
+        
+        try:
+            self.sb.update(self.smmi, self.sample_objs)
+            self.sb.clear()
+            self.assertEqual(WRITES.pending, {})
+            
+            self.sb.flush()
+            self.assertEqual(self.sb.search(u'*')['hits'], 0)
+        finally:
+            self.unbuffer_writes()
+    
+    def test_parallel_update(self):
+        command = UpdateIndexCommand()
+        command.workers = 3
+        querysets = command.split_queryset(self.sample_objs.order_by('pk'), 23)
+        self.assertEqual([qs.count() for qs in querysets], [8, 8, 7])
+        
+        generation = self.sb.index.latest_generation()
+        self.sb.parallel_update(self.smmi, querysets, batch_size=5)
+        
+        # A segment per worker, all added in the same commit.
+        self.sb.index = self.sb.index.refresh()
+        self.assertEqual(self.sb.index.latest_generation(), generation + 1)
+        self.assertEqual(len(self.sb.index._segments()), 3)
+        self.assertEqual(self.sb.search(u'*')['hits'], 23)
+        self.assertEqual([result.pk for result in self.sb.search(u'*', sort_by=['id'])['results']][:3], [u'1', u'10', u'11'])
+        
+        # Indexing again replaces what's there, rather than adding to it.
+        self.sb.parallel_update(self.smmi, querysets)
+        self.assertEqual(self.sb.search(u'*')['hits'], 23)
+        self.assertEqual(self.sb.count(u'id:"core.mockmodel.1"'), 1)
+        
+        # Failures in the workers come back to the caller.
+        self.assertRaises(SearchBackendError, self.sb.parallel_update, self.smmi, [self.sample_objs, AnotherMockModel.objects.all()])
+        self.assertEqual(self.sb.search(u'*')['hits'], 23)
+        
+        # Other versions of Whoosh index each queryset in turn, a commit per batch.
+        old_versions = whoosh_backend.PARALLEL_WHOOSH_VERSIONS
+        whoosh_backend.PARALLEL_WHOOSH_VERSIONS = []
+        
+        try:
+            self.sb.clear()
+            generation = self.sb.index.refresh().latest_generation()
+            self.sb.parallel_update(self.smmi, querysets, batch_size=5)
+            self.assertEqual(self.sb.index.refresh().latest_generation(), generation + 6)
+            self.assertEqual(self.sb.search(u'*')['hits'], 23)
+        finally:
+            whoosh_backend.PARALLEL_WHOOSH_VERSIONS = old_versions
+    
+    def spelling_words(self):
+        searcher = SpellChecker(self.sb.storage).index().searcher()
+        
+        try:
+            return sorted([fields['word'] for fields in searcher.all_stored_fields()])
+        finally:
+            searcher.close()
+    
+    def test_spelling_dictionary(self):
+        # The first batch starts the dictionary off.
+        self.sb.update(self.smmi, self.sample_objs[:10])
+        self.assertEqual(self.spelling_words(), [u'10', u'index'])
+        
+        # Later ones only add the words the index didn't have.
+        self.sb.update(self.smmi, self.sample_objs[10:])
+        self.assertEqual(self.spelling_words(), [u'%s' % i for i in xrange(10, 24)] + [u'index'])
+        
+        self.sb.update(self.smmi, self.sample_objs)
+        self.assertEqual(len(self.spelling_words()), 15)
+        
+        # As do buffered writes & parallel builds.
+        self.sb.delete_index()
+        self.buffer_writes(100)
+        
+        try:
+            self.sb.update(self.smmi, self.sample_objs[:10])
+            self.sb.flush()
+            self.sb.update(self.smmi, self.sample_objs[:15])
+            self.sb.flush()
+            self.assertEqual(self.spelling_words(), [u'10', u'11', u'12', u'13', u'14', u'15', u'index'])
+        finally:
+            self.unbuffer_writes()
+        
+        self.sb.parallel_update(self.smmi, [self.sample_objs.filter(pk__lte=20), self.sample_objs.filter(pk__gt=20)])
+        self.assertEqual(self.spelling_words(), [u'%s' % i for i in xrange(10, 24)] + [u'index'])
+        self.assertEqual(self.sb.search(u'Indx')['spelling_suggestion'], u'index')
+    
+    def test_spelling_suggestion_cache(self):
+        suggested = []
+        old_suggest = PooledSpellChecker.suggest
+        
+        def counting_suggest(sp, text, number=3, usescores=False):
+            suggested.append(text)
+            return old_suggest(sp, text, number, usescores)
+        
+        PooledSpellChecker.suggest = counting_suggest
+        SUGGESTIONS.clear()
+        
+        try:
+            self.sb.update(self.smmi, self.sample_objs[:10])
+            self.assertEqual(self.sb.create_spelling_suggestion(u'Indx'), u'index')
+            self.assertEqual(self.sb.create_spelling_suggestion(u'Indx'), u'index')
+            self.assertEqual(suggested, [u'Indx'])
+            
+            # New words in the dictionary mean asking again.
+            self.sb.update(self.smmi, self.sample_objs[10:])
+            self.assertEqual(self.sb.create_spelling_suggestion(u'Indx'), u'index')
+            self.assertEqual(suggested, [u'Indx', u'Indx'])
+        finally:
+            PooledSpellChecker.suggest = old_suggest
+            SUGGESTIONS.clear()
+    
+    def test_snapshot_storage(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        
+        # Stow.
+        old_whoosh_storage = getattr(settings, 'HAYSTACK_WHOOSH_STORAGE', 'file')
+        old_snapshot_interval = getattr(settings, 'HAYSTACK_WHOOSH_SNAPSHOT_INTERVAL', 1)
+        settings.HAYSTACK_WHOOSH_STORAGE = 'snapshot'
+        settings.HAYSTACK_WHOOSH_SNAPSHOT_INTERVAL = 0
+        
+        try:
+            sb = SearchBackend(site=self.site)
+            sb.setup()
+            self.assertEqual(sb.search(u'index*')['hits'], 23)
+            self.assertEqual(sb.search(u'Indx')['spelling_suggestion'], u'index')
+            
+            # Searches are served from memory.
+            snapshot = sb._search_index()
+            self.assert_(isinstance(snapshot.storage, RamStorage))
+            self.assert_(SNAPSHOTS.storage(settings.HAYSTACK_WHOOSH_PATH) is snapshot.storage)
+            
+            # A newer version on disk is swapped in, & the old one let go.
+            self.sb.remove(self.sample_objs[0])
+            self.assertEqual(sb.search(u'index*')['hits'], 22)
+            self.assert_(sb._search_index().storage is not snapshot.storage)
+            self.assertFalse(whoosh_backend.index_key(snapshot) in SEARCHERS.idle)
+            
+            # Between checks, searches stick with the snapshot they have.
+            settings.HAYSTACK_WHOOSH_SNAPSHOT_INTERVAL = 60
+            self.assertEqual(sb.search(u'index*')['hits'], 22)
+            self.sb.remove(self.sample_objs[1])
+            self.assertEqual(sb.search(u'index*')['hits'], 22)
+            self.assertEqual(self.sb.search(u'index*')['hits'], 21)
+        finally:
+            SNAPSHOTS.clear(settings.HAYSTACK_WHOOSH_PATH)
+            settings.HAYSTACK_WHOOSH_STORAGE = old_whoosh_storage
+            settings.HAYSTACK_WHOOSH_SNAPSHOT_INTERVAL = old_snapshot_interval
+    
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        
+        # 'b' is the least recently used.
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        
+        cache.set('a', 4)
+        cache.set('d', 5)
+        self.assertEqual(cache.get('c', 'missing'), 'missing')
+        self.assertEqual(cache.get('a'), 4)
+        
+        cache = LRUCache(0)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), None)
+    
+    def test_facets(self):
+        self.site.unregister(MockModel)
+        self.site.register(MockModel, WhooshFacetMockSearchIndex)
+        self.sb.setup()
+        self.sb.update(self.site.get_index(MockModel), self.sample_objs)
+        
+        results = self.sb.search(u'index*', facets=['name_exact'])
+        self.assertEqual(results['hits'], 23)
+        self.assertEqual(results['facets']['fields'], {'name_exact': [(u'daniel3', 9), (u'daniel1', 7), (u'daniel2', 7)]})
+        
+        # Counts only cover the documents matched.
+        results = self.sb.search(u'index*', facets=['name_exact'], narrow_queries=set(['name_exact:daniel1']))
+        self.assertEqual(results['hits'], 7)
+        self.assertEqual(results['facets']['fields'], {'name_exact': [(u'daniel1', 7)]})
+        
+        results = self.sb.search(u'index*', date_facets={'pub_date': {'start_date': date(2009, 6, 1), 'end_date': datetime(2009, 7, 17, 3), 'gap_by': 'month', 'gap_amount': 1}})
+        self.assertEqual(results['facets']['dates'], {'pub_date': [(datetime(2009, 6, 1), 2), (datetime(2009, 7, 1), 3)]})
+        
+        results = self.sb.search(u'index*', date_facets={'pub_date': {'start_date': datetime(2009, 7, 17), 'end_date': datetime(2009, 7, 17, 3), 'gap_by': 'hour', 'gap_amount': 2}})
+        self.assertEqual(results['facets']['dates'], {'pub_date': [(datetime(2009, 7, 17), 2), (datetime(2009, 7, 17, 2), 1)]})
+        
+        results = self.sb.search(u'index*', query_facets=[('name_exact', 'daniel2'), ('pub_date', '[20090701 TO 20090801]')])
+        self.assertEqual(results['facets']['queries'], {u'name_exact:daniel2': 7, u'pub_date:[20090701 TO 20090801]': 21})
+        
+        # The terms are only gathered once per version of the index.
+        values = []
+        facet_value = self.sb._facet_value
+        
+        def counting_facet_value(field, text):
+            values.append(text)
+            return facet_value(field, text)
+        
+        self.sb._facet_value = counting_facet_value
+        self.sb.search(u'index*', facets=['name_exact'])
+        self.assertEqual(values, [])
+        
+        self.sb.remove(self.sample_objs[0])
+        results = self.sb.search(u'index*', facets=['name_exact'])
+        self.assertEqual(results['facets']['fields'], {'name_exact': [(u'daniel3', 9), (u'daniel2', 7), (u'daniel1', 6)]})
+        self.assertEqual(len(values), 3)
+    
     def test_more_like_this(self):
         self.sb.update(self.smmi, self.sample_objs)
         self.assertEqual(len(self.whoosh_search(u'*')), 23)
         
-        # Unsupported by Whoosh. Should see empty results.
+        # Every document shares the one key term, so all the others match.
+        results = self.sb.more_like_this(self.sample_objs[0])
+        self.assertEqual(results['hits'], 22)
+        self.assertEqual(sorted([int(result.pk) for result in results['results']]), range(2, 24))
+        
+        results = self.sb.more_like_this(self.sample_objs[0], additional_query_string=u'name:daniel3', end_offset=5)
+        self.assertEqual(results['hits'], 9)
+        self.assertEqual(len(results['results']), 5)
+        
+        # The key terms are cached alongside the text they came from...
+        cache_key = ((self.sb.index.storage.folder, 'MAIN'), 'core.mockmodel.1', 'text')
+        text, key_terms = KEY_TERMS.get(cache_key)
+        self.assertEqual(text, u'Indexed!\n1')
+        self.assertEqual([term for term, weight in key_terms], [u'index'])
+        
+        KEY_TERMS.set(cache_key, (text, [(u'nothing', 1.0)]))
         self.assertEqual(self.sb.more_like_this(self.sample_objs[0])['hits'], 0)
+        
+        # ... & worked out afresh once the text changes.
+        KEY_TERMS.set(cache_key, (u'Something else', [(u'nothing', 1.0)]))
+        self.assertEqual(self.sb.more_like_this(self.sample_objs[0])['hits'], 22)
+        
+        # Documents that aren't in the index have nothing like them.
+        self.sb.remove(self.sample_objs[0])
+        self.assertEqual(self.sb.more_like_this(self.sample_objs[0]), {'hits': 0, 'results': []})
     
     def test_delete_index(self):
         self.sb.update(self.smmi, self.sample_objs)
@@ -221,6 +1061,30 @@ class WhooshSearchBackendTestCase(TestCase):
         results = self.sb.search(u'*', sort_by=['-id'])
         self.assertEqual([result.pk for result in results['results']], [u'9', u'8', u'7', u'6', u'5', u'4', u'3', u'23', u'22', u'21', u'20', u'2', u'19', u'18', u'17', u'16', u'15', u'14', u'13', u'12', u'11', u'10', u'1'])
     
+    def test_order_by_multiple_fields(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        
+        results = self.sb.search(u'*', sort_by=['name', '-pub_date'])
+        self.assertEqual([result.pk for result in results['results']], [u'18', u'11', u'9', u'7', u'6', u'5', u'1', u'21', u'20', u'15', u'14', u'12', u'8', u'2', u'23', u'22', u'19', u'17', u'16', u'13', u'10', u'4', u'3'])
+        
+        results = self.sb.search(u'*', sort_by=['-name', 'pub_date'], end_offset=5)
+        self.assertEqual(results['hits'], 23)
+        self.assertEqual([result.pk for result in results['results']], [u'3', u'4', u'10', u'13', u'16'])
+        
+        results = self.sb.search(u'*', sort_by=['-name', 'pub_date'], start_offset=5, end_offset=10, narrow_queries=set(['name:daniel3 OR name:daniel2']))
+        self.assertEqual(results['hits'], 16)
+        self.assertEqual([result.pk for result in results['results']], [u'17', u'19', u'22', u'23', u'2'])
+        
+        chunks = list(self.sb.iter_search(u'*', chunk_size=4, sort_by=['-name', '-pub_date'], end_offset=6))
+        self.assertEqual([[result.pk for result in chunk] for chunk in chunks], [[u'23', u'22', u'19', u'17'], [u'16', u'13']])
+        
+        # The sort keys follow changes to the index.
+        self.sb.remove(self.sample_objs[17])
+        results = self.sb.search(u'*', sort_by=['name', '-pub_date'], end_offset=3)
+        self.assertEqual([result.pk for result in results['results']], [u'11', u'9', u'7'])
+        
+        self.assertRaises(SearchBackendError, self.sb.search, u'*', sort_by=['-nonexistent', 'name'])
+    
     def test__from_python(self):
         self.assertEqual(self.sb._from_python('abc'), u'abc')
         self.assertEqual(self.sb._from_python(1), 1)
@@ -372,6 +1236,50 @@ class LiveWhooshSearchQueryTestCase(TestCase):
         self.sq.add_filter(SQ(content='Indx'))
         self.assertEqual(self.sq.get_spelling_suggestion(), u'index')
     
+    def test_build_final_query(self):
+        parsed = []
+        parse = self.sb.parser.parse
+        
+        def counting_parse(query_string):
+            parsed.append(query_string)
+            return parse(query_string)
+        
+        self.sb.parser.parse = counting_parse
+        
+        self.sq.add_filter(SQ(content='why') | SQ(content='hello'))
+        self.sq.add_filter(~SQ(content='world'))
+        self.sq.add_filter(SQ(content=self.sq.clean('hello-world')))
+        self.sq.add_filter(SQ(content='Indexed things'))
+        self.sq.add_filter(SQ(name__in=['daniel1', 'Daniel Lindsley']))
+        self.sq.add_filter(SQ(name__startswith='dan'))
+        self.sq.add_filter(SQ(name__gte='B'))
+        self.sq.add_model(MockModel)
+        self.sq.add_boost('world', 5)
+        final_query = self.sq.build_final_query()
+        
+        # The query the parser would make of the string, without parsing it.
+        self.assertEqual(final_query, self.sq.build_query())
+        self.assertEqual(final_query.query, parse(final_query))
+        self.assertEqual(parsed, [])
+        
+        # The same query again, even from a copy, comes from the cache.
+        self.assertTrue(self.sq.build_final_query() is final_query)
+        self.assertTrue(self.sq._clone().build_final_query() is final_query)
+        
+        # Values holding query syntax are left to the parser.
+        sq = SearchQuery(backend=self.sb)
+        sq.add_filter(SQ(content='hello*'))
+        self.assertEqual(sq.build_final_query().query, parse(u'hello*'))
+        self.assertEqual(parsed, [u'hello*'])
+        
+        # Unlike with the parser, a leading NOT isn't lost & matching
+        # everything doesn't need the content field.
+        sq = SearchQuery(backend=self.sb)
+        sq.add_filter(~SQ(content='hello'))
+        sq.add_filter(~SQ(content='world'))
+        self.assertEqual(sq.build_final_query().query, And([Not(Term(u'text', u'hello')), Not(Term(u'text', u'world'))]))
+        self.assertEqual(SearchQuery(backend=self.sb).build_final_query().query, Every())
+    
     def test_log_query(self):
         from django.conf import settings
         from haystack import backends
@@ -495,6 +1403,16 @@ class LiveWhooshSearchQuerySetTestCase(TestCase):
         self.assertEqual(sqs.query.build_query(), u'django_ct:core.mockmodel')
         self.assertEqual(len(sqs), 3)
     
+    def test_more_like_this(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        
+        mlt = self.sqs.more_like_this(self.sample_objs[0])
+        self.assertEqual(len(mlt), 2)
+        self.assertEqual(sorted([result.pk for result in mlt]), [u'2', u'3'])
+        
+        mlt = self.sqs.filter(name='daniel3').more_like_this(self.sample_objs[0])
+        self.assertEqual([result.pk for result in mlt], [u'3'])
+    
     def test_all_regression(self):
         sqs = SearchQuerySet()
         self.assertEqual([result.pk for result in sqs], [])
@@ -581,6 +1499,38 @@ class LiveWhooshSearchQuerySetTestCase(TestCase):
         self.assertEqual(results._cache_is_full(), True)
         self.assertEqual(len(backends.queries), 1)
     
+    def test_iterator(self):
+        self.sb.update(self.smmi, self.sample_objs)
+        
+        sqs = self.sqs.all()
+        self.assertEqual(sorted([int(result.pk) for result in sqs.iterator(chunk_size=2)]), [1, 2, 3])
+        self.assertEqual(len(sqs._result_cache), 0)
+        
+        self.assertEqual([int(result.pk) for result in self.sqs.filter(name='daniel2').iterator()], [2])
+    
+    def test_multi_search(self):
+        from haystack.query import multi_search
+        self.sb.update(self.smmi, self.sample_objs)
+        
+        querysets = [
+            self.sqs.filter(name='daniel1'),
+            self.sqs.all(),
+            self.sqs.filter(name='daniel3'),
+        ]
+        original_backends = [sqs.query.backend for sqs in querysets]
+        backends.reset_search_queries()
+        multi_search(querysets)
+        
+        # Every query went through the first query's backend & searcher.
+        self.assertEqual(len(backends.queries), 3)
+        self.assertEqual(querysets[0].query.backend._batch_searcher, None)
+        self.assertEqual([sqs.query.backend for sqs in querysets], original_backends)
+        
+        self.assertEqual([result.pk for result in querysets[0]], [u'1'])
+        self.assertEqual(sorted([result.pk for result in querysets[1]]), [u'1', u'2', u'3'])
+        self.assertEqual([result.pk for result in querysets[2]], [u'3'])
+        self.assertEqual(len(backends.queries), 3)
+    
     def test_count(self):
         more_samples = []
         
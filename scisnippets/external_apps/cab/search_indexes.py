@@ -33,4 +33,7 @@ class SnippetIndex(SearchIndex):
     def get_updated_field(self):
         return 'updated_date'
 
+    def load_all_queryset(self):
+        return Snippet.objects.select_related('author', 'language')
+
 site.register(Snippet, SnippetIndex)
@@ -3,12 +3,16 @@ from copy import deepcopy
 from time import time
 from django.conf import settings
 from django.core import signals
+from django.core.cache import cache
 from django.db.models import Q
 from django.db.models.base import ModelBase
 from django.utils import tree
-from django.utils.encoding import force_unicode
+from django.utils.encoding import force_unicode, smart_str
+from django.utils.hashcompat import md5_constructor
 from haystack.constants import VALID_FILTERS, FILTER_SEPARATOR
 from haystack.exceptions import SearchBackendError, MoreLikeThisError, FacetingError
+from haystack.models import ResultConverter
+from haystack.utils import get_generations
 try:
     set
 except NameError:
@@ -99,6 +103,47 @@ class BaseSearchBackend(object):
         """
         raise NotImplementedError
     
+    def remove_many(self, identifiers, commit=True):
+        """
+        Removes a collection of documents/objects from the backend, given as
+        model instances and/or identifiers.
+        
+        Backends that can remove many documents at once should override this.
+        By default, each one is removed in turn.
+        """
+        for obj_or_string in identifiers:
+            self.remove(obj_or_string)
+    
+    def defers_updates(self):
+        """
+        Returns whether updates/removals are held on to and written later
+        (until ``flush`` at the latest), rather than as they are made.
+        
+        Backends that defer them must bump the generations of the models
+        involved (see ``haystack.utils.bump_generations``) once the changes
+        are searchable, as cached results can't be invalidated before then.
+        """
+        return False
+    
+    def iter_ids(self, model, chunk_size=1000):
+        """
+        Yields the primary key (as a string) of each document stored in the
+        backend for ``model``, in no particular order. Documents may be
+        removed while iterating, without any of the rest being skipped.
+        
+        Backends that can read the stored ids directly, without building
+        results, should override this. By default, the model's documents are
+        paged through with a ``SearchQuerySet``. Those pages are by offset,
+        which removals would shift, so every pk is read before the first is
+        yielded.
+        """
+        from haystack.query import SearchQuerySet
+        
+        pks = [smart_str(result.pk) for result in SearchQuerySet(site=self.site).models(model).iterator(chunk_size=chunk_size)]
+        
+        for pk in pks:
+            yield pk
+    
     def clear(self, models=[], commit=True):
         """
         Clears the backend of all documents/objects for a collection of models.
@@ -108,6 +153,30 @@ class BaseSearchBackend(object):
         """
         raise NotImplementedError
     
+    def flush(self):
+        """
+        Writes out any updates/removals the backend is holding on to.
+        
+        Backends that buffer changes should override this. By default, changes
+        are written as they are made, so there is nothing to do.
+        """
+        pass
+    
+    def parallel_update(self, index, querysets, batch_size=1000):
+        """
+        Indexes everything in a list of querysets that don't overlap (such as
+        the primary key ranges ``update_index --workers`` splits a model into).
+        
+        Backends that can index in several processes at once should override
+        this. By default, each queryset is sent to ``update`` in turn, in
+        batches of ``batch_size``.
+        """
+        from haystack.utils import queryset_batches
+        
+        for qs in querysets:
+            for batch in queryset_batches(qs, batch_size):
+                self.update(index, batch)
+    
     @log_query
     def search(self, query_string, sort_by=None, start_offset=0, end_offset=None,
                fields='', highlight=False, facets=None, date_facets=None, query_facets=None,
@@ -128,6 +197,58 @@ class BaseSearchBackend(object):
         """
         raise NotImplementedError
     
+    def count(self, query_string, narrow_queries=None,
+              limit_to_registered_models=None, **kwargs):
+        """
+        Takes a query to search on and returns the number of matched results.
+        
+        Backends should override this to fetch just the count, without
+        loading any documents. By default, this runs a normal ``search`` for
+        a single result and returns its ``hits``.
+        """
+        kwargs['start_offset'] = 0
+        kwargs['end_offset'] = 1
+        results = self.search(query_string, narrow_queries=narrow_queries, limit_to_registered_models=limit_to_registered_models, **kwargs)
+        return results.get('hits', 0)
+    
+    def iter_search(self, query_string, chunk_size=100, start_offset=0,
+                    end_offset=None, **kwargs):
+        """
+        Takes a query to search on and yields its results as lists of up to
+        ``chunk_size`` ``SearchResult`` objects, without holding on to them.
+        
+        Backends with a cheaper way to walk deep into a result set should
+        override this. By default, the total is fetched with ``count`` and
+        ``search`` is called for each chunk in turn.
+        """
+        total = self.count(query_string, **kwargs)
+        
+        if end_offset is not None:
+            total = min(total, end_offset)
+        
+        start = start_offset or 0
+        
+        while start < total:
+            end = min(start + chunk_size, total)
+            results = self.search(query_string, start_offset=start, end_offset=end, **kwargs)
+            chunk = results.get('results', [])
+            
+            if chunk:
+                yield chunk
+            
+            start = end
+    
+    def run_batch(self, queries):
+        """
+        Executes a batch of independent ``SearchQuery`` objects (as used by
+        ``haystack.query.multi_search``), leaving the results stored on each.
+        
+        Backends that can run several queries more efficiently than one at a
+        time should override this. By default, the queries are run in turn.
+        """
+        for query in queries:
+            query.get_results()
+    
     def prep_value(self, value):
         """
         Hook to give the backend a chance to prep an attribute value before
@@ -153,6 +274,23 @@ class BaseSearchBackend(object):
         """
         raise NotImplementedError("Subclasses must provide a way to build their schema.")
     
+    def build_result_converter(self, index):
+        """
+        Builds the ``ResultConverter`` that turns the raw documents this
+        backend returns for the index's model into ``SearchResult`` fields.
+        
+        The site caches what this returns per model, so it's not called per
+        hit. Backends should override this to account for how they store
+        particular field types.
+        """
+        converters = {}
+        
+        for field_name, field in index.fields.items():
+            if hasattr(field, 'convert'):
+                converters[field_name] = field.convert
+        
+        return ResultConverter(converters, exclude=('django_ct', 'django_id'))
+    
     def build_registered_models_list(self):
         """
         Builds a list of registered models for searching.
@@ -354,12 +492,83 @@ class BaseSearchQuery(object):
         
         return kwargs
     
+    def _search(self, query_string, **kwargs):
+        """
+        Hands the query off to the backend's ``search``.
+        
+        If ``HAYSTACK_RESULT_CACHE_TIMEOUT`` is set, the backend's response is
+        stored in Django's cache and identical searches are answered from
+        there until the timeout expires or any of the models involved is
+        reindexed.
+        """
+        timeout = getattr(settings, 'HAYSTACK_RESULT_CACHE_TIMEOUT', None)
+        
+        if not timeout:
+            return self.backend.search(query_string, **kwargs)
+        
+        cache_key = self.get_result_cache_key(query_string, **kwargs)
+        results = cache.get(cache_key)
+        
+        if results is None:
+            results = self.backend.search(query_string, **kwargs)
+            cache.set(cache_key, results, timeout)
+        
+        return results
+    
+    def _count(self, query_string, **kwargs):
+        """
+        Hands the query off to the backend's ``count``, caching the number
+        the same way ``_search`` caches full responses.
+        """
+        timeout = getattr(settings, 'HAYSTACK_RESULT_CACHE_TIMEOUT', None)
+        
+        if not timeout:
+            return self.backend.count(query_string, **kwargs)
+        
+        cache_key = "%s.count" % self.get_result_cache_key(query_string, **kwargs)
+        hits = cache.get(cache_key)
+        
+        if hits is None:
+            hits = self.backend.count(query_string, **kwargs)
+            cache.set(cache_key, hits, timeout)
+        
+        return hits
+    
+    def get_result_cache_key(self, query_string, **kwargs):
+        """
+        Builds the cache key for a search from the query, its parameters and
+        the index generations of the models that could be in the results.
+        """
+        if self.models:
+            models = list(self.models)
+        else:
+            models = self.backend.site.get_indexed_models()
+        
+        models = sorted(models, key=lambda model: str(model._meta))
+        bits = [self.backend.__class__.__module__, smart_str(query_string)]
+        
+        for key in sorted(kwargs.keys()):
+            value = kwargs[key]
+            
+            # Ensure the order of unordered params doesn't matter.
+            if isinstance(value, (set, frozenset)):
+                value = sorted(value)
+            elif isinstance(value, dict):
+                value = sorted(value.items())
+            
+            bits.append("%s=%r" % (key, value))
+        
+        for model, generation in zip(models, get_generations(models)):
+            bits.append("%s=%s" % (model._meta, generation))
+        
+        return "haystack_results.%s" % md5_constructor("|".join(bits)).hexdigest()
+    
     def run(self, spelling_query=None):
         """Builds and executes the query. Returns a list of search results."""
-        final_query = self.build_query()
+        final_query = self.build_final_query()
         kwargs = self.build_params(spelling_query=spelling_query)
         
-        results = self.backend.search(final_query, **kwargs)
+        results = self._search(final_query, **kwargs)
         self._results = results.get('results', [])
         self._hit_count = results.get('hits', 0)
         self._facet_counts = self.post_process_facets(results)
@@ -373,7 +582,7 @@ class BaseSearchQuery(object):
         if self._more_like_this is False or self._mlt_instance is None:
             raise MoreLikeThisError("No instance was provided to determine 'More Like This' results.")
         
-        additional_query_string = self.build_query()
+        additional_query_string = self.build_final_query()
         results = self.backend.more_like_this(self._mlt_instance, additional_query_string)
         self._results = results.get('results', [])
         self._hit_count = results.get('hits', 0)
@@ -383,33 +592,70 @@ class BaseSearchQuery(object):
         kwargs = self.build_params()
         kwargs.update(self._raw_query_params)
         
-        results = self.backend.search(self._raw_query, **kwargs)
+        results = self._search(self._raw_query, **kwargs)
         self._results = results.get('results', [])
         self._hit_count = results.get('hits', 0)
         self._facet_counts = results.get('facets', {})
         self._spelling_suggestion = results.get('spelling_suggestion', None)
     
+    def run_count(self):
+        """
+        Executes the query, only asking the backend for the number of matched
+        results. No results are fetched or stored.
+        """
+        kwargs = {}
+        
+        if self.narrow_queries:
+            kwargs['narrow_queries'] = self.narrow_queries
+        
+        if self._raw_query:
+            query_string = self._raw_query
+            kwargs.update(self._raw_query_params)
+        else:
+            query_string = self.build_final_query()
+        
+        self._hit_count = self._count(query_string, **kwargs)
+    
+    def iter_results(self, chunk_size=100):
+        """
+        Executes the query, yielding the results in lists of up to
+        ``chunk_size`` without storing them on the query. Any limits set on
+        the query are respected.
+        """
+        if self._more_like_this:
+            # Special case for MLT, which comes back in one piece.
+            yield self.get_results()
+            return
+        
+        kwargs = self.build_params()
+        
+        if self._raw_query:
+            query_string = self._raw_query
+            kwargs.update(self._raw_query_params)
+        else:
+            query_string = self.build_final_query()
+        
+        for chunk in self.backend.iter_search(query_string, chunk_size=chunk_size, **kwargs):
+            yield chunk
+    
     def get_count(self):
         """
         Returns the number of results the backend found for the query.
         
-        If the query has not been run, this will execute the query and store
-        the results.
+        If the query has not been run, this will ask the backend for just the
+        count and store it.
         """
         if self._hit_count is None:
-            # Limit the slice to 10 so we get a count without consuming
-            # everything.
-            if not self.end_offset:
-                self.end_offset = 10
-            
             if self._more_like_this:
-                # Special case for MLT.
+                # Special case for MLT, which has no count-only mode. Limit
+                # the slice to 10 so we get a count without consuming
+                # everything.
+                if not self.end_offset:
+                    self.end_offset = 10
+                
                 self.run_mlt()
-            elif self._raw_query:
-                # Special case for raw queries.
-                self.run_raw()
             else:
-                self.run()
+                self.run_count()
         
         return self._hit_count
     
@@ -496,6 +742,16 @@ class BaseSearchQuery(object):
         
         return final_query
     
+    def build_final_query(self):
+        """
+        Builds the query handed to the backend when the query is run.
+        
+        By default, this is the string from ``build_query``. Backends that can
+        make use of the query tree directly may return more, so long as it
+        still behaves as that string.
+        """
+        return self.build_query()
+    
     def combine(self, rhs, connector=SQ.AND):
         if connector == SQ.AND:
             self.add_filter(rhs.query_filter)
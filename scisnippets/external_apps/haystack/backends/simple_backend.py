@@ -38,6 +38,15 @@ class SearchBackend(BaseSearchBackend):
             logger.warning('remove is not implemented in this backend')
         pass
     
+    def remove_many(self, identifiers, commit=True):
+        if settings.DEBUG:
+            logger.warning('remove_many is not implemented in this backend')
+        pass
+    
+    def iter_ids(self, model, chunk_size=1000):
+        # Searches run against the database itself, so nothing is stored.
+        return iter([])
+    
     def clear(self, models=[], commit=True):
         if settings.DEBUG:
             logger.warning('clear is not implemented in this backend')
@@ -52,24 +61,7 @@ class SearchBackend(BaseSearchBackend):
         results = []
         
         if query_string:
-            for model in self.site.get_indexed_models():
-                if query_string == '*':
-                    qs = model.objects.all()
-                else:
-                    for term in query_string.split():
-                        queries = []
-                        
-                        for field in model._meta._fields():
-                            if hasattr(field, 'related'):
-                                continue
-                            
-                            if not field.get_internal_type() in ('TextField', 'CharField', 'SlugField'):
-                                continue
-                            
-                            queries.append(Q(**{'%s__icontains' % field.name: term}))
-                        
-                        qs = model.objects.filter(reduce(lambda x, y: x|y, queries))
-                
+            for qs in self._querysets(query_string):
                 hits += len(qs)
                 
                 for match in qs:
@@ -84,6 +76,39 @@ class SearchBackend(BaseSearchBackend):
             'hits': hits,
         }
     
+    @log_query
+    def count(self, query_string, narrow_queries=None,
+              limit_to_registered_models=None, **kwargs):
+        hits = 0
+        
+        if query_string:
+            for qs in self._querysets(query_string):
+                hits += qs.count()
+        
+        return hits
+    
+    def _querysets(self, query_string):
+        """Yields a ``QuerySet`` of matches for each indexed model."""
+        for model in self.site.get_indexed_models():
+            if query_string == '*':
+                qs = model.objects.all()
+            else:
+                for term in query_string.split():
+                    queries = []
+                    
+                    for field in model._meta._fields():
+                        if hasattr(field, 'related'):
+                            continue
+                        
+                        if not field.get_internal_type() in ('TextField', 'CharField', 'SlugField'):
+                            continue
+                        
+                        queries.append(Q(**{'%s__icontains' % field.name: term}))
+                    
+                    qs = model.objects.filter(reduce(lambda x, y: x|y, queries))
+            
+            yield qs
+    
     def prep_value(self, db_field, value):
         return value
     
@@ -1,12 +1,19 @@
+import atexit
+import errno
+import httplib
 import logging
+import socket
 import sys
+import threading
+import time
+from xml.sax.saxutils import escape
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.db.models.loading import get_model
+from django.utils.encoding import force_unicode, smart_str
 from haystack.backends import BaseSearchBackend, BaseSearchQuery, log_query
 from haystack.exceptions import MissingDependency, MoreLikeThisError
-from haystack.models import SearchResult
-from haystack.utils import get_identifier
+from haystack.models import ResultConverter, SearchResult
+from haystack.utils import bump_identifier_generations, get_identifier, run_threaded
 try:
     set
 except NameError:
@@ -25,11 +32,379 @@ except ImportError:
 BACKEND_NAME = 'solr'
 
 
+class ConnectionPool(object):
+    """
+    Keeps keep-alive HTTP connections to a Solr server around for reuse.
+    
+    At most ``size`` connections are open at once. Past that, callers wait
+    up to ``timeout`` seconds for one to be handed back with ``release``.
+    """
+    def __init__(self, scheme, host, port, size, timeout, socket_timeout):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.socket_timeout = socket_timeout
+        self.lock = threading.Condition(threading.Lock())
+        self.idle = []
+        self.open = 0
+    
+    def acquire(self):
+        """
+        Returns a connection, along with whether it's been used before.
+        """
+        deadline = time.time() + self.timeout
+        self.lock.acquire()
+        
+        try:
+            while not self.idle and self.open >= self.size:
+                remaining = deadline - time.time()
+                
+                if remaining <= 0:
+                    raise SolrError("Timed out waiting for a connection to Solr at '%s:%s'." % (self.host, self.port))
+                
+                self.lock.wait(remaining)
+            
+            if self.idle:
+                return self.idle.pop(), True
+            
+            self.open += 1
+        finally:
+            self.lock.release()
+        
+        if self.scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        
+        try:
+            conn = connection_class(self.host, self.port, timeout=self.socket_timeout)
+        except TypeError:
+            # Python < 2.6 can't time out connections.
+            conn = connection_class(self.host, self.port)
+        
+        return conn, False
+    
+    def release(self, conn):
+        """
+        Hands back a connection that's free for the next request.
+        """
+        self.lock.acquire()
+        
+        try:
+            self.idle.append(conn)
+            self.lock.notify()
+        finally:
+            self.lock.release()
+    
+    def clear(self):
+        """
+        Closes the idle connections.
+        """
+        self.lock.acquire()
+        
+        try:
+            idle = self.idle
+            self.idle = []
+            self.open -= len(idle)
+            self.lock.notifyAll()
+        finally:
+            self.lock.release()
+        
+        for conn in idle:
+            conn.close()
+    
+    def discard(self, conn):
+        """
+        Closes a connection that can't be reused, making room for another.
+        """
+        conn.close()
+        self.lock.acquire()
+        
+        try:
+            self.open -= 1
+            self.lock.notify()
+        finally:
+            self.lock.release()
+
+
+# Connection pools, by scheme, host & port. Shared by every backend in the
+# process.
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+
+def connection_pool(scheme, host, port):
+    """
+    Returns the process-wide ``ConnectionPool`` for a Solr server.
+    """
+    POOLS_LOCK.acquire()
+    
+    try:
+        pool = POOLS.get((scheme, host, port))
+        
+        if pool is None:
+            socket_timeout = getattr(settings, 'HAYSTACK_SOLR_TIMEOUT', 10)
+            size = int(getattr(settings, 'HAYSTACK_SOLR_POOL_SIZE', 10))
+            timeout = getattr(settings, 'HAYSTACK_SOLR_POOL_TIMEOUT', socket_timeout)
+            pool = POOLS[(scheme, host, port)] = ConnectionPool(scheme, host, port, size, timeout, socket_timeout)
+        
+        return pool
+    finally:
+        POOLS_LOCK.release()
+
+
+def is_stale_connection_error(e):
+    """
+    Returns whether an error sending a request on a kept-alive connection
+    means the server had already closed it.
+    """
+    if isinstance(e, httplib.BadStatusLine):
+        return True
+    
+    if isinstance(e, socket.timeout) or not isinstance(e, socket.error):
+        return False
+    
+    return len(e.args) > 0 and e.args[0] in (errno.ECONNRESET, errno.EPIPE)
+
+
+class PooledSolr(Solr):
+    """
+    A ``Solr`` connection that sends its requests over the pooled
+    keep-alive connections, instead of opening a new one every time.
+    """
+    def __init__(self, url, decoder=None, timeout=60):
+        super(PooledSolr, self).__init__(url, decoder=decoder, timeout=timeout)
+        self.pool = connection_pool(self.scheme, self.host, self.port)
+    
+    def _send_request(self, method, path, body=None, headers=None):
+        if headers is None:
+            headers = {}
+        
+        start_time = time.time()
+        self.log.debug("Starting request to '%s:%s/%s' (%s) with body '%s'..." % (self.host, self.port, path, method, str(body)[:10]))
+        
+        while True:
+            conn, reused = self.pool.acquire()
+            
+            try:
+                try:
+                    conn.request(method, path, body, headers)
+                    response = conn.getresponse()
+                except (httplib.HTTPException, socket.error), e:
+                    # Solr may have dropped a connection while it sat idle.
+                    # Nothing was answered on it, so it's safe to try again
+                    # on another. Anything else (like a timeout) may have
+                    # reached Solr, so it isn't sent twice.
+                    if reused and is_stale_connection_error(e):
+                        self.pool.discard(conn)
+                        continue
+                    
+                    raise
+                
+                content = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                self.pool.discard(conn)
+                error_message = "Failed to connect to server at '%s': %s" % (self.base_url, e)
+                self.log.error(error_message)
+                raise SolrError(error_message)
+            except:
+                self.pool.discard(conn)
+                raise
+            
+            if response.will_close:
+                self.pool.discard(conn)
+            else:
+                self.pool.release(conn)
+            
+            break
+        
+        self.log.info("Finished '%s:%s/%s' (%s) with body '%s' in %0.3f seconds." % (self.host, self.port, path, method, str(body)[:10], time.time() - start_time))
+        
+        if response.status != 200:
+            error_message = self._extract_error(dict(response.getheaders()), content)
+            self.log.error(error_message)
+            raise SolrError(error_message)
+        
+        return content
+    
+    def delete_many(self, ids, commit=True, commitWithin=None):
+        """
+        Deletes documents by id, all in the one request.
+        """
+        ids = u''.join([u'<id>%s</id>' % escape(force_unicode(solr_id)) for solr_id in ids])
+        
+        if commitWithin:
+            message = u'<delete commitWithin="%s">%s</delete>' % (commitWithin, ids)
+        else:
+            message = u'<delete>%s</delete>' % ids
+        
+        self._update(message.encode('utf-8'), commit=commit)
+
+
 class EmptyResults(object):
     hits = 0
     docs = []
 
 
+class UpdateQueue(object):
+    """
+    Holds document adds & deletes in memory and posts them to Solr in bulk,
+    so that a burst of saves turns into one request (and no hard commits)
+    instead of a request & commit per save.
+    
+    Changes for a Solr server are posted ``HAYSTACK_SOLR_QUEUE_DELAY``
+    seconds after the first of them came in (from a background thread), on
+    ``flush`` or once ``HAYSTACK_SOLR_QUEUE_SIZE`` documents are waiting.
+    Only the last change to each document is kept. Posts ask Solr to commit
+    within ``HAYSTACK_SOLR_COMMIT_WITHIN`` milliseconds, after which the
+    generations of the models involved are bumped.
+    
+    A caller that fills the queue posts it itself, waiting on any post
+    already under way, so saves can't get ahead of Solr by more than that.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.post_lock = threading.Lock()
+        self.pending = {}
+        self.timers = {}
+        self.log = logging.getLogger('haystack')
+    
+    def add(self, conn, docs, boost):
+        self._queue(conn, [(doc['id'], (doc, boost)) for doc in docs])
+    
+    def remove(self, conn, solr_ids):
+        self._queue(conn, [(solr_id, None) for solr_id in solr_ids])
+    
+    def _queue(self, conn, changes):
+        key = conn.url
+        size = int(getattr(settings, 'HAYSTACK_SOLR_QUEUE_SIZE', 0))
+        delay = float(getattr(settings, 'HAYSTACK_SOLR_QUEUE_DELAY', 1))
+        self.lock.acquire()
+        
+        try:
+            if not key in self.pending:
+                self.pending[key] = (conn, {})
+            
+            docs = self.pending[key][1]
+            
+            for solr_id, change in changes:
+                docs[solr_id] = change
+            
+            full = len(docs) >= size
+            
+            if not full and not key in self.timers:
+                timer = threading.Timer(delay, self._post_later, [key])
+                timer.setDaemon(True)
+                self.timers[key] = timer
+                timer.start()
+        finally:
+            self.lock.release()
+        
+        if full:
+            self._post(key)
+    
+    def flush(self, conn=None):
+        """
+        Posts whatever is waiting for ``conn`` (or for every Solr server).
+        """
+        if conn is not None:
+            keys = [conn.url]
+        else:
+            keys = self.pending.keys()
+        
+        for key in keys:
+            self._post(key)
+    
+    def _post_later(self, key):
+        # Nobody is around to see an exception raised from the timer's thread.
+        try:
+            self._post(key)
+        except Exception, e:
+            self.log.error("Failed to post queued changes to Solr: %s", e)
+    
+    def _post(self, key):
+        self.post_lock.acquire()
+        
+        try:
+            self.lock.acquire()
+            
+            try:
+                pending = self.pending.pop(key, None)
+                timer = self.timers.pop(key, None)
+            finally:
+                self.lock.release()
+            
+            if timer is not None:
+                timer.cancel()
+            
+            if pending is None:
+                return
+            
+            conn, docs = pending
+            commit_within = int(getattr(settings, 'HAYSTACK_SOLR_COMMIT_WITHIN', 1000))
+            removals = []
+            additions = {}
+            
+            for solr_id, change in docs.items():
+                if change is None:
+                    removals.append(solr_id)
+                else:
+                    # Documents from different indexes carry different boosts.
+                    doc, boost = change
+                    additions.setdefault(tuple(sorted(boost.items())), []).append(doc)
+            
+            # Deletes ignore ``commitWithin`` before Solr 3.6, so a post with
+            # any removals commits with its last request, unless Solr's known
+            # to honour it.
+            if removals and not getattr(settings, 'HAYSTACK_SOLR_COMMIT_WITHIN_DELETES', False):
+                commit_within = 0
+            
+            # Without ``commitWithin``, the last request commits.
+            try:
+                if removals:
+                    self._delete(conn, removals, commit_within, commit=not additions)
+                
+                for i, (boost, docs) in enumerate(additions.items()):
+                    self._add(conn, docs, dict(boost), commit_within, commit=i == len(additions) - 1)
+            except (IOError, SolrError), e:
+                self.log.error("Failed to post queued changes to Solr: %s", e)
+                return
+        finally:
+            self.post_lock.release()
+        
+        # Results cached before the changes are searchable would otherwise
+        # outlive them, so the generations only move on once Solr commits.
+        if not getattr(settings, 'HAYSTACK_RESULT_CACHE_TIMEOUT', None):
+            return
+        
+        if commit_within:
+            timer = threading.Timer(commit_within / 1000.0, bump_identifier_generations, [pending[1].keys()])
+            timer.setDaemon(True)
+            timer.start()
+        else:
+            bump_identifier_generations(pending[1].keys())
+    
+    def _add(self, conn, docs, boost, commit_within, commit):
+        if commit_within:
+            conn.add(docs, commit=False, boost=boost, commitWithin=str(commit_within))
+        else:
+            conn.add(docs, commit=commit, boost=boost)
+    
+    def _delete(self, conn, solr_ids, commit_within, commit):
+        if commit_within:
+            conn.delete_many(solr_ids, commit=False, commitWithin=str(commit_within))
+        else:
+            conn.delete_many(solr_ids, commit=commit)
+
+
+# Shared by every backend in the process. Anything still waiting is posted
+# before the process exits.
+UPDATES = UpdateQueue()
+atexit.register(UPDATES.flush)
+
+
 class SearchBackend(BaseSearchBackend):
     # Word reserved by Solr for special use.
     RESERVED_WORDS = (
@@ -53,9 +428,15 @@ class SearchBackend(BaseSearchBackend):
             raise ImproperlyConfigured('You must specify a HAYSTACK_SOLR_URL in your settings.')
         
         timeout = getattr(settings, 'HAYSTACK_SOLR_TIMEOUT', 10)
-        self.conn = Solr(settings.HAYSTACK_SOLR_URL, timeout=timeout)
+        self.conn = PooledSolr(settings.HAYSTACK_SOLR_URL, timeout=timeout)
         self.log = logging.getLogger('haystack')
     
+    def _queued(self):
+        return int(getattr(settings, 'HAYSTACK_SOLR_QUEUE_SIZE', 0)) > 0
+    
+    def defers_updates(self):
+        return self._queued()
+    
     def update(self, index, iterable, commit=True):
         docs = []
         
@@ -66,6 +447,10 @@ class SearchBackend(BaseSearchBackend):
             sys.stderr.write("Chunk failed.\n")
         
         if len(docs) > 0:
+            if self._queued():
+                UPDATES.add(self.conn, docs, index.get_field_weights())
+                return
+            
             try:
                 self.conn.add(docs, commit=commit, boost=index.get_field_weights())
             except (IOError, SolrError), e:
@@ -74,12 +459,62 @@ class SearchBackend(BaseSearchBackend):
     def remove(self, obj_or_string, commit=True):
         solr_id = get_identifier(obj_or_string)
         
+        if self._queued():
+            UPDATES.remove(self.conn, [solr_id])
+            return
+        
         try:
             self.conn.delete(id=solr_id, commit=commit)
         except (IOError, SolrError), e:
             self.log.error("Failed to remove document '%s' from Solr: %s", solr_id, e)
     
+    def remove_many(self, identifiers, commit=True):
+        solr_ids = [get_identifier(obj_or_string) for obj_or_string in identifiers]
+        
+        if not solr_ids:
+            return
+        
+        if self._queued():
+            UPDATES.remove(self.conn, solr_ids)
+            return
+        
+        try:
+            self.conn.delete_many(solr_ids, commit=commit)
+        except (IOError, SolrError), e:
+            self.log.error("Failed to remove %s documents from Solr: %s", len(solr_ids), e)
+    
+    def iter_ids(self, model, chunk_size=1000):
+        django_ct = "%s.%s" % (model._meta.app_label, model._meta.module_name)
+        kwargs = {
+            'fl': 'id django_id',
+            'sort': 'id asc',
+            'rows': chunk_size,
+        }
+        last_id = None
+        
+        # Pages are keyed on the last ``id`` seen, rather than an offset, so
+        # each one is as cheap as the first and removing documents while
+        # paging doesn't make us skip any.
+        while True:
+            kwargs['fq'] = ['django_ct:%s' % django_ct]
+            
+            if last_id is not None:
+                kwargs['fq'].append('id:{"%s" TO *}' % last_id.replace('\\', '\\\\').replace('"', '\\"'))
+            
+            raw_results = self.conn.search('*:*', **kwargs)
+            
+            for raw_result in raw_results.docs:
+                yield smart_str(raw_result['django_id'])
+            
+            if len(raw_results.docs) < chunk_size:
+                return
+            
+            last_id = raw_results.docs[-1]['id']
+    
     def clear(self, models=[], commit=True):
+        # Anything queued goes first, so it can't reappear afterwards.
+        UPDATES.flush(self.conn)
+        
         try:
             if not models:
                 # *:* matches all docs in Solr
@@ -100,6 +535,12 @@ class SearchBackend(BaseSearchBackend):
             else:
                 self.log.error("Failed to clear Solr index: %s", e)
     
+    def flush(self):
+        """
+        Posts any queued updates & removals for this Solr server.
+        """
+        UPDATES.flush(self.conn)
+    
     @log_query
     def search(self, query_string, sort_by=None, start_offset=0, end_offset=None,
                fields='', highlight=False, facets=None, date_facets=None, query_facets=None,
@@ -188,6 +629,52 @@ class SearchBackend(BaseSearchBackend):
         
         return self._process_results(raw_results, highlight=highlight)
     
+    @log_query
+    def count(self, query_string, narrow_queries=None,
+              limit_to_registered_models=None, **kwargs):
+        if len(query_string) == 0:
+            return 0
+        
+        # Ask for no rows, so Solr only has to count the matches.
+        kwargs = {
+            'fl': 'id',
+            'rows': 0,
+        }
+        
+        if narrow_queries is not None:
+            narrow_queries = set(narrow_queries)
+        
+        if limit_to_registered_models is None:
+            limit_to_registered_models = getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
+        
+        if limit_to_registered_models:
+            # Using narrow queries, limit the results to only models registered
+            # with the current site.
+            if narrow_queries is None:
+                narrow_queries = set()
+            
+            registered_models = self.build_registered_models_list()
+            
+            if len(registered_models) > 0:
+                narrow_queries.add('django_ct:(%s)' % ' OR '.join(registered_models))
+        
+        if narrow_queries is not None:
+            kwargs['fq'] = list(narrow_queries)
+        
+        try:
+            raw_results = self.conn.search(query_string, **kwargs)
+        except (IOError, SolrError), e:
+            self.log.error("Failed to query Solr using '%s': %s", query_string, e)
+            raw_results = EmptyResults()
+        
+        return raw_results.hits
+    
+    def run_batch(self, queries):
+        # Each query is an independent HTTP round trip, so run them side by
+        # side and wait on the slowest.
+        max_threads = int(getattr(settings, 'HAYSTACK_MULTI_SEARCH_THREADS', 4))
+        run_threaded(lambda query: query.get_results(), queries, max_threads)
+    
     def more_like_this(self, model_instance, additional_query_string=None,
                        start_offset=0, end_offset=None,
                        limit_to_registered_models=None, **kwargs):
@@ -268,31 +755,18 @@ class SearchBackend(BaseSearchBackend):
                     # collated result from the end.
                     spelling_suggestion = raw_results.spellcheck.get('suggestions')[-1]
         
-        indexed_models = site.get_indexed_models()
-        
         for raw_result in raw_results.docs:
-            app_label, model_name = raw_result['django_ct'].split('.')
-            additional_fields = {}
-            model = get_model(app_label, model_name)
-            
-            if model and model in indexed_models:
-                for key, value in raw_result.items():
-                    index = site.get_index(model)
-                    string_key = str(key)
-                    
-                    if string_key in index.fields and hasattr(index.fields[string_key], 'convert'):
-                        additional_fields[string_key] = index.fields[string_key].convert(value)
-                    else:
-                        additional_fields[string_key] = self.conn._to_python(value)
-                
-                del(additional_fields['django_ct'])
-                del(additional_fields['django_id'])
-                del(additional_fields['score'])
+            model, converter = site.get_result_converter(raw_result['django_ct'], self)
+            
+            if model is not None:
+                additional_fields = {}
                 
                 if raw_result['id'] in getattr(raw_results, 'highlighting', {}):
                     additional_fields['highlighted'] = raw_results.highlighting[raw_result['id']]
                 
-                result = SearchResult(app_label, model_name, raw_result['django_id'], raw_result['score'], **additional_fields)
+                # Stored fields stay raw until they're first accessed.
+                result = SearchResult(model._meta.app_label, model._meta.module_name, raw_result['django_id'], raw_result['score'], **additional_fields)
+                result._set_raw_fields(raw_result, converter)
                 results.append(result)
             else:
                 hits -= 1
@@ -304,6 +778,10 @@ class SearchBackend(BaseSearchBackend):
             'spelling_suggestion': spelling_suggestion,
         }
     
+    def build_result_converter(self, index):
+        converter = super(SearchBackend, self).build_result_converter(index)
+        return ResultConverter(converter.converters, default=self.conn._to_python, exclude=('django_ct', 'django_id', 'score'))
+    
     def build_schema(self, fields):
         content_field_name = ''
         schema_fields = []
@@ -413,12 +891,8 @@ class SearchQuery(BaseSearchQuery):
         
         return result
     
-    def run(self, spelling_query=None):
-        """Builds and executes the query. Returns a list of search results."""
-        final_query = self.build_query()
-        kwargs = {
-            'start_offset': self.start_offset,
-        }
+    def build_params(self, spelling_query=None):
+        kwargs = super(SearchQuery, self).build_params(spelling_query=spelling_query)
         
         if self.order_by:
             order_by_list = []
@@ -431,32 +905,7 @@ class SearchQuery(BaseSearchQuery):
             
             kwargs['sort_by'] = ", ".join(order_by_list)
         
-        if self.end_offset is not None:
-            kwargs['end_offset'] = self.end_offset
-        
-        if self.highlight:
-            kwargs['highlight'] = self.highlight
-        
-        if self.facets:
-            kwargs['facets'] = list(self.facets)
-        
-        if self.date_facets:
-            kwargs['date_facets'] = self.date_facets
-        
-        if self.query_facets:
-            kwargs['query_facets'] = self.query_facets
-        
-        if self.narrow_queries:
-            kwargs['narrow_queries'] = self.narrow_queries
-        
-        if spelling_query:
-            kwargs['spelling_query'] = spelling_query
-        
-        results = self.backend.search(final_query, **kwargs)
-        self._results = results.get('results', [])
-        self._hit_count = results.get('hits', 0)
-        self._facet_counts = self.post_process_facets(results)
-        self._spelling_suggestion = results.get('spelling_suggestion', None)
+        return kwargs
     
     def run_mlt(self):
         """Builds and executes the query. Returns a list of search results."""
@@ -1,18 +1,28 @@
+import atexit
+import bisect
+import calendar
+import heapq
+import logging
 import os
 import re
 import shutil
 import threading
-import warnings
+import time
+import traceback
+import weakref
+from array import array
+from collections import defaultdict
+from datetime import timedelta
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.db.models.loading import get_model
+from django.db import connection, reset_queries
 from django.utils.datetime_safe import datetime
 from django.utils.encoding import force_unicode
 from haystack.backends import BaseSearchBackend, BaseSearchQuery, log_query
-from haystack.fields import DateField, DateTimeField, IntegerField, FloatField, BooleanField, MultiValueField
-from haystack.exceptions import MissingDependency, SearchBackendError
-from haystack.models import SearchResult
-from haystack.utils import get_identifier
+from haystack.fields import DateField, DateTimeField, IntegerField, FloatField, BooleanField, MultiValueField, FacetCharField
+from haystack.exceptions import FacetingError, MissingDependency, SearchBackendError
+from haystack.models import ResultConverter, SearchResult
+from haystack.utils import bump_identifier_generations, get_identifier, queryset_batches
 try:
     set
 except NameError:
@@ -24,25 +34,48 @@ except ImportError:
         import simplejson as json
     except ImportError:
         from django.utils import simplejson as json
+try:
+    from django.db.models.sql.query import get_proxied_model
+except ImportError:
+    # Likely on Django 1.0
+    get_proxied_model = None
+try:
+    from multiprocessing import Process, Queue
+    from Queue import Empty
+except ImportError:
+    # Python < 2.6. Parallel builds fall back to a single process.
+    Process = None
 
 try:
     import whoosh
 except ImportError:
     raise MissingDependency("The 'whoosh' backend requires the installation of 'Whoosh'. Please refer to the documentation.")
 
+# Handle minimum requirement. This comes before the rest of the imports, some
+# of which older versions don't have.
+if not hasattr(whoosh, '__version__') or whoosh.__version__ < (1, 8, 4):
+    raise MissingDependency("The 'whoosh' backend requires version 1.8.4 or greater.")
+
 # Bubble up the correct error.
 from whoosh.analysis import StemmingAnalyzer
+from whoosh.classify import Bo1Model, Expander
 from whoosh.fields import Schema, ID, IDLIST, STORED, TEXT, KEYWORD, NUMERIC, BOOLEAN, DATETIME
 from whoosh import index
+from whoosh.filedb.fileindex import Segment, _read_toc
+from whoosh.matching import ListMatcher, NullMatcher, RequireMatcher
 from whoosh.qparser import QueryParser
+from whoosh.qparser.common import QueryParserError, get_single_text
+from whoosh.query import And, Every, Not, NullQuery, Or, Term, TermRange, Wildcard, WrappingQuery
 from whoosh.filedb.filestore import FileStorage, RamStorage
-from whoosh.searching import ResultsPage
+from whoosh.searching import Results, ResultsPage
 from whoosh.spelling import SpellChecker
+from whoosh.support.bitvector import BitSet
+from whoosh.support.times import long_to_datetime
 from whoosh.writing import AsyncWriter
-
-# Handle minimum requirement.
-if not hasattr(whoosh, '__version__') or whoosh.__version__ < (1, 1, 1):
-    raise MissingDependency("The 'whoosh' backend requires version 1.1.1 or greater.")
+try:
+    from whoosh.filedb.filewriting import SegmentWriter
+except ImportError:
+    SegmentWriter = None
 
 
 DATETIME_REGEX = re.compile('^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})T(?P<hour>\d{2}):(?P<minute>\d{2}):(?P<second>\d{2})(\.\d{3,6}Z?)?$')
@@ -50,6 +83,876 @@ BACKEND_NAME = 'whoosh'
 LOCALS = threading.local()
 LOCALS.RAM_STORE = None
 
+# How many distinct narrow queries to remember per version of an index.
+NARROW_FILTER_CACHE_SIZE = 100
+
+# Narrowing to fewer than 1/N of the documents a query could match is done
+# while matching, rather than by checking each match against the filter.
+FILTERED_QUERY_RATIO = 4
+
+# Parallel builds write their segments through Whoosh internals that change
+# between releases, so they're only done on the versions known to work.
+# Others index each queryset in turn.
+PARALLEL_WHOOSH_VERSIONS = [(1, 8)]
+
+# How many key terms to pull from a document for More Like This.
+MORE_LIKE_THIS_TERM_COUNT = 10
+
+# Words the query parser reads as plain terms, free of any of its syntax.
+PLAIN_WORD_REGEX = re.compile(ur'^[^\s"\'()\[\]{}*?^:\\\u055e\u061f\u1367]+$', re.UNICODE)
+# Words the query parser keeps whole when they're followed by a ``*``.
+PREFIX_WORD_REGEX = re.compile(r'^\w+$', re.UNICODE)
+# Anything that would throw off the query parser within a range.
+RANGE_SYNTAX_REGEX = re.compile(r'[Tt][Oo]|[\s"\'\[\]{}]')
+# Boosts the query parser understands.
+BOOST_REGEX = re.compile(r'^[0-9]+(.[0-9]+)?$')
+
+# The table of contents of one generation of an index.
+TOC_REGEX = re.compile(r'^_(?P<indexname>.+)_(?P<generation>[0-9]+)\.toc$')
+# How many times to try copying an index into memory while it's being
+# written to, before giving up.
+SNAPSHOT_LOAD_ATTEMPTS = 3
+
+
+class ResultsSlice(object):
+    """
+    A window onto Whoosh ``Results`` that can start at any offset. Provides
+    the parts of ``ResultsPage`` that ``_process_results`` uses.
+    """
+    def __init__(self, results, offset, length):
+        self.results = results
+        self.total = len(results)
+        self.offset = offset
+        self.pagelen = max(min(length, self.total - offset), 0)
+    
+    def __iter__(self):
+        return iter(self.results[self.offset:self.offset + self.pagelen])
+    
+    def __len__(self):
+        return self.total
+    
+    def score(self, n):
+        return self.results.score(n + self.offset)
+
+
+def index_key(ix):
+    """
+    Identifies an index by where it lives, rather than by the ``Index``
+    object, since backends open their own.
+    """
+    if isinstance(ix.storage, RamStorage):
+        return (id(ix.storage), ix.indexname)
+    
+    return (ix.storage.folder, ix.indexname)
+
+
+def index_version(ix):
+    """
+    Identifies the current contents of an index.
+    """
+    # On disk, the TOC's modification time catches an index that's been
+    # deleted & rebuilt back up to the same generation.
+    if isinstance(ix.storage, RamStorage):
+        return (ix.latest_generation(), None)
+    
+    return (ix.latest_generation(), ix.last_modified())
+
+
+class SearcherPool(object):
+    """
+    Keeps open searchers around for reuse, grouped by the index they read.
+    
+    Whoosh searchers aren't safe to share between threads, so each one is
+    lent to a single caller at a time & handed back with ``release``. Idle
+    searchers are reused until the index changes underneath them, at which
+    point they're closed rather than lent out again.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.versions = {}
+        self.filters = {}
+        self.lent = weakref.WeakKeyDictionary()
+    
+    def _open(self, ix):
+        return ix.searcher()
+    
+    def acquire(self, ix):
+        """
+        Lends out a searcher over the latest version of ``ix``.
+        """
+        key = index_key(ix)
+        version = index_version(ix)
+        stale = []
+        searcher = None
+        
+        self.lock.acquire()
+        
+        try:
+            if self.versions.get(key) != version:
+                stale = self.idle.pop(key, [])
+                self.filters.pop((key, self.versions.get(key)), None)
+                self.versions[key] = version
+            
+            idle = self.idle.setdefault(key, [])
+            
+            if idle:
+                searcher = idle.pop()
+        finally:
+            self.lock.release()
+        
+        for old_searcher in stale:
+            old_searcher.close()
+        
+        if searcher is None:
+            searcher = self._open(ix)
+        
+        # Searchers that are never released are simply dropped from here once
+        # they're garbage collected.
+        self.lent[searcher] = (key, version)
+        return searcher
+    
+    def release(self, searcher):
+        """
+        Takes back a searcher. It's kept for reuse if the index hasn't changed
+        since it was lent out, otherwise it's closed.
+        """
+        max_idle = int(getattr(settings, 'HAYSTACK_WHOOSH_SEARCHER_POOL_SIZE', 4))
+        self.lock.acquire()
+        
+        try:
+            lent = self.lent.pop(searcher, None)
+            
+            if lent is not None:
+                key, version = lent
+                idle = self.idle.setdefault(key, [])
+                
+                if self.versions.get(key) == version and len(idle) < max_idle:
+                    idle.append(searcher)
+                    searcher = None
+        finally:
+            self.lock.release()
+        
+        if searcher is not None:
+            searcher.close()
+    
+    def filter_cache(self, searcher, kind='narrow'):
+        """
+        Returns a dictionary for caching things worked out from the version of
+        the index ``searcher`` was lent out for (narrow filters, facet terms),
+        one per ``kind``. They're thrown away once the index changes.
+        """
+        lent = self.lent.get(searcher)
+        
+        # Outdated or unknown searchers get a dictionary nobody else sees.
+        if lent is None or self.versions.get(lent[0]) != lent[1]:
+            return {}
+        
+        self.lock.acquire()
+        
+        try:
+            return self.filters.setdefault(lent, {}).setdefault(kind, {})
+        finally:
+            self.lock.release()
+    
+    def clear(self, ix):
+        """
+        Closes the idle searchers for ``ix``. Used when the index is wiped.
+        """
+        key = index_key(ix)
+        self.lock.acquire()
+        
+        try:
+            stale = self.idle.pop(key, [])
+            self.filters.pop((key, self.versions.pop(key, None)), None)
+        finally:
+            self.lock.release()
+        
+        for old_searcher in stale:
+            old_searcher.close()
+
+
+# Shared by every backend in the process.
+SEARCHERS = SearcherPool()
+
+
+def folder_version(storage):
+    """
+    Identifies the current generation of every index in a folder, by the
+    names & modification times of their tables of contents.
+    """
+    version = []
+    
+    for name in storage.list():
+        if TOC_REGEX.match(name):
+            version.append((name, storage.file_modified(name)))
+    
+    version.sort()
+    return tuple(version)
+
+
+class Snapshot(object):
+    """
+    An in-memory copy of the indexes in a folder, as of ``version``.
+    """
+    def __init__(self, version, storage, indexes):
+        self.version = version
+        self.storage = storage
+        self.indexes = indexes
+        self.next_check = 0
+
+
+class SnapshotLoader(object):
+    """
+    Keeps in-memory copies of on-disk indexes, so that searches on
+    read-mostly nodes never go to the disk.
+    
+    Every ``HAYSTACK_WHOOSH_SNAPSHOT_INTERVAL`` seconds, one caller checks
+    the folder for a newer generation of its indexes &, if there is one,
+    copies it into memory and swaps it in. Everyone else carries on with the
+    copy they've got in the meantime.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshots = {}
+        self.log = logging.getLogger('haystack')
+    
+    def storage(self, folder):
+        """
+        Returns the ``RamStorage`` holding the latest copy of ``folder``.
+        """
+        return self._snapshot(folder).storage
+    
+    def index(self, folder, indexname):
+        """
+        Returns the latest copy of the index called ``indexname``.
+        """
+        snapshot = self._snapshot(folder)
+        
+        if not indexname in snapshot.indexes:
+            # Created since the copy was made, so don't wait for the next
+            # check.
+            snapshot = self._snapshot(folder, refresh=True)
+        
+        return snapshot.indexes[indexname]
+    
+    def clear(self, folder):
+        """
+        Drops the copy of ``folder``. Used when the index is wiped.
+        """
+        self.lock.acquire()
+        
+        try:
+            snapshot = self.snapshots.pop(folder, None)
+        finally:
+            self.lock.release()
+        
+        if snapshot is not None:
+            self._discard(snapshot)
+    
+    def _snapshot(self, folder, refresh=False):
+        snapshot = self.snapshots.get(folder)
+        
+        if snapshot is not None and not refresh and time.time() < snapshot.next_check:
+            return snapshot
+        
+        # Only one caller checks at a time. Anyone else who already has a
+        # copy keeps using it, rather than waiting.
+        if snapshot is not None and not refresh:
+            if not self.lock.acquire(False):
+                return snapshot
+        else:
+            self.lock.acquire()
+        
+        try:
+            current = self.snapshots.get(folder)
+            
+            if current is not None and current is not snapshot:
+                # Swapped while we waited.
+                return current
+            
+            return self._refresh(folder, current)
+        finally:
+            self.lock.release()
+    
+    def _refresh(self, folder, snapshot):
+        disk = FileStorage(folder)
+        attempts = SNAPSHOT_LOAD_ATTEMPTS
+        
+        while True:
+            try:
+                version = folder_version(disk)
+                
+                if snapshot is None or snapshot.version != version:
+                    fresh = self._load(disk, version)
+                else:
+                    fresh = snapshot
+                
+                break
+            except (IOError, OSError, index.EmptyIndexError), e:
+                # A commit cleaned up files from the generation being
+                # copied. Try again with the newer one.
+                attempts -= 1
+                
+                if attempts > 0:
+                    continue
+                
+                if snapshot is None:
+                    raise
+                
+                # Better an older copy than no search at all.
+                self.log.warning("Failed to load a snapshot of the Whoosh index in '%s': %s", folder, e)
+                fresh = snapshot
+                break
+        
+        fresh.next_check = time.time() + float(getattr(settings, 'HAYSTACK_WHOOSH_SNAPSHOT_INTERVAL', 1))
+        self.snapshots[folder] = fresh
+        
+        if snapshot is not None and fresh is not snapshot:
+            self._discard(snapshot)
+        
+        return fresh
+    
+    def _load(self, disk, version):
+        """
+        Copies the latest generation of each index in ``version`` into
+        memory, leaving behind anything older or still being written.
+        """
+        storage = RamStorage()
+        latest = {}
+        
+        for toc_name, modified in version:
+            match = TOC_REGEX.match(toc_name)
+            generation = int(match.group('generation'))
+            
+            if generation >= latest.get(match.group('indexname'), (-1, None))[0]:
+                latest[match.group('indexname')] = (generation, toc_name)
+        
+        indexes = {}
+        file_names = disk.list()
+        
+        for indexname, (generation, toc_name) in latest.items():
+            self._copy(disk, storage, toc_name)
+            # Unpickling the schema is slow, so read it just the once.
+            toc = _read_toc(storage, None, indexname)
+            
+            for segment in toc.segments:
+                prefix = "%s." % segment.name
+                
+                if not segment.termsindex_filename in file_names:
+                    raise IOError("Segment '%s' is gone from '%s'." % (segment.name, disk.folder))
+                
+                for file_name in file_names:
+                    if file_name.startswith(prefix):
+                        self._copy(disk, storage, file_name)
+            
+            indexes[indexname] = storage.open_index(indexname, schema=toc.schema)
+        
+        return Snapshot(version, storage, indexes)
+    
+    def _copy(self, disk, storage, name):
+        source = open(os.path.join(disk.folder, name), 'rb')
+        
+        try:
+            target = storage.create_file(name)
+            target.write(source.read())
+            target.close()
+        finally:
+            source.close()
+    
+    def _discard(self, snapshot):
+        # Close the idle searchers over the old copy, so it can be freed.
+        for ix in snapshot.indexes.values():
+            SEARCHERS.clear(ix)
+
+
+# Shared by every backend in the process.
+SNAPSHOTS = SnapshotLoader()
+
+
+def delete_ids(writer, whoosh_ids):
+    """
+    Deletes documents by id with an ``AsyncWriter``, finding them all with
+    the one searcher, rather than a new one per document.
+    """
+    searcher = None
+    
+    if writer.writer is not None and whoosh_ids:
+        searcher = writer.writer.searcher()
+    
+    try:
+        for whoosh_id in whoosh_ids:
+            writer.delete_by_term(u'id', whoosh_id, searcher=searcher)
+    finally:
+        if searcher is not None:
+            searcher.close()
+
+
+class WriteBuffer(object):
+    """
+    Holds document updates & removals in memory and writes them in batches,
+    so that a burst of saves turns into one commit (and one segment) instead
+    of one per save.
+    
+    Changes for an index are committed once ``HAYSTACK_WHOOSH_BUFFER_SIZE``
+    documents are waiting, ``HAYSTACK_WHOOSH_BUFFER_DELAY`` seconds after the
+    first of them came in (from a background thread) or on ``flush``. Only
+    the last change to each document is kept. The generations of the models
+    involved are bumped once the changes are committed.
+    
+    Changes that fail to commit are put back to be tried again, on the next
+    ``flush`` or after another delay.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commit_lock = threading.Lock()
+        self.pending = {}
+        self.timers = {}
+        self.log = logging.getLogger('haystack')
+    
+    def update(self, ix, content_field_name, doc):
+        self._add(ix, content_field_name, doc['id'], doc)
+    
+    def remove(self, ix, content_field_name, whoosh_id):
+        self._add(ix, content_field_name, whoosh_id, None)
+    
+    def _add(self, ix, content_field_name, whoosh_id, doc):
+        key = index_key(ix)
+        size = int(getattr(settings, 'HAYSTACK_WHOOSH_BUFFER_SIZE', 0))
+        delay = float(getattr(settings, 'HAYSTACK_WHOOSH_BUFFER_DELAY', 5))
+        self.lock.acquire()
+        
+        try:
+            if not key in self.pending:
+                self.pending[key] = (ix, content_field_name, {})
+            
+            docs = self.pending[key][2]
+            docs[whoosh_id] = doc
+            full = len(docs) >= size
+            
+            if not full:
+                self._schedule(key, delay)
+        finally:
+            self.lock.release()
+        
+        if full:
+            self._commit(key)
+    
+    def _schedule(self, key, delay):
+        # Must be called with ``self.lock`` held.
+        if key in self.pending and not key in self.timers:
+            timer = threading.Timer(delay, self._commit_later, [key])
+            timer.setDaemon(True)
+            self.timers[key] = timer
+            timer.start()
+    
+    def flush(self, ix=None):
+        """
+        Commits whatever is waiting for ``ix`` (or for every index).
+        """
+        if ix is not None:
+            keys = [index_key(ix)]
+        else:
+            keys = self.pending.keys()
+        
+        for key in keys:
+            self._commit(key)
+    
+    def discard(self, ix):
+        """
+        Drops whatever is waiting for ``ix``. Used when the index is wiped.
+        """
+        key = index_key(ix)
+        self.lock.acquire()
+        
+        try:
+            self.pending.pop(key, None)
+            timer = self.timers.pop(key, None)
+        finally:
+            self.lock.release()
+        
+        if timer is not None:
+            timer.cancel()
+    
+    def _commit_later(self, key):
+        # Nobody is around to see an exception raised from the timer's thread.
+        try:
+            self._commit(key)
+        except Exception, e:
+            self.log.error("Failed to commit buffered changes to Whoosh: %s", e)
+            self.lock.acquire()
+            
+            try:
+                self._schedule(key, float(getattr(settings, 'HAYSTACK_WHOOSH_BUFFER_DELAY', 5)))
+            finally:
+                self.lock.release()
+    
+    def _restore(self, key, pending):
+        """
+        Puts back changes that failed to commit, behind any made to the same
+        documents since.
+        """
+        self.lock.acquire()
+        
+        try:
+            if not key in self.pending:
+                self.pending[key] = pending
+            else:
+                docs = self.pending[key][2]
+                
+                for whoosh_id, doc in pending[2].items():
+                    if not whoosh_id in docs:
+                        docs[whoosh_id] = doc
+        finally:
+            self.lock.release()
+    
+    def _commit(self, key):
+        self.commit_lock.acquire()
+        
+        try:
+            self.lock.acquire()
+            
+            try:
+                pending = self.pending.pop(key, None)
+                timer = self.timers.pop(key, None)
+            finally:
+                self.lock.release()
+            
+            if timer is not None:
+                timer.cancel()
+            
+            if pending is None:
+                return
+            
+            ix, content_field_name, docs = pending
+            
+            try:
+                ix = ix.refresh()
+                spelling = None
+                
+                # If spelling support is desired, add to the dictionary.
+                if getattr(settings, 'HAYSTACK_INCLUDE_SPELLING', False) is True:
+                    spelling = SpellingUpdate(ix, content_field_name)
+                
+                writer = AsyncWriter(ix)
+                
+                try:
+                    delete_ids(writer, [whoosh_id for whoosh_id, doc in docs.items() if doc is None])
+                    
+                    for whoosh_id, doc in docs.items():
+                        if doc is not None:
+                            writer.update_document(**doc)
+                            
+                            if spelling is not None:
+                                spelling.add(doc)
+                except:
+                    # Let go of the index's lock. (``commit`` does that itself,
+                    # even if it fails.)
+                    writer.cancel()
+                    raise
+                
+                writer.commit()
+            except:
+                self._restore(key, pending)
+                raise
+            
+            # If the index was locked, the commit happens on the writer's own
+            # thread. Wait for it, so a flush really has been written.
+            if writer.writer is None:
+                writer.join()
+            
+            if spelling is not None:
+                spelling.commit()
+        finally:
+            self.commit_lock.release()
+        
+        # Results cached before the changes are searchable would otherwise
+        # outlive them.
+        bump_identifier_generations(docs.keys())
+
+
+# Shared by every backend in the process. Anything still waiting is written
+# out before the process exits.
+WRITES = WriteBuffer()
+atexit.register(WRITES.flush)
+
+
+def count_words(field, text, words):
+    """
+    Tallies the terms ``field`` would index ``text`` as into ``words``.
+    """
+    for word, freq, weight, value in field.index(text):
+        words[word] = words.get(word, 0) + freq
+
+
+class SpellingUpdate(object):
+    """
+    Adds the words from a batch of documents to the spelling dictionary,
+    skipping any the index already had (and so the dictionary already has).
+    
+    Must be created before the batch is committed, as it checks words
+    against the index as it was at that point.
+    """
+    def __init__(self, ix, field_name):
+        self.ix = ix
+        self.field_name = field_name
+        self.field = ix.schema[field_name]
+        self.searcher = SEARCHERS.acquire(ix)
+        self.words = {}
+    
+    def add(self, doc):
+        text = doc.get(self.field_name)
+        
+        if text:
+            count_words(self.field, text, self.words)
+    
+    def add_words(self, words):
+        for word, freq in words.items():
+            self.words[word] = self.words.get(word, 0) + freq
+    
+    def commit(self):
+        try:
+            reader = self.searcher.reader()
+            new_words = [(word, freq) for word, freq in self.words.items() if not (self.field_name, word) in reader]
+        finally:
+            SEARCHERS.release(self.searcher)
+        
+        sp = SpellChecker(self.ix.storage)
+        
+        if not index.exists(self.ix.storage, sp.indexname):
+            # No dictionary yet, so start it off with everything.
+            sp.add_field(self.ix.refresh(), self.field_name)
+        elif new_words:
+            sp.add_scored_words(new_words)
+
+
+class LRUCache(object):
+    """
+    A dictionary-like cache holding up to ``size`` entries, dropping the
+    least recently used one to make room. Safe to share between threads.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.clear()
+    
+    def clear(self):
+        # A circular, doubly linked list of [previous, next, key, value],
+        # most recently used first.
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+        self.links = {}
+    
+    def __len__(self):
+        return len(self.links)
+    
+    def get(self, key, default=None):
+        self.lock.acquire()
+        
+        try:
+            link = self.links.get(key)
+            
+            if link is None:
+                return default
+            
+            self._unlink(link)
+            self._push(link)
+            return link[3]
+        finally:
+            self.lock.release()
+    
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        
+        self.lock.acquire()
+        
+        try:
+            link = self.links.pop(key, None)
+            
+            if link is not None:
+                self._unlink(link)
+            elif len(self.links) >= self.size:
+                oldest = self.root[0]
+                self._unlink(oldest)
+                del(self.links[oldest[2]])
+            
+            link = [None, None, key, value]
+            self._push(link)
+            self.links[key] = link
+        finally:
+            self.lock.release()
+    
+    def _unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+    
+    def _push(self, link):
+        first = self.root[1]
+        link[0] = self.root
+        link[1] = first
+        first[0] = link
+        self.root[1] = link
+
+
+# Spelling suggestions, by index, version of the dictionary & query.
+SUGGESTIONS = LRUCache(int(getattr(settings, 'HAYSTACK_WHOOSH_SPELLING_CACHE_SIZE', 1000)))
+
+# More Like This key terms, by index & document, along with the text they
+# were drawn from.
+KEY_TERMS = LRUCache(int(getattr(settings, 'HAYSTACK_WHOOSH_MORE_LIKE_THIS_CACHE_SIZE', 1000)))
+
+# Queries compiled by ``SearchQuery``, by schema & the structure of the query.
+COMPILED_QUERIES = LRUCache(int(getattr(settings, 'HAYSTACK_WHOOSH_QUERY_CACHE_SIZE', 1000)))
+
+
+def add_date_gap(value, gap_by, gap_amount=1):
+    """
+    Moves ``value`` along by ``gap_amount`` years, months, days, hours, minutes
+    or seconds (as named by ``gap_by``). Used to step through date facets.
+    """
+    if gap_amount < 1:
+        raise FacetingError("The gap_amount (%s) must be at least 1." % gap_amount)
+    
+    if gap_by in ('day', 'hour', 'minute', 'second'):
+        return value + timedelta(**{'%ss' % str(gap_by): gap_amount})
+    
+    if gap_by == 'year':
+        year, month = value.year + gap_amount, value.month
+    elif gap_by == 'month':
+        year, month = divmod(value.month - 1 + gap_amount, 12)
+        year, month = value.year + year, month + 1
+    else:
+        raise FacetingError("The gap_by ('%s') isn't one Whoosh can facet on." % gap_by)
+    
+    # Stepping from the 31st lands on the last day of shorter months.
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+def in_memory_database():
+    settings_dict = getattr(connection, 'settings_dict', {})
+    name = settings_dict.get('NAME', settings_dict.get('DATABASE_NAME', getattr(settings, 'DATABASE_NAME', '')))
+    return name == ':memory:'
+
+
+def parallel_segments_supported():
+    """
+    Whether this version of Whoosh can have segments built in other processes.
+    """
+    return SegmentWriter is not None and tuple(whoosh.__version__[:2]) in PARALLEL_WHOOSH_VERSIONS
+
+
+def detach_database_connection():
+    """
+    Makes a forked worker open its own database connection, rather than
+    sharing the parent's.
+    
+    The inherited connection is left open (closing it would close it for the
+    parent as well). In-memory SQLite databases only exist within their
+    connection, so those are kept.
+    """
+    if connection.connection is None or in_memory_database():
+        return
+    
+    LOCALS.INHERITED_CONNECTION = connection.connection
+    connection.connection = None
+
+
+class DocnumMatcher(ListMatcher):
+    """
+    Matches a sorted list of document numbers, bisecting to skip ahead.
+    """
+    def skip_to(self, id):
+        self._i = bisect.bisect_left(self._ids, id, self._i)
+
+
+class FilteredQuery(WrappingQuery):
+    """
+    Restricts a query to a sorted list of document numbers while it's being
+    matched, so the postings between them are skipped over rather than read
+    & thrown away. Scores come from the wrapped query alone.
+    """
+    def __init__(self, child, docnums, offsets):
+        self.child = child
+        self.docnums = docnums
+        # Multi-segment searchers match each segment with its own searcher,
+        # numbering documents from zero.
+        self.offsets = offsets
+    
+    def apply(self, fn):
+        return self.__class__(fn(self.child), self.docnums, self.offsets)
+    
+    def estimate_size(self, ixreader):
+        return min(len(self.docnums), self.child.estimate_size(ixreader))
+    
+    def matcher(self, searcher):
+        offset = self.offsets.get(id(searcher), 0)
+        start = bisect.bisect_left(self.docnums, offset)
+        end = bisect.bisect_left(self.docnums, offset + searcher.reader().doc_count_all())
+        
+        if start == end:
+            return NullMatcher()
+        
+        docnums = [docnum - offset for docnum in self.docnums[start:end]]
+        return RequireMatcher(self.child.matcher(searcher), DocnumMatcher(docnums))
+
+
+class PooledSpellChecker(SpellChecker):
+    """
+    A ``SpellChecker`` that looks words up with searchers borrowed from the
+    pool, instead of opening a fresh searcher over its dictionary every time.
+    """
+    def index(self, create=False):
+        return PooledIndex(super(PooledSpellChecker, self).index(create))
+
+
+class KeyTermExpander(Expander):
+    """
+    An ``Expander`` handed the field's collection frequencies, rather than
+    reading the whole lexicon for them each time it's made.
+    """
+    def __init__(self, ixreader, fieldname, collection_freq):
+        self.ixreader = ixreader
+        self.fieldname = fieldname
+        self.model = Bo1Model(ixreader.doc_count_all(), ixreader.field_length(fieldname))
+        self.collection_freq = collection_freq
+        self.topN_weight = defaultdict(float)
+        self.top_total = 0
+
+
+class PooledIndex(object):
+    """
+    Stands in for a Whoosh index, lending pooled searchers from ``searcher``.
+    """
+    def __init__(self, ix):
+        self.ix = ix
+    
+    def __getattr__(self, name):
+        return getattr(self.ix, name)
+    
+    def searcher(self, weighting=None):
+        searcher = SEARCHERS.acquire(self.ix)
+        
+        if weighting is not None:
+            searcher.weighting = weighting
+        
+        return BorrowedSearcher(searcher)
+
+
+class BorrowedSearcher(object):
+    """
+    Wraps a pooled searcher so that closing it hands it back to the pool.
+    """
+    def __init__(self, searcher):
+        self.searcher = searcher
+    
+    def __getattr__(self, name):
+        return getattr(self.searcher, name)
+    
+    def close(self):
+        SEARCHERS.release(self.searcher)
+
 
 class SearchBackend(BaseSearchBackend):
     # Word reserved by Whoosh for special use.
@@ -71,9 +974,18 @@ class SearchBackend(BaseSearchBackend):
         super(SearchBackend, self).__init__(site)
         self.setup_complete = False
         self.use_file_storage = True
+        self.use_snapshots = False
+        self._batch_searcher = None
+        self._appended = None
+        self._appended_generation = None
         self.post_limit = getattr(settings, 'HAYSTACK_WHOOSH_POST_LIMIT', 128 * 1024 * 1024)
         
-        if getattr(settings, 'HAYSTACK_WHOOSH_STORAGE', 'file') != 'file':
+        storage = getattr(settings, 'HAYSTACK_WHOOSH_STORAGE', 'file')
+        
+        if storage == 'snapshot':
+            # Written to on disk, but searched from a copy in memory.
+            self.use_snapshots = True
+        elif storage != 'file':
             self.use_file_storage = False
         
         if self.use_file_storage and not hasattr(settings, 'HAYSTACK_WHOOSH_PATH'):
@@ -90,7 +1002,8 @@ class SearchBackend(BaseSearchBackend):
             os.makedirs(settings.HAYSTACK_WHOOSH_PATH)
             new_index = True
         
-        if self.use_file_storage and not os.access(settings.HAYSTACK_WHOOSH_PATH, os.W_OK):
+        # Nodes that only search snapshots of the index needn't write to it.
+        if self.use_file_storage and not self.use_snapshots and not os.access(settings.HAYSTACK_WHOOSH_PATH, os.W_OK):
             raise IOError("The path to your Whoosh index '%s' is not writable for the current user/group." % settings.HAYSTACK_WHOOSH_PATH)
         
         if self.use_file_storage:
@@ -108,11 +1021,13 @@ class SearchBackend(BaseSearchBackend):
         
         if new_index is True:
             self.index = self.storage.create_index(self.schema)
+            SEARCHERS.clear(self.index)
         else:
             try:
                 self.index = self.storage.open_index(schema=self.schema)
             except index.EmptyIndexError:
                 self.index = self.storage.create_index(self.schema)
+                SEARCHERS.clear(self.index)
         
         self.setup_complete = True
     
@@ -141,6 +1056,9 @@ class SearchBackend(BaseSearchBackend):
                 schema_fields[field_class.index_fieldname] = NUMERIC(stored=field_class.stored, type=float)
             elif field_class.field_type == 'boolean':
                 schema_fields[field_class.index_fieldname] = BOOLEAN(stored=field_class.stored)
+            elif isinstance(field_class, FacetCharField):
+                # Facets count whole values, so they're kept unanalyzed.
+                schema_fields[field_class.index_fieldname] = ID(stored=True)
             else:
                 schema_fields[field_class.index_fieldname] = TEXT(stored=True, analyzer=StemmingAnalyzer())
             
@@ -154,12 +1072,36 @@ class SearchBackend(BaseSearchBackend):
         
         return (content_field_name, Schema(**schema_fields))
     
+    def _buffered(self):
+        return int(getattr(settings, 'HAYSTACK_WHOOSH_BUFFER_SIZE', 0)) > 0
+    
+    def defers_updates(self):
+        return self._buffered()
+    
     def update(self, index, iterable, commit=True):
         if not self.setup_complete:
             self.setup()
         
+        if self._buffered():
+            for obj in iterable:
+                doc = index.full_prepare(obj)
+                
+                for key in doc:
+                    doc[key] = self._from_python(doc[key])
+                
+                WRITES.update(self.index, self.content_field_name, doc)
+            
+            return
+        
         self.index = self.index.refresh()
+        spelling = None
+        
+        # If spelling support is desired, add to the dictionary.
+        if getattr(settings, 'HAYSTACK_INCLUDE_SPELLING', False) is True:
+            spelling = SpellingUpdate(self.index, self.content_field_name)
+        
         writer = AsyncWriter(self.index)
+        appended = self._appended_ids(writer)
         
         for obj in iterable:
             doc = index.full_prepare(obj)
@@ -169,34 +1111,123 @@ class SearchBackend(BaseSearchBackend):
             for key in doc:
                 doc[key] = self._from_python(doc[key])
             
-            writer.update_document(**doc)
+            # Documents that can't be in the index yet don't need looking up
+            # (and deleting) first.
+            if appended is not None and not doc['id'] in appended:
+                writer.add_document(**doc)
+                appended.add(doc['id'])
+            else:
+                writer.update_document(**doc)
+            
+            if spelling is not None:
+                spelling.add(doc)
         
         if len(iterable) > 0:
             # For now, commit no matter what, as we run into locking issues otherwise.
             writer.commit()
             
-            # If spelling support is desired, add to the dictionary.
-            if getattr(settings, 'HAYSTACK_INCLUDE_SPELLING', False) is True:
-                sp = SpellChecker(self.storage)
-                sp.add_field(self.index, self.content_field_name)
+            if appended is not None:
+                self._appended_generation = writer.writer.generation
+            
+            if spelling is not None:
+                spelling.commit()
+    
+    def _appended_ids(self, writer):
+        """
+        Returns the ids of everything in the index if it has only been added
+        to by this backend since it was last empty (as during a rebuild).
+        Otherwise, returns ``None``.
+        """
+        if writer.writer is None:
+            # Someone else is writing, so the index is about to change.
+            self._appended = None
+            return None
+        
+        # With the write lock held, this is what the index is.
+        if not [segment for segment in writer.writer.segments if segment.doc_count_all()]:
+            self._appended = set()
+        elif self._appended_generation != writer.writer.generation - 1:
+            self._appended = None
+        
+        return self._appended
     
     def remove(self, obj_or_string, commit=True):
         if not self.setup_complete:
             self.setup()
         
-        self.index = self.index.refresh()
         whoosh_id = get_identifier(obj_or_string)
+        
+        if self._buffered():
+            WRITES.remove(self.index, self.content_field_name, whoosh_id)
+            return
+        
+        self.index = self.index.refresh()
         self.index.delete_by_query(q=self.parser.parse(u'id:"%s"' % whoosh_id))
     
-    def clear(self, models=[], commit=True):
+    def remove_many(self, identifiers, commit=True):
+        if not self.setup_complete:
+            self.setup()
+        
+        whoosh_ids = [force_unicode(get_identifier(obj_or_string)) for obj_or_string in identifiers]
+        
+        if self._buffered():
+            for whoosh_id in whoosh_ids:
+                WRITES.remove(self.index, self.content_field_name, whoosh_id)
+            
+            return
+        
+        if not whoosh_ids:
+            return
+        
+        self.index = self.index.refresh()
+        writer = AsyncWriter(self.index)
+        delete_ids(writer, whoosh_ids)
+        writer.commit()
+        
+        # If the index was locked, the commit happens on the writer's own
+        # thread. Wait for it, so the documents really are gone.
+        if writer.writer is None:
+            writer.join()
+    
+    def iter_ids(self, model, chunk_size=1000):
         if not self.setup_complete:
             self.setup()
         
+        # The ids are read from the live index, not a snapshot, so anything
+        # just written is seen. The searcher doesn't see changes made after
+        # it's opened, so removing documents as we go doesn't skip any.
+        WRITES.flush(self.index)
         self.index = self.index.refresh()
+        searcher = SEARCHERS.acquire(self.index)
+        
+        try:
+            reader = searcher.reader()
+            prefix = u"%s.%s." % (model._meta.app_label, model._meta.module_name)
+            
+            # Every document's ``id`` is a term in the (sorted) lexicon of its
+            # segment, so this walks the model's ids without touching stored
+            # fields. A deleted document keeps its term until the segment is
+            # merged, so those segments check for a live posting.
+            for segment_reader in getattr(reader, 'readers', [reader]):
+                has_deletions = segment_reader.has_deletions()
+                
+                for whoosh_id in segment_reader.expand_prefix('id', prefix):
+                    if has_deletions and not segment_reader.postings('id', whoosh_id).is_active():
+                        continue
+                    
+                    yield whoosh_id[len(prefix):].encode('utf-8')
+        finally:
+            SEARCHERS.release(searcher)
+    
+    def clear(self, models=[], commit=True):
+        if not self.setup_complete:
+            self.setup()
         
         if not models:
             self.delete_index()
         else:
+            WRITES.flush(self.index)
+            self.index = self.index.refresh()
             models_to_delete = []
             
             for model in models:
@@ -212,6 +1243,13 @@ class SearchBackend(BaseSearchBackend):
         elif not self.use_file_storage:
             self.storage.clean()
         
+        if self.setup_complete:
+            WRITES.discard(self.index)
+            SEARCHERS.clear(self.index)
+        
+        if self.use_snapshots:
+            SNAPSHOTS.clear(settings.HAYSTACK_WHOOSH_PATH)
+        
         # Recreate everything.
         self.setup()
         
@@ -219,9 +1257,167 @@ class SearchBackend(BaseSearchBackend):
         if not self.setup_complete:
             self.setup()
         
+        WRITES.flush(self.index)
         self.index = self.index.refresh()
         self.index.optimize()
     
+    def flush(self):
+        """
+        Commits any buffered updates & removals for this index.
+        """
+        if not self.setup_complete:
+            self.setup()
+        
+        WRITES.flush(self.index)
+    
+    def parallel_update(self, index, querysets, batch_size=1000):
+        """
+        Indexes each queryset in its own worker process, each writing a new
+        segment, then adds all of the segments to the index in one commit.
+        
+        The querysets must not overlap. Documents already in the index with
+        the same ids are replaced.
+        
+        Only done with the versions of Whoosh in ``PARALLEL_WHOOSH_VERSIONS``.
+        """
+        if not self.setup_complete:
+            self.setup()
+        
+        # A ``RamStorage`` index can't be written to from another process.
+        if Process is None or not self.use_file_storage or len(querysets) < 2 or not parallel_segments_supported():
+            return super(SearchBackend, self).parallel_update(index, querysets, batch_size)
+        
+        WRITES.flush(self.index)
+        self.index = self.index.refresh()
+        
+        # Holds the write lock until the new segments are in.
+        writer = SegmentWriter(self.index)
+        
+        try:
+            segments, ids, words = self._build_segments(index, querysets, batch_size, writer.segment_number)
+        except:
+            writer.cancel()
+            raise
+        
+        if self.index.doc_count_all() > 0:
+            searcher = writer.searcher()
+            
+            try:
+                for whoosh_id in ids:
+                    writer.delete_by_term(u'id', whoosh_id, searcher=searcher)
+            finally:
+                searcher.close()
+        
+        def add_segments(writer, existing):
+            return existing + segments
+        
+        spelling = None
+        
+        # If spelling support is desired, add to the dictionary.
+        if getattr(settings, 'HAYSTACK_INCLUDE_SPELLING', False) is True:
+            spelling = SpellingUpdate(self.index, self.content_field_name)
+            spelling.add_words(words)
+        
+        # The workers took the segment numbers after this writer's own.
+        writer.segment_number += len(querysets)
+        writer.commit(mergetype=add_segments)
+        
+        if spelling is not None:
+            spelling.commit()
+    
+    def _build_segments(self, index, querysets, batch_size, segment_number):
+        results = Queue()
+        workers = []
+        
+        for offset, qs in enumerate(querysets):
+            name = Segment.basename(self.index.indexname, segment_number + offset + 1)
+            worker = Process(target=self._build_segment, args=(index, qs, name, batch_size, results))
+            worker.daemon = True
+            workers.append(worker)
+            worker.start()
+        
+        segments = []
+        ids = []
+        words = {}
+        received = 0
+        
+        try:
+            # Drain the queue before joining, or large results can deadlock.
+            while received < len(workers):
+                try:
+                    segment, segment_ids, segment_words, error = results.get(True, 1)
+                except Empty:
+                    if [worker for worker in workers if worker.is_alive()]:
+                        continue
+                    
+                    try:
+                        segment, segment_ids, segment_words, error = results.get(True, 1)
+                    except Empty:
+                        raise SearchBackendError("A Whoosh indexing worker exited without finishing.")
+                
+                received += 1
+                
+                if error is not None:
+                    raise SearchBackendError("A Whoosh indexing worker failed:\n%s" % error)
+                
+                if segment is not None:
+                    segments.append(segment)
+                    ids.extend(segment_ids)
+                
+                for word, freq in segment_words.items():
+                    words[word] = words.get(word, 0) + freq
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                
+                worker.join()
+        
+        return (segments, ids, words)
+    
+    def _build_segment(self, index, qs, segment_name, batch_size, results):
+        """
+        Runs in a worker process, writing everything in ``qs`` to a new
+        segment that isn't part of the index yet.
+        """
+        try:
+            detach_database_connection()
+            ix = self.storage.open_index(self.index.indexname)
+            writer = SegmentWriter(ix, name=segment_name, _lk=False)
+            ids = []
+            words = {}
+            spelling_field = None
+            
+            # The parent adds new words to the spelling dictionary.
+            if getattr(settings, 'HAYSTACK_INCLUDE_SPELLING', False) is True:
+                spelling_field = ix.schema[self.content_field_name]
+            
+            for batch in queryset_batches(qs, batch_size):
+                for obj in batch:
+                    doc = index.full_prepare(obj)
+                    
+                    for key in doc:
+                        doc[key] = self._from_python(doc[key])
+                    
+                    writer.add_document(**doc)
+                    ids.append(doc['id'])
+                    
+                    if spelling_field is not None and doc.get(self.content_field_name):
+                        count_words(spelling_field, doc[self.content_field_name], words)
+                
+                reset_queries()
+            
+            if not ids:
+                writer.cancel()
+                results.put((None, ids, words, None))
+                return
+            
+            writer.pool.finish(writer.termswriter, writer.docnum, writer.lengthfile)
+            writer._close_all()
+            results.put((writer._getsegment(), ids, words, None))
+        except Exception:
+            results.put((None, [], {}, traceback.format_exc()))
+    
     @log_query
     def search(self, query_string, sort_by=None, start_offset=0, end_offset=None,
                fields='', highlight=False, facets=None, date_facets=None, query_facets=None,
@@ -239,55 +1435,422 @@ class SearchBackend(BaseSearchBackend):
         
         query_string = force_unicode(query_string)
         
-        # A one-character query (non-wildcard) gets nabbed by a stopwords
-        # filter and should yield zero results.
+        # A one-character query (non-wildcard) gets nabbed by a stopwords
+        # filter and should yield zero results.
+        if len(query_string) <= 1 and query_string != u'*':
+            return {
+                'results': [],
+                'hits': 0,
+            }
+        
+        sort_by = self._parse_sort_by(sort_by)
+        searcher = self._acquire_searcher()
+        
+        try:
+            return self._search(searcher, query_string, sort_by, start_offset, end_offset, highlight, narrow_queries, spelling_query, limit_to_registered_models, facets, date_facets, query_facets)
+        finally:
+            self._release_searcher(searcher)
+    
+    def _search(self, searcher, query_string, sort_by, start_offset, end_offset,
+                highlight, narrow_queries, spelling_query, limit_to_registered_models,
+                facets=None, date_facets=None, query_facets=None):
+        """
+        Does the work of ``search`` with a searcher already in hand.
+        """
+        narrowed_results = self._narrow_results(searcher, narrow_queries, limit_to_registered_models)
+        
+        if searcher.doc_count():
+            # Prevent against Whoosh throwing an error. Requires an end_offset
+            # greater than 0.
+            if not end_offset is None and end_offset <= 0:
+                end_offset = 1
+            
+            raw_results = self._raw_results(searcher, query_string, sort_by, end_offset, narrowed_results)
+            
+            # In the event of an invalid/stopworded query, recover gracefully.
+            if raw_results is None:
+                return {
+                    'results': [],
+                    'hits': 0,
+                }
+            
+            raw_page = self._results_page(raw_results, start_offset, end_offset)
+            
+            if raw_page is None:
+                return {
+                    'results': [],
+                    'hits': 0,
+                    'spelling_suggestion': None,
+                }
+            
+            facet_counts = {}
+            
+            if facets is not None or date_facets is not None or query_facets is not None:
+                # Counting the hits loads the full set of matching documents.
+                len(raw_results)
+                facet_counts = self._facet_counts(searcher, raw_results.docset, facets, date_facets, query_facets)
+            
+            return self._process_results(raw_page, highlight=highlight, query_string=query_string, spelling_query=spelling_query, facets=facet_counts)
+        else:
+            if getattr(settings, 'HAYSTACK_INCLUDE_SPELLING', False):
+                if spelling_query:
+                    spelling_suggestion = self.create_spelling_suggestion(spelling_query)
+                else:
+                    spelling_suggestion = self.create_spelling_suggestion(query_string)
+            else:
+                spelling_suggestion = None
+            
+            return {
+                'results': [],
+                'hits': 0,
+                'spelling_suggestion': spelling_suggestion,
+            }
+    
+    def _results_page(self, raw_results, start_offset, end_offset):
+        """
+        Returns the page of ``raw_results`` the offsets cover, or ``None`` if
+        there's no such page.
+        """
+        page_num = 0
+        
+        if end_offset is None:
+            end_offset = 1000000
+        
+        if start_offset is None:
+            start_offset = 0
+        
+        page_length = end_offset - start_offset
+        
+        if page_length and page_length > 0:
+            page_num = start_offset / page_length
+        
+        # Increment because Whoosh uses 1-based page numbers.
+        page_num += 1
+        
+        try:
+            return ResultsPage(raw_results, page_num, page_length)
+        except ValueError:
+            return None
+    
+    @log_query
+    def count(self, query_string, narrow_queries=None,
+              limit_to_registered_models=None, **kwargs):
+        if not self.setup_complete:
+            self.setup()
+        
+        query_string = force_unicode(query_string)
+        
+        # Same short-circuits as ``search``.
+        if len(query_string) == 0:
+            return 0
+        
+        if len(query_string) <= 1 and query_string != u'*':
+            return 0
+        
+        searcher = self._acquire_searcher()
+        
+        try:
+            if not searcher.doc_count():
+                return 0
+            
+            narrowed_results = self._narrow_results(searcher, narrow_queries, limit_to_registered_models)
+            
+            # Nothing to match or narrow on, so every document counts.
+            if query_string == u'*' and narrowed_results is None:
+                return searcher.doc_count()
+            
+            parsed_query = self._parse_query(query_string)
+            
+            if parsed_query is None:
+                return 0
+            
+            if narrowed_results is not None and not narrowed_results:
+                return 0
+            
+            parsed_query, narrowed_results = self._filtered_query(searcher, parsed_query, narrowed_results)
+            
+            # Only the matching document numbers are needed for the length, so
+            # score a single hit and never touch the stored fields.
+            raw_results = searcher.search(parsed_query, limit=1, filter=narrowed_results)
+            return len(raw_results)
+        finally:
+            self._release_searcher(searcher)
+    
+    def _parse_query(self, query_string):
+        """
+        Returns the Whoosh query for ``query_string``, skipping the parser for
+        those ``SearchQuery`` has already compiled.
+        """
+        if isinstance(query_string, CompiledQuery):
+            return query_string.query
+        
+        return self.parser.parse(query_string)
+    
+    def _parse_sort_by(self, sort_by):
+        """
+        Turns a list of fields to order by (each prefixed with a ``-`` to
+        sort in reverse) into a tuple of ``(field_name, reverse)`` pairs, or
+        ``None`` if there's nothing to sort on.
+        """
+        if not sort_by:
+            return None
+        
+        sort_by_list = []
+        
+        for order_by in sort_by:
+            if order_by.startswith('-'):
+                sort_by_list.append((order_by[1:], True))
+            else:
+                sort_by_list.append((order_by, False))
+        
+        return tuple(sort_by_list)
+    
+    def _raw_results(self, searcher, query_string, sort_by=None, end_offset=None, narrowed_results=None):
+        """
+        Runs the query, returning Whoosh's ``Results`` (restricted to the
+        narrowed documents, if any) or ``None`` if the query couldn't be parsed
+        or the narrowing leaves nothing to match.
+        """
+        parsed_query = self._parse_query(query_string)
+        
+        if parsed_query is None:
+            return None
+        
+        # Whoosh treats an empty filter as no filter at all.
+        if narrowed_results is not None and not narrowed_results:
+            return None
+        
+        parsed_query, narrowed_results = self._filtered_query(searcher, parsed_query, narrowed_results)
+        
+        if sort_by is not None:
+            return self._sorted_results(searcher, parsed_query, sort_by, end_offset, narrowed_results)
+        
+        return searcher.search(parsed_query, limit=end_offset, filter=narrowed_results)
+    
+    def _filtered_query(self, searcher, parsed_query, narrowed_results):
+        """
+        Decides how the narrowed document numbers are applied to the query.
+        Returns the ``(query, filter)`` to search with.
+        
+        A narrowing that leaves far fewer documents than the query could match
+        is worked into the query, so only those documents are visited (let
+        alone scored). Otherwise it's left as a filter for Whoosh to check each
+        match against, which is cheaper for broad narrowing.
+        """
+        if not narrowed_results:
+            return parsed_query, narrowed_results
+        
+        try:
+            estimate = parsed_query.estimate_size(searcher.reader())
+        except NotImplementedError:
+            return parsed_query, narrowed_results
+        
+        if len(narrowed_results) * FILTERED_QUERY_RATIO > estimate:
+            return parsed_query, narrowed_results
+        
+        offsets = {}
+        
+        for subsearcher, offset in searcher.subsearchers or []:
+            offsets[id(subsearcher)] = offset
+        
+        return FilteredQuery(parsed_query, sorted(narrowed_results), offsets), None
+    
+    def _sorted_results(self, searcher, parsed_query, sort_by, end_offset=None, narrowed_results=None):
+        """
+        Runs the query, ordering the matches by the ``sort_by`` fields (each
+        in its own direction) using the cached sort keys, so no stored fields
+        are read to sort.
+        """
+        sort_key = self._sort_key(searcher, sort_by).__getitem__
+        docnums = searcher.docs_for_query(parsed_query)
+        
+        if narrowed_results is not None:
+            docnums = [docnum for docnum in docnums if docnum in narrowed_results]
+        else:
+            docnums = list(docnums)
+        
+        docset = set(docnums)
+        
+        # Both sorts are stable, so ties stay in index order.
+        if end_offset is None:
+            docnums.sort(key=sort_key)
+        else:
+            docnums = heapq.nsmallest(end_offset, docnums, key=sort_key)
+        
+        return Results(searcher, parsed_query, [(None, docnum) for docnum in docnums], docset)
+    
+    def _sort_key(self, searcher, sort_by):
+        """
+        Returns a list holding a single sortable number for each document,
+        combining its place in each of the ``sort_by`` fields (reversed as
+        asked). Documents without a value sort first, or last in reverse.
+        
+        Built from the field columns once per version of the index & order.
+        """
+        sort_keys = SEARCHERS.filter_cache(searcher, 'sort_keys')
+        sort_key = sort_keys.get(sort_by)
+        
+        if sort_key is None:
+            sort_key = [0] * searcher.doc_count_all()
+            
+            for field_name, reverse in sort_by:
+                column, size = self._sort_column(searcher, field_name)
+                
+                # Places run from 0 (no value) to ``size``, so each field
+                # needs ``size + 1`` slots in the combined key.
+                if reverse:
+                    sort_key = [key * (size + 1) + size - place for key, place in zip(sort_key, column)]
+                else:
+                    sort_key = [key * (size + 1) + place for key, place in zip(sort_key, column)]
+            
+            sort_keys[sort_by] = sort_key
+        
+        return sort_key
+    
+    def _sort_column(self, searcher, field_name):
+        """
+        Returns ``(column, size)``, where ``column`` gives each document's
+        place (from 1 to ``size``) among the sorted values of ``field_name``,
+        or 0 if it has no value.
+        
+        Built from the field's terms & postings once per version of the index.
+        """
+        columns = SEARCHERS.filter_cache(searcher, 'sort_columns')
+        cached = columns.get(field_name)
+        
+        if cached is None:
+            if not field_name in self.schema:
+                raise SearchBackendError("Whoosh can't sort on '%s', as it isn't in the index." % field_name)
+            
+            field = self.schema[field_name]
+            reader = searcher.reader()
+            column = array('i', [0]) * searcher.doc_count_all()
+            size = 0
+            
+            # Terms come back in order, with only the full precision ones for
+            # numbers & dates.
+            for text, sortable in field.sortable_values(reader, field_name):
+                size += 1
+                
+                for docnum in reader.postings(field_name, text).all_ids():
+                    column[docnum] = size
+            
+            cached = (column, size)
+            columns[field_name] = cached
+        
+        return cached
+    
+    def iter_search(self, query_string, chunk_size=100, sort_by=None,
+                    start_offset=0, end_offset=None, highlight=False,
+                    narrow_queries=None, limit_to_registered_models=None,
+                    **kwargs):
+        if not self.setup_complete:
+            self.setup()
+        
+        query_string = force_unicode(query_string)
+        
+        # Same short-circuits as ``search``.
+        if len(query_string) == 0:
+            return
+        
         if len(query_string) <= 1 and query_string != u'*':
-            return {
-                'results': [],
-                'hits': 0,
-            }
+            return
         
-        reverse = False
+        if end_offset is not None and end_offset <= 0:
+            return
         
-        if sort_by is not None:
-            # Determine if we need to reverse the results and if Whoosh can
-            # handle what it's being asked to sort by. Reversing is an
-            # all-or-nothing action, unfortunately.
-            sort_by_list = []
-            reverse_counter = 0
-            
-            for order_by in sort_by:
-                if order_by.startswith('-'):
-                    reverse_counter += 1
-            
-            if len(sort_by) > 1 and reverse_counter > 1:
-                raise SearchBackendError("Whoosh does not handle more than one field and any field being ordered in reverse.")
-            
-            for order_by in sort_by:
-                if order_by.startswith('-'):
-                    sort_by_list.append(order_by[1:])
-                    
-                    if len(sort_by_list) == 1:
-                        reverse = True
-                else:
-                    sort_by_list.append(order_by)
-                    
-                    if len(sort_by_list) == 1:
-                        reverse = False
+        sort_by = self._parse_sort_by(sort_by)
+        
+        searcher = self._acquire_searcher()
+        
+        try:
+            if not searcher.doc_count():
+                return
+            
+            narrowed_results = self._narrow_results(searcher, narrow_queries, limit_to_registered_models)
+            
+            # Run the query once (matches are only document numbers & scores),
+            # then load the stored fields a chunk at a time as we go.
+            raw_results = self._raw_results(searcher, query_string, sort_by, end_offset, narrowed_results)
+            
+            if raw_results is None:
+                return
+            
+            total = len(raw_results)
+            
+            if end_offset is not None:
+                total = min(total, end_offset)
+            
+            start = start_offset or 0
+            
+            while start < total:
+                raw_slice = ResultsSlice(raw_results, start, min(chunk_size, total - start))
+                chunk = self._process_results(raw_slice, highlight=highlight, query_string=query_string)['results']
                 
-            sort_by = sort_by_list[0]
+                if chunk:
+                    yield chunk
+                
+                start += chunk_size
+        finally:
+            self._release_searcher(searcher)
+    
+    def _acquire_searcher(self):
+        """
+        Returns the searcher shared by the batch being run, or borrows one
+        from the pool.
+        """
+        if self._batch_searcher is not None:
+            return self._batch_searcher
         
-        if facets is not None:
-            warnings.warn("Whoosh does not handle faceting.", Warning, stacklevel=2)
+        return SEARCHERS.acquire(self._search_index())
+    
+    def _search_index(self):
+        """
+        Returns the index to search, which is the latest snapshot of it when
+        searching snapshots.
+        """
+        if self.use_snapshots:
+            return SNAPSHOTS.index(self.storage.folder, self.index.indexname)
         
-        if date_facets is not None:
-            warnings.warn("Whoosh does not handle date faceting.", Warning, stacklevel=2)
+        return self.index
+    
+    def _release_searcher(self, searcher):
+        if searcher is not self._batch_searcher:
+            SEARCHERS.release(searcher)
+    
+    def run_batch(self, queries):
+        if not self.setup_complete:
+            self.setup()
         
-        if query_facets is not None:
-            warnings.warn("Whoosh does not handle query faceting.", Warning, stacklevel=2)
+        backends = [query.backend for query in queries]
+        self._batch_searcher = SEARCHERS.acquire(self._search_index())
+        
+        try:
+            # Route every query through this backend, so they all use the
+            # one searcher (and see the same version of the index).
+            for query in queries:
+                query.backend = self
+                query.get_results()
+        finally:
+            SEARCHERS.release(self._batch_searcher)
+            self._batch_searcher = None
+            
+            for query, backend in zip(queries, backends):
+                query.backend = backend
+    
+    def _narrow_results(self, searcher, narrow_queries=None, limit_to_registered_models=None):
+        """
+        Runs the narrow queries (plus the registered models restriction, if
+        enabled) and returns the set of document numbers matching all of them,
+        or ``None`` if there is nothing to narrow on.
         
+        The documents each narrow query matches are cached until the index
+        changes, so repeating a narrow query doesn't search again.
+        """
         narrowed_results = None
-        self.index = self.index.refresh()
+        
+        if narrow_queries is not None:
+            narrow_queries = set(narrow_queries)
         
         if limit_to_registered_models is None:
             limit_to_registered_models = getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
@@ -303,94 +1866,246 @@ class SearchBackend(BaseSearchBackend):
             if len(registered_models) > 0:
                 narrow_queries.add('django_ct:(%s)' % ' OR '.join(registered_models))
         
-        if narrow_queries is not None:
-            # Potentially expensive? I don't see another way to do it in Whoosh...
-            narrow_searcher = self.index.searcher()
-            
+        if narrow_queries:
             for nq in narrow_queries:
-                recent_narrowed_results = narrow_searcher.search(self.parser.parse(force_unicode(nq)))
+                narrowed_docs = self._query_docs(searcher, nq)
                 
-                if narrowed_results:
-                    narrowed_results.filter(recent_narrowed_results)
+                if narrowed_results is None:
+                    narrowed_results = narrowed_docs
                 else:
-                   narrowed_results = recent_narrowed_results
+                    narrowed_results = narrowed_results & narrowed_docs
         
-        self.index = self.index.refresh()
+        return narrowed_results
+    
+    def _query_docs(self, searcher, query_string):
+        """
+        Returns the set of document numbers ``query_string`` matches, cached
+        until the index changes.
+        """
+        filters = SEARCHERS.filter_cache(searcher)
+        query_string = force_unicode(query_string)
+        docs = filters.get(query_string)
         
-        if self.index.doc_count():
-            searcher = self.index.searcher()
-            parsed_query = self.parser.parse(query_string)
-            
-            # In the event of an invalid/stopworded query, recover gracefully.
-            if parsed_query is None:
-                return {
-                    'results': [],
-                    'hits': 0,
-                }
-            
-            # Prevent against Whoosh throwing an error. Requires an end_offset
-            # greater than 0.
-            if not end_offset is None and end_offset <= 0:
-                end_offset = 1
-            
-            raw_results = searcher.search(parsed_query, limit=end_offset, sortedby=sort_by, reverse=reverse)
-            
-            # Handle the case where the results have been narrowed.
-            if narrowed_results:
-                raw_results.filter(narrowed_results)
-            
-            # Determine the page.
-            page_num = 0
-            
-            if end_offset is None:
-                end_offset = 1000000
-            
-            if start_offset is None:
-                start_offset = 0
-            
-            page_length = end_offset - start_offset
+        if docs is None:
+            if len(filters) >= NARROW_FILTER_CACHE_SIZE:
+                filters.clear()
             
-            if page_length and page_length > 0:
-                page_num = start_offset / page_length
-            
-            # Increment because Whoosh uses 1-based page numbers.
-            page_num += 1
-            
-            try:
-                raw_page = ResultsPage(raw_results, page_num, page_length)
-            except ValueError:
-                return {
-                    'results': [],
-                    'hits': 0,
-                    'spelling_suggestion': None,
-                }
+            docs = BitSet(searcher.doc_count_all(), source=searcher.docs_for_query(self._parse_query(query_string)))
+            filters[query_string] = docs
+        
+        return docs
+    
+    def _facet_terms(self, searcher, field_name):
+        """
+        Returns a list of ``(value, docs)`` pairs covering every value indexed
+        in ``field_name``, where ``docs`` is the set of live document numbers
+        holding that value.
+        
+        The list is built from the field's terms & postings once per version of
+        the index, after which facet counts are only set intersections.
+        """
+        facet_terms = SEARCHERS.filter_cache(searcher, 'facets')
+        terms = facet_terms.get(field_name)
+        
+        if terms is None:
+            terms = []
             
-            return self._process_results(raw_page, highlight=highlight, query_string=query_string, spelling_query=spelling_query)
-        else:
-            if getattr(settings, 'HAYSTACK_INCLUDE_SPELLING', False):
-                if spelling_query:
-                    spelling_suggestion = self.create_spelling_suggestion(spelling_query)
+            if field_name in self.schema:
+                field = self.schema[field_name]
+                reader = searcher.reader()
+                
+                if isinstance(field, NUMERIC):
+                    # Numbers & dates are indexed at several precisions. Only
+                    # the full precision terms hold actual values.
+                    texts = [text for text, sortable in field.sortable_values(reader, field_name)]
                 else:
-                    spelling_suggestion = self.create_spelling_suggestion(query_string)
-            else:
-                spelling_suggestion = None
+                    texts = list(reader.lexicon(field_name))
+                
+                for text in texts:
+                    docs = frozenset(reader.postings(field_name, text).all_ids())
+                    
+                    # Terms left over from deleted documents match nothing.
+                    if docs:
+                        terms.append((self._facet_value(field, text), docs))
             
-            return {
-                'results': [],
-                'hits': 0,
-                'spelling_suggestion': spelling_suggestion,
-            }
+            facet_terms[field_name] = terms
+        
+        return terms
+    
+    def _facet_value(self, field, text):
+        if isinstance(field, DATETIME):
+            return long_to_datetime(field.from_text(text))
+        
+        if isinstance(field, NUMERIC):
+            return field.from_text(text)
+        
+        if isinstance(field, BOOLEAN):
+            return text in field.trues
+        
+        return text
+    
+    def _facet_counts(self, searcher, matched, facets=None, date_facets=None, query_facets=None):
+        """
+        Counts the requested facets over the ``matched`` document numbers,
+        handing them back in the same shape as the Solr backend.
+        """
+        facet_counts = {
+            'fields': {},
+            'dates': {},
+            'queries': {},
+        }
+        
+        if facets is not None:
+            for field_name in facets:
+                counts = []
+                
+                for value, docs in self._facet_terms(searcher, field_name):
+                    count = len(matched.intersection(docs))
+                    
+                    if count:
+                        counts.append((value, count))
+                
+                counts.sort(key=lambda pair: (-pair[1], pair[0]))
+                facet_counts['fields'][field_name] = counts
+        
+        if date_facets is not None:
+            for field_name, details in date_facets.items():
+                start_date = self._facet_datetime(details['start_date'])
+                end_date = self._facet_datetime(details['end_date'])
+                starts = []
+                
+                while start_date < end_date:
+                    starts.append(start_date)
+                    start_date = add_date_gap(start_date, details.get('gap_by'), details.get('gap_amount', 1))
+                
+                counts = [0] * len(starts)
+                
+                if field_name in self.schema and isinstance(self.schema[field_name], DATETIME):
+                    for value, docs in self._facet_terms(searcher, field_name):
+                        position = bisect.bisect_right(starts, value) - 1
+                        
+                        if position >= 0 and value < end_date:
+                            counts[position] += len(matched.intersection(docs))
+                
+                facet_counts['dates'][field_name] = zip(starts, counts)
+        
+        if query_facets is not None:
+            if hasattr(query_facets, 'items'):
+                query_facets = query_facets.items()
+            
+            for field_name, query in query_facets:
+                facet_query = u"%s:%s" % (field_name, query)
+                facet_counts['queries'][facet_query] = len(matched.intersection(self._query_docs(searcher, facet_query)))
+        
+        return facet_counts
+    
+    def _facet_datetime(self, value):
+        if not hasattr(value, 'hour'):
+            value = datetime(value.year, value.month, value.day)
+        
+        return value
     
     def more_like_this(self, model_instance, additional_query_string=None,
                        start_offset=0, end_offset=None,
                        limit_to_registered_models=None, **kwargs):
-        warnings.warn("Whoosh does not handle More Like This.", Warning, stacklevel=2)
-        return {
+        if not self.setup_complete:
+            self.setup()
+        
+        # Handle deferred models.
+        if get_proxied_model and hasattr(model_instance, '_deferred') and model_instance._deferred:
+            model_klass = get_proxied_model(model_instance._meta)
+        else:
+            model_klass = type(model_instance)
+        
+        field_name = self.site.get_index(model_klass).get_content_field()
+        narrow_queries = None
+        
+        if additional_query_string:
+            narrow_queries = set([additional_query_string])
+        
+        searcher = self._acquire_searcher()
+        
+        try:
+            return self._more_like_this(searcher, get_identifier(model_instance), field_name, narrow_queries, start_offset, end_offset, limit_to_registered_models)
+        finally:
+            self._release_searcher(searcher)
+    
+    def _more_like_this(self, searcher, identifier, field_name, narrow_queries,
+                        start_offset, end_offset, limit_to_registered_models):
+        """
+        Does the work of ``more_like_this`` with a searcher already in hand.
+        
+        The document's key terms are run as an OR query, each boosted by its
+        weight. The document itself is left out of the results.
+        """
+        empty_results = {
             'results': [],
             'hits': 0,
         }
+        docnum = searcher.document_number(id=force_unicode(identifier))
+        
+        if docnum is None:
+            return empty_results
+        
+        key_terms = self._key_terms(searcher, identifier, docnum, field_name)
+        
+        if not key_terms:
+            return empty_results
+        
+        narrowed_results = self._narrow_results(searcher, narrow_queries, limit_to_registered_models)
+        
+        # Whoosh treats an empty filter as no filter at all.
+        if narrowed_results is not None and not narrowed_results:
+            return empty_results
+        
+        if not end_offset is None and end_offset <= 0:
+            end_offset = 1
+        
+        query = Or([Term(field_name, text, boost=weight) for text, weight in key_terms])
+        query, narrowed_results = self._filtered_query(searcher, query, narrowed_results)
+        raw_results = searcher.search(query, limit=end_offset, filter=narrowed_results, mask=set([docnum]))
+        raw_page = self._results_page(raw_results, start_offset, end_offset)
+        
+        if raw_page is None:
+            return empty_results
+        
+        return self._process_results(raw_page)
+    
+    def _key_terms(self, searcher, identifier, docnum, field_name):
+        """
+        Returns the most telling ``(term, weight)`` pairs in the document's
+        ``field_name``.
+        
+        They're cached per document & only worked out again once the document
+        is reindexed with different text.
+        """
+        text = searcher.stored_fields(docnum).get(field_name)
+        
+        if not text:
+            return []
+        
+        cache_key = (index_key(self.index), identifier, field_name)
+        cached = KEY_TERMS.get(cache_key)
+        
+        if cached is not None and cached[0] == text:
+            return cached[1]
+        
+        # Reading the frequency of every term in the field is the slow part, so
+        # that's kept until the index changes.
+        frequencies = SEARCHERS.filter_cache(searcher, 'frequencies')
+        collection_freq = frequencies.get(field_name)
+        
+        if collection_freq is None:
+            collection_freq = dict((word, freq) for word, docfreq, freq in searcher.reader().iter_field(field_name))
+            frequencies[field_name] = collection_freq
+        
+        expander = KeyTermExpander(searcher.reader(), field_name, collection_freq)
+        expander.add_text(text)
+        key_terms = expander.expanded_terms(MORE_LIKE_THIS_TERM_COUNT)
+        KEY_TERMS.set(cache_key, (text, key_terms))
+        return key_terms
     
-    def _process_results(self, raw_page, highlight=False, query_string='', spelling_query=None):
+    def _process_results(self, raw_page, highlight=False, query_string='', spelling_query=None, facets=None):
         from haystack import site
         results = []
         
@@ -398,47 +2113,33 @@ class SearchBackend(BaseSearchBackend):
         # can cause pagination failures.
         hits = len(raw_page)
         
-        facets = {}
+        if facets is None:
+            facets = {}
+        
         spelling_suggestion = None
-        indexed_models = site.get_indexed_models()
         
         for doc_offset, raw_result in enumerate(raw_page):
             score = raw_page.score(doc_offset) or 0
-            app_label, model_name = raw_result['django_ct'].split('.')
-            additional_fields = {}
-            model = get_model(app_label, model_name)
-            
-            if model and model in indexed_models:
-                for key, value in raw_result.items():
-                    index = site.get_index(model)
-                    string_key = str(key)
-                    
-                    if string_key in index.fields and hasattr(index.fields[string_key], 'convert'):
-                        # Special-cased due to the nature of KEYWORD fields.
-                        if isinstance(index.fields[string_key], MultiValueField):
-                            if value is None or len(value) is 0:
-                                additional_fields[string_key] = []
-                            else:
-                                additional_fields[string_key] = value.split(',')
-                        else:
-                            additional_fields[string_key] = index.fields[string_key].convert(value)
-                    else:
-                        additional_fields[string_key] = self._to_python(value)
-                
-                del(additional_fields['django_ct'])
-                del(additional_fields['django_id'])
+            raw_fields = raw_result.fields()
+            model, converter = site.get_result_converter(raw_fields['django_ct'], self)
+            
+            if model is not None:
+                additional_fields = {}
                 
                 if highlight:
                     from whoosh import analysis
                     from whoosh.highlight import highlight, ContextFragmenter, UppercaseFormatter
                     sa = analysis.StemmingAnalyzer()
                     terms = [term.replace('*', '') for term in query_string.split()]
+                    content = converter.convert(self.content_field_name, raw_fields.get(self.content_field_name))
                     
                     additional_fields['highlighted'] = {
-                        self.content_field_name: [highlight(additional_fields.get(self.content_field_name), terms, sa, ContextFragmenter(terms), UppercaseFormatter())],
+                        self.content_field_name: [highlight(content, terms, sa, ContextFragmenter(terms), UppercaseFormatter())],
                     }
                 
-                result = SearchResult(app_label, model_name, raw_result['django_id'], score, **additional_fields)
+                # Stored fields stay raw until they're first accessed.
+                result = SearchResult(model._meta.app_label, model._meta.module_name, raw_fields['django_id'], score, **additional_fields)
+                result._set_raw_fields(raw_fields, converter)
                 results.append(result)
             else:
                 hits -= 1
@@ -456,14 +2157,44 @@ class SearchBackend(BaseSearchBackend):
             'spelling_suggestion': spelling_suggestion,
         }
     
+    def build_result_converter(self, index):
+        converters = super(SearchBackend, self).build_result_converter(index).converters
+        
+        for field_name, field in index.fields.items():
+            # Special-cased due to the nature of KEYWORD fields.
+            if isinstance(field, MultiValueField):
+                converters[field_name] = self._split_multivalue
+        
+        return ResultConverter(converters, default=self._to_python, exclude=('django_ct', 'django_id'))
+    
+    def _split_multivalue(self, value):
+        if value is None or len(value) is 0:
+            return []
+        
+        return value.split(',')
+    
     def create_spelling_suggestion(self, query_string):
         spelling_suggestion = None
-        sp = SpellChecker(self.storage)
+        
+        if self.use_snapshots:
+            sp = PooledSpellChecker(SNAPSHOTS.storage(self.storage.folder))
+        else:
+            sp = PooledSpellChecker(self.storage)
+        
         cleaned_query = force_unicode(query_string)
         
         if not query_string:
             return spelling_suggestion
         
+        # The dictionary's version is part of the key, so additions to it
+        # aren't hidden by older suggestions.
+        spelling_index = sp.index()
+        cache_key = (index_key(spelling_index), index_version(spelling_index), cleaned_query)
+        spelling_suggestion = SUGGESTIONS.get(cache_key)
+        
+        if spelling_suggestion is not None:
+            return spelling_suggestion
+        
         # Clean the string.
         for rev_word in self.RESERVED_WORDS:
             cleaned_query = cleaned_query.replace(rev_word, '')
@@ -482,6 +2213,7 @@ class SearchBackend(BaseSearchBackend):
                 suggested_words.append(suggestions[0])
         
         spelling_suggestion = ' '.join(suggested_words)
+        SUGGESTIONS.set(cache_key, spelling_suggestion)
         return spelling_suggestion
     
     def _from_python(self, value):
@@ -544,6 +2276,17 @@ class SearchBackend(BaseSearchBackend):
         return value
 
 
+class CompiledQuery(unicode):
+    """
+    A query string built by ``SearchQuery``, carrying the Whoosh query it
+    compiles to so the backend needn't parse it.
+    """
+    def __new__(cls, query_string, query):
+        compiled = super(CompiledQuery, cls).__new__(cls, force_unicode(query_string))
+        compiled.query = query
+        return compiled
+
+
 class SearchQuery(BaseSearchQuery):
     def __init__(self, site=None, backend=None):
         super(SearchQuery, self).__init__(backend=backend)
@@ -652,3 +2395,240 @@ class SearchQuery(BaseSearchQuery):
                 result = filter_types[filter_type] % (index_fieldname, value)
         
         return result
+    
+    def build_final_query(self):
+        """
+        Returns the query string along with the Whoosh query compiled straight
+        from the query tree, which the backend runs instead of parsing the
+        string. Both are cached by the structure of the query, so repeating a
+        search builds neither.
+        """
+        if not self.backend.setup_complete:
+            self.backend.setup()
+        
+        cache_key = self._compiled_query_key()
+        compiled = None
+        
+        if cache_key is not None:
+            compiled = COMPILED_QUERIES.get(cache_key)
+        
+        if compiled is None:
+            compiled = CompiledQuery(self.build_query(), self._compile_query())
+            
+            if cache_key is not None:
+                COMPILED_QUERIES.set(cache_key, compiled)
+        
+        return compiled
+    
+    def _compiled_query_key(self):
+        """
+        Identifies the query by its structure & the schema it's compiled
+        against. Returns ``None`` for queries holding values that can't be
+        hashed, which get compiled every time.
+        """
+        schema = self.backend.schema
+        fields = tuple([(name, schema[name].__class__, getattr(schema[name], 'type', None)) for name in schema.names()])
+        models = tuple(sorted(['%s.%s' % (model._meta.app_label, model._meta.module_name) for model in self.models]))
+        cache_key = (self.backend.content_field_name, fields, self._node_key(self.query_filter), models, tuple(sorted(self.boost.items())))
+        
+        try:
+            hash(cache_key)
+        except TypeError:
+            return None
+        
+        return cache_key
+    
+    def _node_key(self, node):
+        children = []
+        
+        for child in node.children:
+            if hasattr(child, 'as_query_string'):
+                children.append(self._node_key(child))
+            else:
+                expression, value = child
+                
+                # Values are told apart by type too, since ``1``, ``1.0`` &
+                # ``True`` are equal but query differently.
+                if isinstance(value, (list, tuple, set, frozenset)):
+                    value = tuple([(possible_value.__class__, possible_value) for possible_value in value])
+                
+                children.append((expression, value.__class__, value))
+        
+        return (node.connector, node.negated, tuple(children))
+    
+    def _compile_query(self):
+        """
+        Compiles the query tree, models & boosts into the Whoosh query the
+        backend's parser would make of ``build_query``'s string.
+        
+        The one difference is matching everything, done with ``Every()``
+        rather than the parser's ``Every`` on the content field, which has to
+        read all of that field's terms.
+        """
+        parser = self.backend.parser
+        queries = []
+        query = self._compile_node(self.query_filter)
+        
+        if query is not None:
+            queries.append(query)
+        
+        if len(self.models):
+            models = sorted(['%s.%s' % (model._meta.app_label, model._meta.module_name) for model in self.models])
+            queries.append(Or([parser.term_query('django_ct', force_unicode(model), Term) for model in models]))
+        
+        for boost_word, boost_value in self.boost.items():
+            boost_word = force_unicode(boost_word)
+            boost_value = force_unicode(boost_value)
+            
+            if PLAIN_WORD_REGEX.match(boost_word) and BOOST_REGEX.match(boost_value):
+                queries.append(parser.term_query(self.backend.content_field_name, boost_word, Term, boost=float(boost_value)))
+            else:
+                queries.append(parser.parse(force_unicode(self.boost_fragment(boost_word, boost_value))))
+        
+        if not queries:
+            return Every()
+        
+        return And(queries).normalize()
+    
+    def _compile_node(self, node):
+        queries = []
+        
+        for child in node.children:
+            if hasattr(child, 'as_query_string'):
+                query = self._compile_node(child)
+            else:
+                expression, value = child
+                field, filter_type = node.split_expression(expression)
+                query = self._compile_fragment(field, filter_type, value)
+            
+            if query is not None:
+                queries.append(query)
+        
+        if not queries:
+            return None
+        
+        if len(queries) == 1:
+            query = queries[0]
+        elif node.connector == node.OR:
+            query = Or(queries)
+        else:
+            query = And(queries)
+        
+        if node.negated:
+            query = Not(query)
+        
+        return query
+    
+    def _compile_fragment(self, field, filter_type, value):
+        """
+        Compiles a single condition as ``build_query_fragment`` would write
+        it & the parser would read it back. Values holding any of the parser's
+        syntax are left for the parser.
+        """
+        query = None
+        
+        if field == 'content':
+            query = self._compile_text(self.backend.content_field_name, self.backend._from_python(value))
+        else:
+            index_fieldname = self.backend.site.get_index_fieldname(field)
+            
+            if index_fieldname in self.backend.schema:
+                query = self._compile_field(index_fieldname, filter_type, value)
+        
+        if query is None:
+            query = self.backend.parser.parse(force_unicode(self.build_query_fragment(field, filter_type, value)))
+        
+        return query
+    
+    def _compile_field(self, index_fieldname, filter_type, value):
+        if filter_type == 'in':
+            queries = []
+            
+            for possible_value in value:
+                possible_value = self._compile_value(possible_value)
+                
+                if '"' in possible_value:
+                    return None
+                
+                queries.append(self._compile_phrase(index_fieldname, possible_value))
+            
+            if not queries:
+                return None
+            
+            return Or(queries)
+        
+        if filter_type == 'range':
+            return self._compile_range(index_fieldname, self._compile_value(value[0]), self._compile_value(value[1]), False, False)
+        
+        value = self._compile_value(value)
+        
+        if filter_type == 'exact':
+            return self._compile_text(index_fieldname, value)
+        elif filter_type == 'startswith':
+            if PREFIX_WORD_REGEX.match(value):
+                return self.backend.parser.term_query(index_fieldname, value + u'*', Wildcard, tokenize=False, removestops=False)
+        elif filter_type == 'gt':
+            return self._compile_range(index_fieldname, value, None, True, True)
+        elif filter_type == 'gte':
+            return self._compile_range(index_fieldname, value, None, False, False)
+        elif filter_type == 'lt':
+            return self._compile_range(index_fieldname, None, value, True, True)
+        elif filter_type == 'lte':
+            return self._compile_range(index_fieldname, None, value, False, False)
+        
+        return None
+    
+    def _compile_value(self, value):
+        """
+        Turns a value into the text ``build_query_fragment`` would use.
+        """
+        if hasattr(value, 'strftime'):
+            return self._convert_datetime(self.backend._from_python(value))
+        
+        return force_unicode(self.backend._from_python(value))
+    
+    def _compile_text(self, field_name, text):
+        """
+        Compiles a word, or a phrase if there are spaces in it.
+        """
+        if ' ' in text:
+            if '"' in text:
+                return None
+            
+            return self._compile_phrase(field_name, text)
+        
+        if len(text) > 2 and text[0] == text[-1] == "'" and not "'" in text[1:-1]:
+            # Quoted by ``clean``, so it's taken as a single term.
+            text = text[1:-1]
+        elif not PLAIN_WORD_REGEX.match(text):
+            return None
+        
+        return self.backend.parser.term_query(field_name, text, Term)
+    
+    def _compile_phrase(self, field_name, text):
+        words = list(self.backend.schema[field_name].process_text(text, mode='query'))
+        return self.backend.parser.phraseclass(field_name, words, slop=1)
+    
+    def _compile_range(self, field_name, start, end, startexcl, endexcl):
+        for bound in (start, end):
+            if bound is not None and (not bound or RANGE_SYNTAX_REGEX.search(bound)):
+                return None
+        
+        field = self.backend.schema[field_name]
+        
+        if field.self_parsing():
+            try:
+                query = field.parse_range(field_name, start, end, startexcl, endexcl)
+            except QueryParserError:
+                return NullQuery
+            
+            if query is not None:
+                return query
+        
+        if start is not None:
+            start = get_single_text(field, start, tokenize=False, removestops=False)
+        
+        if end is not None:
+            end = get_single_text(field, end, tokenize=False, removestops=False)
+        
+        return TermRange(field_name, start, end, startexcl, endexcl)
@@ -34,8 +34,10 @@ class Command(BaseCommand):
             print "Removing all documents from your index because you said so."
         
         from haystack import backend
+        from haystack.utils import bump_generations
         sb = backend.SearchBackend()
         sb.clear()
+        bump_generations(site.get_indexed_models())
         
         if self.verbosity >= 1:
             print "All documents removed."
@@ -1,9 +1,160 @@
 import re
 import warnings
+from bisect import bisect_left, bisect_right
 from django.conf import settings
+from django.db import connection
 from haystack.backends import SQ
 from haystack.constants import REPR_OUTPUT_SIZE, ITERATOR_LOAD_PER_QUERY, DEFAULT_OPERATOR
 from haystack.exceptions import NotRegistered
+from haystack.utils import run_threaded
+
+
+class ResultCache(object):
+    """
+    A sparse cache of ``SearchResult`` objects, keyed by their offset within
+    the backend's result set.
+    
+    Results are stored in fixed-size blocks (``block number -> list``) and the
+    offsets that have been requested from the backend are tracked as a sorted
+    list of non-overlapping ``[start, end)`` ranges. This keeps memory
+    proportional to what has actually been loaded (not the hit count) and lets
+    slicing and iteration work in time proportional to the page requested.
+    
+    A range can be filled but contain fewer results than its length (i.e.
+    results for unregistered models or deleted objects were dropped). Those
+    offsets are remembered as filled so they won't be fetched again.
+    """
+    def __init__(self, block_size=ITERATOR_LOAD_PER_QUERY):
+        self.block_size = max(int(block_size), 1)
+        self.blocks = {}
+        self._starts = []
+        self._ends = []
+        self._length = 0
+    
+    def __len__(self):
+        """The number of results actually loaded."""
+        return self._length
+    
+    def __iter__(self):
+        """Iterates over all loaded results in order."""
+        block_numbers = self.blocks.keys()
+        block_numbers.sort()
+        
+        for block_number in block_numbers:
+            for result in self.blocks[block_number]:
+                if result is not None:
+                    yield result
+    
+    def filled_until(self, position):
+        """
+        Returns the end of the filled range containing ``position`` or
+        ``None`` if that position hasn't been filled.
+        """
+        offset = bisect_right(self._starts, position) - 1
+        
+        if offset >= 0 and self._ends[offset] > position:
+            return self._ends[offset]
+        
+        return None
+    
+    def missing(self, start, end):
+        """
+        Returns a list of ``(start, end)`` ranges within the provided bounds
+        that have not been filled yet.
+        """
+        gaps = []
+        offset = bisect_right(self._ends, start)
+        
+        while start < end and offset < len(self._starts) and self._starts[offset] < end:
+            if self._starts[offset] > start:
+                gaps.append((start, self._starts[offset]))
+            
+            start = self._ends[offset]
+            offset += 1
+        
+        if start < end:
+            gaps.append((start, end))
+        
+        return gaps
+    
+    def is_full(self, count):
+        """Checks if every offset up to ``count`` has been filled."""
+        if count <= 0:
+            return True
+        
+        return len(self._starts) > 0 and self._starts[0] == 0 and self._ends[0] >= count
+    
+    def add(self, start, end, results):
+        """
+        Stores ``results`` consecutively from offset ``start`` and marks the
+        whole ``[start, end)`` range as filled.
+        """
+        end = max(end, start + len(results))
+        
+        for offset in xrange(end - start):
+            if offset < len(results):
+                self._set(start + offset, results[offset])
+            else:
+                self._set(start + offset, None)
+        
+        # Merge the new range with any it overlaps or touches.
+        first = bisect_left(self._ends, start)
+        last = bisect_right(self._starts, end)
+        
+        if first < last:
+            start = min(start, self._starts[first])
+            end = max(end, self._ends[last - 1])
+        
+        self._starts[first:last] = [start]
+        self._ends[first:last] = [end]
+    
+    def get(self, position):
+        """Returns the result at ``position`` or ``None`` if there isn't one."""
+        block = self.blocks.get(position // self.block_size)
+        
+        if block is None:
+            return None
+        
+        return block[position % self.block_size]
+    
+    def results(self, start, end):
+        """Returns the loaded results between ``start`` and ``end``."""
+        results = []
+        
+        for block_number in xrange(start // self.block_size, (end - 1) // self.block_size + 1):
+            block = self.blocks.get(block_number)
+            
+            if block is None:
+                continue
+            
+            block_start = block_number * self.block_size
+            lower = max(start - block_start, 0)
+            upper = min(end - block_start, self.block_size)
+            
+            for result in block[lower:upper]:
+                if result is not None:
+                    results.append(result)
+        
+        return results
+    
+    def _set(self, position, result):
+        block_number = position // self.block_size
+        block = self.blocks.get(block_number)
+        
+        if block is None:
+            if result is None:
+                return
+            
+            block = self.blocks[block_number] = [None] * self.block_size
+        
+        offset = position % self.block_size
+        
+        if block[offset] is None and result is not None:
+            self._length += 1
+        elif block[offset] is not None and result is None:
+            self._length -= 1
+        
+        block[offset] = result
 
 
 class SearchQuerySet(object):
@@ -19,10 +170,11 @@ class SearchQuerySet(object):
             from haystack import backend
             self.query = backend.SearchQuery(site=site)
         
-        self._result_cache = []
+        self._result_cache = ResultCache()
         self._result_count = None
         self._cache_full = False
         self._load_all = False
+        self._load_all_related = ()
         self._ignored_result_count = 0
         
         if site is not None:
@@ -92,12 +244,7 @@ class SearchQuerySet(object):
         if len(self) <= 0:
             return True
         
-        try:
-            self._result_cache.index(None)
-            return False
-        except ValueError:
-            # No ``None``s found in the results. Check the length of the cache.
-            return len(self._result_cache) > 0
+        return self._result_cache.is_full(self._result_count)
     
     def _manual_iter(self):
         # If we're here, our cache isn't fully populated.
@@ -105,90 +252,149 @@ class SearchQuerySet(object):
         # Also, this can't be part of the __iter__ method due to Python's rules
         # about generator functions.
         current_position = 0
-        current_cache_max = 0
         
         while True:
-            if len(self._result_cache) > 0:
-                try:
-                    current_cache_max = self._result_cache.index(None)
-                except ValueError:
-                    current_cache_max = len(self._result_cache)
+            filled_until = self._result_cache.filled_until(current_position)
             
-            while current_position < current_cache_max:
-                yield self._result_cache[current_position]
-                current_position += 1
+            if filled_until is not None:
+                for result in self._result_cache.results(current_position, filled_until):
+                    yield result
+                
+                current_position = filled_until
+                continue
             
             if self._cache_is_full():
                 raise StopIteration
             
             # We've run out of results and haven't hit our limit.
-            # Fill more of the cache.
-            if not self._fill_cache(current_position, current_position + ITERATOR_LOAD_PER_QUERY):
+            # Fill more of the cache, stopping short of anything already loaded.
+            start, end = self._result_cache.missing(current_position, current_position + ITERATOR_LOAD_PER_QUERY)[0]
+            
+            if not self._fill_cache(start, end):
                 raise StopIteration
     
     def _fill_cache(self, start, end):
         # Tell the query where to start from and how many we'd like.
         self.query._reset()
         self.query.set_limits(start, end)
+        return self._cache_results(start, end)
+    
+    def _cache_results(self, start, end):
+        # Store the results of the query (already limited to start/end) in
+        # the cache.
         results = self.query.get_results()
         
         if len(results) == 0:
             return False
         
-        # Setup the full cache now that we know how many results there are.
-        # We need the ``None``s as placeholders to know what parts of the
-        # cache we have/haven't filled.
-        # Using ``None`` like this takes up very little memory. In testing,
-        # an array of 100,000 ``None``s consumed less than .5 Mb, which ought
-        # to be an acceptable loss for consistent and more efficient caching.
-        if len(self._result_cache) == 0:
-            self._result_cache = [None for i in xrange(self.query.get_count())]
-        
         if start is None:
             start = 0
         
-        if end is None:
+        # Don't claim offsets past the end of the results as filled.
+        if end is None or end > self.query.get_count():
             end = self.query.get_count()
         
         # Check if we wish to load all objects.
         if self._load_all:
-            original_results = []
-            models_pks = {}
-            loaded_objects = {}
-            
-            # Remember the search position for each result so we don't have to resort later.
-            for result in results:
-                original_results.append(result)
-                models_pks.setdefault(result.model, []).append(result.pk)
-            
-            # Load the objects for each model in turn.
-            for model in models_pks:
-                loaded_objects[model] = model._default_manager.in_bulk(models_pks[model])
+            to_cache = self._attach_objects(results)
+            self._ignored_result_count += len(results) - len(to_cache)
+        else:
+            to_cache = list(results)
+        
+        self._result_cache.add(start, end, to_cache)
+        return True
+    
+    def _attach_objects(self, results):
+        """
+        Loads the objects for the provided results, returning the results
+        that have one. Results whose object was deleted since being indexed
+        (or is excluded by the ``load_all_queryset``) are left out.
+        """
+        models_pks = {}
         
-        to_cache = []
+        for result in results:
+            models_pks.setdefault(result.model, []).append(result.pk)
+        
+        loaded_objects = self._load_objects(models_pks)
+        attached = []
         
         for result in results:
-            if self._load_all:
-                # We have to deal with integer keys being cast from strings
-                model_objects = loaded_objects.get(result.model, {})
-                if not result.pk in model_objects:
-                    try:
-                        result.pk = int(result.pk)
-                    except ValueError:
-                        pass
+            # We have to deal with integer keys being cast from strings
+            model_objects = loaded_objects.get(result.model, {})
+            if not result.pk in model_objects:
                 try:
-                    result._object = model_objects[result.pk]
-                except KeyError:
-                    # The object was either deleted since we indexed or should
-                    # be ignored; fail silently.
-                    self._ignored_result_count += 1
-                    continue
+                    result.pk = int(result.pk)
+                except ValueError:
+                    pass
+            try:
+                result._object = model_objects[result.pk]
+            except KeyError:
+                # The object was either deleted since we indexed or should
+                # be ignored; fail silently.
+                continue
             
-            to_cache.append(result)
+            attached.append(result)
         
-        # Assign by slice.
-        self._result_cache[start:start + len(to_cache)] = to_cache
-        return True
+        return attached
+    
+    def _load_objects(self, models_pks):
+        """
+        Loads the objects for a page of results, given a dictionary of
+        ``{model: [pk, ...]}``. Returns a dictionary of ``{model: {pk: obj}}``.
+        
+        Each model is a single query. If ``HAYSTACK_LOAD_ALL_THREADS`` is
+        greater than one, the models are loaded concurrently by up to that
+        many threads.
+        """
+        loaded_objects = {}
+        models = models_pks.keys()
+        max_threads = int(getattr(settings, 'HAYSTACK_LOAD_ALL_THREADS', 1))
+        
+        if max_threads <= 1 or len(models) <= 1:
+            for model in models:
+                loaded_objects[model] = self._load_model_objects(model, models_pks[model])
+            
+            return loaded_objects
+        
+        def load(model):
+            try:
+                return self._load_model_objects(model, models_pks[model])
+            finally:
+                # Each thread gets its own connection. Don't leak it.
+                connection.close()
+        
+        for model, objects in zip(models, run_threaded(load, models, max_threads)):
+            loaded_objects[model] = objects
+        
+        return loaded_objects
+    
+    def _load_model_objects(self, model, pks):
+        """
+        Fetches the objects for one model's share of the results, keyed by pk.
+        
+        Uses the ``load_all_queryset`` of the model's ``SearchIndex`` (falling
+        back to the default manager) plus any ``load_all_related`` lookups
+        that apply to the model.
+        """
+        try:
+            queryset = self.site.get_index(model).load_all_queryset()
+        except NotRegistered:
+            queryset = model._default_manager.all()
+        
+        lookups = self._related_lookups(model)
+        
+        if lookups:
+            queryset = queryset.select_related(*lookups)
+        
+        return queryset.in_bulk(pks)
+    
+    def _related_lookups(self, model):
+        """
+        Returns the ``load_all_related`` lookups that start with a field on
+        the provided model.
+        """
+        field_names = model._meta.get_all_field_names()
+        return [lookup for lookup in self._load_all_related if lookup.split('__')[0] in field_names]
     
     
     def __getitem__(self, k):
@@ -217,19 +423,35 @@ class SearchQuerySet(object):
             start = k
             bound = k + 1
         
-        # We need check to see if we need to populate more of the cache.
-        if len(self._result_cache) <= 0 or (None in self._result_cache[start:bound] and not self._cache_is_full()):
-            try:
-                self._fill_cache(start, bound)
-            except StopIteration:
-                # There's nothing left, even though the bound is higher.
-                pass
+        if start is None:
+            start = 0
+        
+        try:
+            if bound is None:
+                # Open-ended slices run to the end of the results. Let the
+                # first fill tell us how far that is.
+                if not self.query.has_run():
+                    self._fill_cache(start, None)
+                
+                bound = len(self) + self._ignored_result_count
+            elif self.query.has_run():
+                bound = min(bound, self.query.get_count())
+            
+            # Only fetch the parts of the range we haven't seen yet.
+            for gap_start, gap_end in self._result_cache.missing(start, bound):
+                self._fill_cache(gap_start, gap_end)
+        except StopIteration:
+            # There's nothing left, even though the bound is higher.
+            pass
         
         # Cache should be full enough for our needs.
         if is_slice:
-            return self._result_cache[start:bound]
-        else:
-            return self._result_cache[start]
+            return self._result_cache.results(start, bound)
+        
+        if self._result_cache.filled_until(start) is None:
+            raise IndexError("SearchQuerySet index out of range")
+        
+        return self._result_cache.get(start)
     
     
     # Methods that return a SearchQuerySet.
@@ -336,6 +558,18 @@ class SearchQuerySet(object):
         clone._load_all = True
         return clone
     
+    def load_all_related(self, *lookups):
+        """
+        Like ``load_all``, but also follows the provided relations (using
+        ``select_related``) when loading the objects.
+        
+        Lookups are applied to each model in the results that has a field
+        matching the first part of the lookup.
+        """
+        clone = self.load_all()
+        clone._load_all_related = tuple(self._load_all_related) + lookups
+        return clone
+    
     def auto_query(self, query_string):
         """
         Performs a best guess constructing the search query.
@@ -381,6 +615,23 @@ class SearchQuerySet(object):
     
     # Methods that do not return a SearchQuerySet.
     
+    def iterator(self, chunk_size=100):
+        """
+        Iterates over all of the results without caching them.
+        
+        Results are fetched from the backend ``chunk_size`` at a time and
+        dropped once yielded, so walking a large result set takes constant
+        memory.
+        """
+        query = self.query._clone()
+        
+        for chunk in query.iter_results(chunk_size=chunk_size):
+            if self._load_all:
+                chunk = self._attach_objects(chunk)
+            
+            for result in chunk:
+                yield result
+    
     def count(self):
         """Returns the total number of matching results."""
         return len(self)
@@ -409,6 +660,10 @@ class SearchQuerySet(object):
         This will cause the query to execute and should generally be used when
         presenting the data.
         """
+        if self.query.has_run():
+            # Already have the counts from the last page fetched.
+            return self.query.get_facet_counts()
+        
         clone = self._clone()
         return clone.query.get_facet_counts()
     
@@ -435,6 +690,7 @@ class SearchQuerySet(object):
         query = self.query._clone()
         clone = klass(site=self.site, query=query)
         clone._load_all = self._load_all
+        clone._load_all_related = self._load_all_related
         return clone
 
 
@@ -452,11 +708,17 @@ class EmptySearchQuerySet(SearchQuerySet):
     
     def _clone(self, klass=None):
         clone = super(EmptySearchQuerySet, self)._clone(klass=klass)
-        clone._result_cache = []
+        clone._result_cache = ResultCache()
         return clone
     
     def _fill_cache(self, start, end):
         return False
+    
+    def _cache_results(self, start, end):
+        return False
+    
+    def iterator(self, chunk_size=100):
+        return iter([])
 
     def facet_counts(self):
         return {}
@@ -473,6 +735,12 @@ class RelatedSearchQuerySet(SearchQuerySet):
     _load_all_querysets = {}
     _result_cache = []
     
+    def __init__(self, site=None, query=None):
+        super(RelatedSearchQuerySet, self).__init__(site=site, query=query)
+        # Results are appended in order as they're loaded, so a plain list
+        # is all that's needed here.
+        self._result_cache = []
+    
     def _cache_is_full(self):
         return len(self._result_cache) >= len(self)
     
@@ -505,6 +773,11 @@ class RelatedSearchQuerySet(SearchQuerySet):
         # Tell the query where to start from and how many we'd like.
         self.query._reset()
         self.query.set_limits(start, end)
+        return self._cache_results(start, end)
+    
+    def _cache_results(self, start, end):
+        # Store the results of the query (already limited to start/end) in
+        # the cache.
         results = self.query.get_results()
         
         if len(results) == 0:
@@ -518,31 +791,12 @@ class RelatedSearchQuerySet(SearchQuerySet):
         
         # Check if we wish to load all objects.
         if self._load_all:
-            original_results = []
             models_pks = {}
-            loaded_objects = {}
             
-            # Remember the search position for each result so we don't have to resort later.
             for result in results:
-                original_results.append(result)
                 models_pks.setdefault(result.model, []).append(result.pk)
             
-            # Load the objects for each model in turn.
-            for model in models_pks:
-                if model in self._load_all_querysets:
-                    # Use the overriding queryset.
-                    loaded_objects[model] = self._load_all_querysets[model].in_bulk(models_pks[model])
-                else:
-                    # Check the SearchIndex for the model for an override.
-                    try:
-                        index = self.site.get_index(model)
-                        qs = index.load_all_queryset()
-                        loaded_objects[model] = qs.in_bulk(models_pks[model])
-                    except NotRegistered:
-                        # The model returned doesn't seem to be registered with
-                        # the current site. We should silently fail and populate
-                        # nothing for those objects.
-                        loaded_objects[model] = []
+            loaded_objects = self._load_objects(models_pks)
         
         if len(results) + len(self._result_cache) < len(self) and len(results) < ITERATOR_LOAD_PER_QUERY:
             self._ignored_result_count += ITERATOR_LOAD_PER_QUERY - len(results)
@@ -609,6 +863,27 @@ class RelatedSearchQuerySet(SearchQuerySet):
         else:
             return self._result_cache[start]
     
+    def _load_model_objects(self, model, pks):
+        if model in self._load_all_querysets:
+            # Use the overriding queryset.
+            queryset = self._load_all_querysets[model]
+            lookups = self._related_lookups(model)
+            
+            if lookups:
+                queryset = queryset.select_related(*lookups)
+            
+            return queryset.in_bulk(pks)
+        
+        try:
+            self.site.get_index(model)
+        except NotRegistered:
+            # The model returned doesn't seem to be registered with the
+            # current site. We should silently fail and populate nothing for
+            # those objects.
+            return {}
+        
+        return super(RelatedSearchQuerySet, self)._load_model_objects(model, pks)
+    
     def load_all_queryset(self, model, queryset):
         """
         Allows for specifying a custom ``QuerySet`` that changes how ``load_all``
@@ -628,5 +903,44 @@ class RelatedSearchQuerySet(SearchQuerySet):
         query = self.query._clone()
         clone = klass(site=self.site, query=query)
         clone._load_all = self._load_all
+        clone._load_all_related = self._load_all_related
         clone._load_all_querysets = self._load_all_querysets
         return clone
+
+
+def multi_search(querysets, start=0, end=ITERATOR_LOAD_PER_QUERY):
+    """
+    Runs a batch of independent ``SearchQuerySet`` objects together, filling
+    each one's cache with its results from ``start`` to ``end`` (along with
+    the hit count, facets & spelling suggestion).
+    
+    The queries are handed to their backend's ``run_batch`` in one go, which
+    lets the backend run them concurrently (Solr) or share a searcher
+    (Whoosh). Returns the list of ``SearchQuerySet`` objects.
+    """
+    querysets = list(querysets)
+    batches = {}
+    batch_order = []
+    
+    for sqs in querysets:
+        if isinstance(sqs, EmptySearchQuerySet):
+            continue
+        
+        sqs.query._reset()
+        sqs.query.set_limits(start, end)
+        key = (sqs.query.backend.__class__, id(sqs.query.backend.site))
+        
+        if not key in batches:
+            batches[key] = []
+            batch_order.append(key)
+        
+        batches[key].append(sqs.query)
+    
+    for key in batch_order:
+        queries = batches[key]
+        queries[0].backend.run_batch(queries)
+    
+    for sqs in querysets:
+        sqs._cache_results(start, end)
+    
+    return querysets